@@ -1,6 +1,7 @@
 """Gunicorn basic configuration."""
 
 import os
+import shutil
 
 bind = os.getenv('GUNICORN_BIND', '0.0.0.0:80')
 
@@ -8,3 +9,19 @@ bind = os.getenv('GUNICORN_BIND', '0.0.0.0:80')
 DEFAULT_NUM_WORKERS = 2 * os.cpu_count() + 1
 workers = int(os.getenv('GUNICORN_WORKERS', DEFAULT_NUM_WORKERS))
 worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'uvicorn.workers.UvicornWorker')
+
+# the workers keep the metrics in the shared directory, /metrics aggregates them
+METRICS_DIR = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/urlshrtr-metrics')
+
+
+def on_starting(server):
+    """Clear the metrics of the previous run."""
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_DIR)
+
+
+def child_exit(server, worker):
+    """Drop the live gauges of the exited worker."""
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,12 +1,42 @@
 """Shared pytest fixtures."""
 
-from unittest.mock import patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
+from urlshrtr.cache import UrlCache
+
 
 @pytest.fixture()
 def mock_redis_client():
     """Redis client mock."""
-    with patch('urlshrtr.model.redis_client') as redis_mock:
+    with patch(
+        'urlshrtr.redis_connector.redis_client', new_callable=AsyncMock
+    ) as redis_mock:
         yield redis_mock
+
+
+@pytest.fixture()
+def url_cache():
+    """An enabled in-process URL cache used by the model layer."""
+    cache = UrlCache(maxsize=10, ttl=60)
+    with patch('urlshrtr.model.url_cache', cache):
+        yield cache
+
+
+@pytest.fixture()
+def mock_redis_pipeline(mock_redis_client):
+    """Redis pipeline mock, the commands are queued synchronously."""
+    pipeline_mock = MagicMock(execute=AsyncMock())
+    pipeline_mock.ts = MagicMock(return_value=MagicMock())
+    mock_redis_client.pipeline = MagicMock(return_value=pipeline_mock)
+    yield pipeline_mock
+
+
+@pytest.fixture()
+def mock_id_allocator():
+    """Short url ID allocator mock used by the storage backends."""
+    allocator_mock = MagicMock(allocate=AsyncMock())
+    with patch('urlshrtr.model.id_allocator', allocator_mock):
+        with patch('urlshrtr.embedded.id_allocator', allocator_mock):
+            yield allocator_mock
@@ -3,3 +3,4 @@ FULL_URL = 'http://example.com/a+b'
 FULL_URL_BYTES = FULL_URL.encode()
 URL_ID = 'abc123'
 FROZEN_TIME = '2020-01-01T00:00:00'
+FROZEN_TS = 1577836800000  # FROZEN_TIME in msec
@@ -0,0 +1,103 @@
+"""Test the short url ID allocators."""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from freezegun import freeze_time
+from nanoid.resources import alphabet
+
+from tests.constants import FROZEN_TIME, URL_ID
+from urlshrtr import allocator
+from urlshrtr.config import settings
+
+
+@pytest.mark.parametrize(
+    'number,expected', [(0, '0'), (61, 'Z'), (62, '10'), (62**2 + 1, '101')]
+)
+def test_encode_base62(number, expected):
+    """Test encode_base62 success."""
+    assert allocator.encode_base62(number) == expected
+
+
+def test_base_allocator_abstract():
+    """Test the base allocator can't be made without the _allocate method."""
+    with pytest.raises(TypeError):
+        allocator.IdAllocator()
+
+
+@pytest.mark.asyncio
+@patch('urlshrtr.allocator.nanoid.generate')
+async def test_random_allocator(nanoid_mock):
+    """Test the random allocator generates nanoid IDs."""
+    nanoid_mock.return_value = URL_ID
+    id_allocator = allocator.RandomIdAllocator()
+    assert await id_allocator.allocate(2) == [URL_ID, URL_ID]
+    nanoid_mock.assert_called_with(alphabet, settings.url_key_length)
+
+
+@pytest.mark.asyncio
+async def test_counter_allocator():
+    """Test the counter allocator leases a new block if the current one is short."""
+    client_mock = MagicMock(incrby=AsyncMock(side_effect=[2, 4]))
+    id_allocator = allocator.CounterIdAllocator('counter', 2, client_mock)
+    url_ids = await id_allocator.allocate(1) + await id_allocator.allocate(2)
+    offset = 62 ** (settings.url_key_length - 1)
+    assert url_ids == [allocator.encode_base62(offset + i) for i in (0, 2, 3)]
+    assert len(url_ids[0]) == settings.url_key_length
+    assert client_mock.incrby.await_count == 2
+    client_mock.incrby.assert_awaited_with('counter', 2)
+
+
+@pytest.mark.asyncio
+@freeze_time(FROZEN_TIME)
+async def test_snowflake_allocator():
+    """Test the snowflake allocator generates unique IDs within one ms."""
+    id_allocator = allocator.SnowflakeIdAllocator(worker_id=1)
+    url_ids = await id_allocator.allocate(3)
+    assert len(set(url_ids)) == 3
+    other_ids = await allocator.SnowflakeIdAllocator(worker_id=2).allocate(3)
+    assert not set(url_ids) & set(other_ids)
+
+
+@pytest.mark.asyncio
+@patch.object(allocator, 'SNOWFLAKE_SEQUENCE_BITS', 1)
+@patch('urlshrtr.allocator.time.time', return_value=1700000000.0)
+async def test_snowflake_allocator_sequence_wrap(time_mock):
+    """Test the concurrent allocations waiting for the next ms get unique IDs."""
+    id_allocator = allocator.SnowflakeIdAllocator(worker_id=1)
+    batches = await asyncio.gather(*(id_allocator.allocate(3) for _ in range(4)))
+    url_ids = [url_id for batch in batches for url_id in batch]
+    assert len(set(url_ids)) == 12
+
+
+@pytest.mark.asyncio
+async def test_allocator_stats():
+    """Test the allocations and collisions are counted."""
+    id_allocator = allocator.SnowflakeIdAllocator(worker_id=1)
+    await id_allocator.allocate(4)
+    id_allocator.record_collision()
+    stats = id_allocator.stats()
+    assert stats['allocations'] == 4
+    assert stats['collisions'] == 1
+    assert stats['collision_rate'] == 0.25
+    assert stats['allocations_per_sec'] > 0
+
+
+@pytest.mark.parametrize(
+    'name,expected_class',
+    [
+        ('random', allocator.RandomIdAllocator),
+        ('counter', allocator.CounterIdAllocator),
+        ('snowflake', allocator.SnowflakeIdAllocator),
+    ],
+)
+def test_make_allocator(name, expected_class):
+    """Test make_allocator returns the configured allocator."""
+    assert isinstance(allocator.make_allocator(name), expected_class)
+
+
+def test_make_allocator_unknown():
+    """Test make_allocator rejects the unknown allocator name."""
+    with pytest.raises(ValueError):
+        allocator.make_allocator('uuid')
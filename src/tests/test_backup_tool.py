@@ -0,0 +1,110 @@
+"""Test the bulk export and import tool."""
+
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+from urllib import parse
+
+import pytest
+
+from urlshrtr import backup_tool
+from urlshrtr.compact import UrlCodec
+from urlshrtr.config import settings
+
+LINKS = [
+    dict(id='id1', url='https://example.org/a+b', labels={}, stats=[[1000, 2]]),
+    dict(id='id2', url='https://example.net', expires_at=2000000000),
+    dict(id='id3', url='https://example.com/ü'),
+]
+
+
+def _scan(keys):
+    """Make a scan_iter mock yielding the keys."""
+
+    async def scan_iter(**kwargs):
+        for key in keys:
+            yield key
+
+    return MagicMock(side_effect=scan_iter)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('file_name', ['links.ndjson', 'links.ndjson.gz'])
+async def test_export_links(
+    tmp_path, mock_redis_client, mock_redis_pipeline, file_name
+):
+    """Test the links and their stats are dumped as NDJSON with the raw URLs."""
+    path = str(tmp_path / file_name)
+    mock_redis_client.scan_iter = _scan([b'id1', b'id1:stats', b'id2', b'id3', b'id4'])
+    mock_redis_pipeline.execute.side_effect = [
+        [[b'https%3A%2F%2Fexample.org%2Fa%2Bb', b'https://example.net'], -1, 100],
+        [['https://example.com/ü'.encode(), None], -1, -2],
+    ]
+    dump_stats = AsyncMock(side_effect=[{'id1': ({}, [(1000, 2)])}, {}])
+    with patch('urlshrtr.backup_tool.model.dump_stats', dump_stats):
+        with patch('time.time', return_value=1999999900):
+            count = await backup_tool.export_links(
+                [mock_redis_client], UrlCodec(compact=False), path, batch=3
+            )
+    assert count == 3
+    with backup_tool._open(path, 'r') as dump_file:
+        assert [json.loads(line) for line in dump_file] == LINKS
+    dump_stats.assert_awaited_with(mock_redis_client, ['id3'])
+
+
+@pytest.mark.asyncio
+@patch.object(settings, 'url_layout', 'compact')
+async def test_export_links_compact(tmp_path, mock_redis_client, mock_redis_pipeline):
+    """Test the compact records are dumped with their expiry times."""
+    path = str(tmp_path / 'links.ndjson')
+    codec = UrlCodec(compact=True)
+    mock_redis_client.scan_iter = _scan([b'urlshrtr:u:1'])
+    mock_redis_pipeline.execute.return_value = [
+        {
+            b'id2': codec.encode(LINKS[1]['url'], LINKS[1]['expires_at']),
+            b'id3': codec.encode(LINKS[2]['url']),
+            b'id4': codec.encode(LINKS[2]['url'], 1000),
+        }
+    ]
+    assert (
+        await backup_tool.export_links(
+            [mock_redis_client], codec, path, batch=10, stats=False
+        )
+        == 2
+    )
+    with open(path) as dump_file:
+        assert [json.loads(line) for line in dump_file] == LINKS[1:]
+
+
+@pytest.mark.asyncio
+async def test_import_links(tmp_path):
+    """Test the links are restored in concurrent batches from the checkpoint.
+
+    The percent-encoded URLs of the version 1 dumps are restored as raw ones.
+    """
+    path = str(tmp_path / 'links.ndjson')
+    with open(path, 'w') as dump_file:
+        dump_file.writelines(
+            json.dumps(dict(link, url=parse.quote_plus(link['url']))) + '\n'
+            for link in LINKS
+        )
+    with open(f'{path}.checkpoint', 'w') as checkpoint_file:
+        checkpoint_file.write('1')
+    restore = AsyncMock(side_effect=[1, 0])
+    with patch('urlshrtr.backup_tool.model.restore_short_urls', restore):
+        assert await backup_tool.import_links(path, batch=1, concurrency=4) == 1
+    assert [args[0] for args, _ in restore.await_args_list] == [[LINKS[1]], [LINKS[2]]]
+    assert not (tmp_path / 'links.ndjson.checkpoint').exists()
+
+
+@pytest.mark.asyncio
+async def test_import_links_checkpoint(tmp_path):
+    """Test the checkpoint is kept when the import fails."""
+    path = str(tmp_path / 'links.ndjson')
+    with open(path, 'w') as dump_file:
+        dump_file.writelines(json.dumps(link) + '\n' for link in LINKS)
+    restore = AsyncMock(side_effect=[2, ConnectionError()])
+    with patch('urlshrtr.backup_tool.model.restore_short_urls', restore):
+        with pytest.raises(ConnectionError):
+            await backup_tool.import_links(path, batch=2, concurrency=1)
+    with open(f'{path}.checkpoint') as checkpoint_file:
+        assert checkpoint_file.read() == '2'
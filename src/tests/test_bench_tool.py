@@ -0,0 +1,106 @@
+"""Test the benchmark tool."""
+
+import random
+from collections import Counter
+from unittest.mock import patch
+
+import pytest
+
+from urlshrtr import bench_tool
+from urlshrtr.app import app
+from urlshrtr.config import settings
+from urlshrtr.embedded import EmbeddedStorage
+from urlshrtr.fastpath import RedirectFastPath
+from urlshrtr.metrics import MetricsMiddleware
+
+
+def test_zipf_sampler():
+    """Test the first items are sampled the most, the uniform sampler is flat."""
+    items = [f'id{i}' for i in range(100)]
+    counts = Counter(bench_tool.zipf_sampler(items, 1.2, random.Random(1))(10000))
+    assert counts.most_common(1)[0][0] == 'id0'
+    assert counts['id0'] > 10 * counts['id50']
+    uniform = Counter(bench_tool.zipf_sampler(items, 0, random.Random(1))(10000))
+    assert uniform['id0'] < 200
+
+
+def test_compare():
+    """Test the regressions over the threshold are reported by the metric."""
+    baseline = dict(
+        results=dict(
+            redirect=dict(p99_ms=1.0, throughput=1000, redis_commands_per_request=2),
+            quote_url=dict(us_per_op=1.0),
+        )
+    )
+    results = dict(
+        results=dict(
+            redirect=dict(p99_ms=1.1, throughput=700, redis_commands_per_request=3),
+            quote_url=dict(us_per_op=0.5),
+            create=dict(p99_ms=5.0),
+        )
+    )
+    assert bench_tool.compare(baseline, results, 0.2) == [
+        'redirect throughput: 1000.000 -> 700.000 (-30.0%)',
+        'redirect redis_commands_per_request: 2.000 -> 3.000 (+50.0%)',
+    ]
+    assert bench_tool.compare(baseline, baseline, 0.0) == []
+
+
+@pytest.mark.asyncio
+@patch.object(settings, 'storage_backend', 'embedded')
+async def test_run_load():
+    """Test every scenario runs against the app with the embedded backend."""
+    with patch('urlshrtr.storage.backend', EmbeddedStorage()):
+        results = await bench_tool.run_load(
+            app, requests=20, concurrency=4, links=50, exponent=1.1, seed=1
+        )
+    assert set(results) == {
+        'redirect',
+        'create',
+        'batch_create',
+        'resolve',
+        'stats',
+        'batch_stats',
+    }
+    for result in results.values():
+        assert result['requests'] == 20
+        assert result['errors'] == 0
+        assert result['p50_ms'] <= result['p99_ms']
+        assert result['redis_commands_per_request'] is None
+
+
+@pytest.mark.asyncio
+async def test_run_micro():
+    """Test the micro benchmarks time every operation."""
+    results = await bench_tool.run_micro(10)
+    assert 'snowflake_id' in results
+    assert all(result['us_per_op'] > 0 for result in results.values())
+
+
+@pytest.mark.asyncio
+@patch.object(settings, 'storage_backend', 'embedded')
+async def test_run_redirect():
+    """Test the redirects are run through the route and the fast path."""
+    with patch('urlshrtr.storage.backend', EmbeddedStorage()):
+        results = await bench_tool.run_redirect(
+            app, requests=20, concurrency=4, links=50, exponent=1.1, seed=1
+        )
+    assert set(results) == {'route', 'fast_path'}
+    assert all(result['errors'] == 0 for result in results.values())
+
+
+def test_with_fast_path():
+    """Test both the redirect variants run through the metrics middleware."""
+
+    def middleware_classes(handler):
+        stack, layer = [], handler.middleware_stack
+        while hasattr(layer, 'app'):
+            stack.append(type(layer))
+            layer = layer.app
+        return stack
+
+    route = middleware_classes(bench_tool.with_fast_path(app, False))
+    fast_path = middleware_classes(bench_tool.with_fast_path(app, True))
+    assert MetricsMiddleware in route and RedirectFastPath not in route
+    assert fast_path.index(MetricsMiddleware) < fast_path.index(RedirectFastPath)
+    assert [cls for cls in fast_path if cls is not RedirectFastPath] == route
@@ -0,0 +1,60 @@
+"""Test the in-process URL cache."""
+
+import pytest
+from freezegun import freeze_time
+
+from tests.constants import FROZEN_TIME, FULL_URL, URL_ID
+from urlshrtr.cache import UrlCache
+
+
+def test_cache_get_set():
+    """Test the cached URL is returned and counted as a hit."""
+    cache = UrlCache(maxsize=2, ttl=60)
+    assert cache.get(URL_ID) is None
+    cache.set(URL_ID, FULL_URL)
+    assert cache.get(URL_ID) == FULL_URL
+    assert cache.stats() == dict(hits=1, misses=1, evictions=0, size=1)
+
+
+def test_cache_expired():
+    """Test the expired URL is removed from the cache."""
+    cache = UrlCache(maxsize=2, ttl=60)
+    with freeze_time(FROZEN_TIME) as frozen_time:
+        cache.set(URL_ID, FULL_URL)
+        frozen_time.tick(61)
+        assert cache.get(URL_ID) is None
+    assert cache.stats() == dict(hits=0, misses=1, evictions=0, size=0)
+
+
+@pytest.mark.parametrize('policy,evicted', [('lru', 'b'), ('fifo', 'a')])
+def test_cache_eviction(policy, evicted):
+    """Test the records over the maxsize are evicted according to the policy."""
+    cache = UrlCache(maxsize=2, ttl=60, policy=policy)
+    cache.set('a', FULL_URL)
+    cache.set('b', FULL_URL)
+    cache.get('a')
+    cache.set('c', FULL_URL)
+    assert cache.get(evicted) is None
+    assert cache.evictions == 1
+
+
+def test_cache_invalidate():
+    """Test the invalidated URL is removed from the cache."""
+    cache = UrlCache(maxsize=2, ttl=60)
+    cache.set(URL_ID, FULL_URL)
+    cache.invalidate(URL_ID)
+    assert cache.get(URL_ID) is None
+
+
+def test_cache_disabled():
+    """Test the cache with zero maxsize doesn't store anything."""
+    cache = UrlCache(maxsize=0, ttl=60)
+    cache.set(URL_ID, FULL_URL)
+    assert cache.get(URL_ID) is None
+    assert cache.stats() == dict(hits=0, misses=0, evictions=0, size=0)
+
+
+def test_cache_unknown_policy():
+    """Test the unknown eviction policy is rejected."""
+    with pytest.raises(ValueError):
+        UrlCache(maxsize=2, ttl=60, policy='random')
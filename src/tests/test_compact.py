@@ -0,0 +1,118 @@
+"""Test the compact ShortURL records layout."""
+
+from unittest.mock import patch
+from urllib import parse
+
+import pytest
+from freezegun import freeze_time
+
+from tests.constants import FROZEN_TIME, FROZEN_TS
+from urlshrtr import compact, compact_tool
+from urlshrtr.config import settings
+
+LONG_URL = 'https://www.example.com/products/shoes?utm_source=news&utm_medium=email'
+
+
+def test_codec_default_layout():
+    """Test the URLs are stored as is, or percent-encoded in the version 1."""
+    codec = compact.UrlCodec(compact=False)
+    url = 'https://example.com/a+b%2B c?ü=1'
+    quoted = parse.quote_plus(url)
+    assert codec.encode(url) == url
+    assert codec.decode(url.encode()) == url
+    assert codec.decode(quoted.encode()) == url
+    assert compact.UrlCodec(compact=False, raw=False).encode(url) == quoted
+
+
+def test_codec_is_legacy():
+    """Test the version 1 values of the string layout are migrated."""
+    quoted = parse.quote_plus(LONG_URL).encode()
+    assert compact.UrlCodec(compact=False).is_legacy(quoted)
+    assert not compact.UrlCodec(compact=False).is_legacy(LONG_URL.encode())
+    assert not compact.UrlCodec(compact=False, raw=False).is_legacy(quoted)
+    assert not compact.UrlCodec(compact=True).is_legacy(b'example')
+
+
+@pytest.mark.parametrize('url', ['https://example.com/ü', LONG_URL])
+def test_codec_compact(url):
+    """Test the URLs are stored as raw UTF-8, the long ones are deflated."""
+    codec = compact.UrlCodec(compact=True, compression=True, min_length=64)
+    value = codec.encode(url)
+    if len(url) < 64:
+        assert value == url.encode()
+    else:
+        assert value.startswith(compact.DEFLATED)
+        assert len(value) < len(url)
+    assert codec.decode(value) == url
+
+
+@freeze_time(FROZEN_TIME)
+def test_codec_expiry():
+    """Test the expiring compact records are decoded as missing once expired."""
+    codec = compact.UrlCodec(compact=True, compression=True, min_length=0)
+    now = FROZEN_TS // 1000
+    assert codec.decode(codec.encode(LONG_URL, now + 1)) == LONG_URL
+    assert codec.decode(codec.encode(LONG_URL, now)) is None
+    assert compact.UrlCodec(compact=False).encode(LONG_URL, now) == LONG_URL
+    assert not compact.is_expired(codec.encode(LONG_URL, now + 1))
+    assert compact.is_expired(codec.encode(LONG_URL, now))
+    assert not compact.is_expired(codec.encode(LONG_URL))
+
+
+def test_codec_another_dictionary():
+    """Test a value deflated with another dictionary is not decoded."""
+    value = compact.UrlCodec(compact=True, compression=True).encode(LONG_URL)
+    codec = compact.UrlCodec(compact=True, dictionary=b'utm_source=')
+    with pytest.raises(ValueError):
+        codec.decode(value)
+
+
+def test_url_record():
+    """Test the compact records are spread over the hash buckets."""
+    assert compact.url_record('abc123', 'abc123') == ('abc123', '')
+    with patch.object(settings, 'url_layout', 'compact'):
+        with patch.object(settings, 'url_buckets', 4):
+            records = [compact.url_record(f'id{i}', f'id{i}') for i in range(100)]
+    assert {key for key, _ in records} == {
+        f'{settings.url_bucket_prefix}{bucket}' for bucket in range(4)
+    }
+    assert [field for _, field in records] == [f'id{i}' for i in range(100)]
+
+
+def test_train_dictionary():
+    """Test the dictionary keeps the most valuable repeated fragments last."""
+    urls = [f'https://www.example.com/item?utm_source=mail&id={i}' for i in range(50)]
+    dictionary = compact.train_dictionary(urls, size=24)
+    assert len(dictionary) <= 24
+    assert dictionary.endswith(b'utm_source=')
+    assert b'id=' not in dictionary
+    codec = compact.UrlCodec(
+        compact=True, compression=True, min_length=0, dictionary=dictionary
+    )
+    assert len(codec.encode(urls[0])) < len(urls[0])
+
+
+@pytest.mark.asyncio
+@freeze_time(FROZEN_TIME)
+@patch.object(settings, 'url_layout', 'compact')
+async def test_move_records(mock_redis_client, mock_redis_pipeline):
+    """Test the migrated records keep their expiry, the deleted ones are skipped."""
+    codec = compact.UrlCodec(compact=True)
+    now = FROZEN_TS // 1000
+    mock_redis_pipeline.execute.side_effect = [
+        [b'https://a', -1, b'https://b', 60000, None, -2],
+        [1, 1],
+    ]
+    records = [(b'id1', 'id1'), (b'id2', 'id2'), (b'id3', 'id3')]
+    with patch.object(compact_tool, 'move_record') as move_mock:
+        assert await compact_tool._move_records(mock_redis_client, codec, records) == 2
+    assert [c.args[1:] for c in move_mock.queue.call_args_list] == [
+        (
+            [b'id1', compact.url_record('id1', 'id1')[0], settings.url_expiry_key],
+            ['id1', b'https://a', codec.encode('https://a'), 0],
+        ),
+        (
+            [b'id2', compact.url_record('id2', 'id2')[0], settings.url_expiry_key],
+            ['id2', b'https://b', codec.encode('https://b', now + 60), now + 60],
+        ),
+    ]
@@ -0,0 +1,202 @@
+"""Test the embedded storage engine."""
+
+import json
+from unittest.mock import patch
+from urllib import parse
+
+import pytest
+from freezegun import freeze_time
+
+from tests.constants import FROZEN_TIME, FROZEN_TS, FULL_URL
+from urlshrtr.config import settings
+from urlshrtr.embedded import EmbeddedStorage
+
+
+@pytest.mark.asyncio
+@freeze_time(FROZEN_TIME)
+async def test_embedded_storage(mock_id_allocator):
+    """Test the records are created, read, updated and deleted."""
+    mock_id_allocator.allocate.side_effect = [['id1', 'id2'], ['id1'], ['id3']]
+    storage = EmbeddedStorage()
+    assert await storage.create_short_urls([FULL_URL] * 2, {'owner': 'me'}) == [
+        'id1',
+        'id2',
+    ]
+    assert await storage.create_short_url(FULL_URL) == 'id3'
+    mock_id_allocator.record_collision.assert_any_call(1)
+    assert await storage.get_short_url('id1') == FULL_URL
+    assert await storage.get_short_urls(['id2', 'missing'], count_views=True) == [
+        FULL_URL,
+        None,
+    ]
+    await storage.update_view_counts([{('id3', FROZEN_TS): 5}])
+    assert await storage.get_view_count('id1') == 1
+    assert await storage.get_view_counts(labels={'owner': 'me'}) == {
+        'id1': 1,
+        'id2': 1,
+    }
+    assert await storage.get_view_counts(['id3', 'missing'], {'owner': 'me'}) == {
+        'id3': 0
+    }
+    assert await storage.update_short_url('new', 'id1') == 'id1'
+    assert await storage.get_short_url('id1') == 'new'
+    assert await storage.delete_short_url('id1') == 'id1'
+    assert await storage.get_short_url('id1') is None
+    assert await storage.get_view_count('id1') is None
+    assert await storage.update_short_url('new', 'id1') is None
+    assert await storage.delete_short_url('id1') is None
+
+
+@pytest.mark.asyncio
+@patch.object(settings, 'url_dedup', True)
+async def test_embedded_storage_dedup(mock_id_allocator):
+    """Test the known URLs with the same labels reuse the existing IDs."""
+    mock_id_allocator.allocate.side_effect = [['id1'], ['id2'], ['id3']]
+    storage = EmbeddedStorage()
+    assert await storage.create_short_urls([FULL_URL] * 2) == ['id1', 'id1']
+    assert await storage.create_short_url(FULL_URL, {'owner': 'me'}) == 'id2'
+    assert await storage.create_short_url(FULL_URL) == 'id1'
+    await storage.update_short_url('new', 'id1')
+    assert await storage.create_short_url('new') == 'id1'
+    await storage.delete_short_url('id1')
+    assert await storage.create_short_url('new') == 'id3'
+
+
+@pytest.mark.asyncio
+async def test_embedded_storage_expiry(mock_id_allocator):
+    """Test the expired links are read as missing and purged."""
+    mock_id_allocator.allocate.side_effect = [['id1', 'id2']]
+    storage = EmbeddedStorage()
+    with freeze_time(FROZEN_TIME):
+        now = FROZEN_TS // 1000
+        await storage.create_short_urls([FULL_URL] * 2, expires_at=now + 10)
+        await storage.update_short_url('new', 'id2', expires_at=now + 20)
+        assert await storage.purge_expired() == 0
+    with freeze_time(FROZEN_TIME) as frozen_time:
+        frozen_time.tick(10)
+        assert await storage.get_short_urls(['id1', 'id2']) == [None, 'new']
+        assert await storage.get_view_count('id1') is None
+        assert await storage.purge_expired() == 1
+        assert 'id1' not in storage._urls
+
+
+@pytest.mark.asyncio
+@freeze_time(FROZEN_TIME)
+async def test_embedded_storage_recovery(mock_id_allocator, tmp_path):
+    """Test the state is restored from the snapshot and the log."""
+    mock_id_allocator.allocate.side_effect = [['id1'], ['id2'], ['id3']]
+    paths = dict(log_path=tmp_path / 'log', snapshot_path=tmp_path / 'snapshot')
+    storage = EmbeddedStorage(**paths, snapshot_every=3)
+    await storage.start()
+    await storage.create_short_url(FULL_URL)
+    await storage.get_short_url('id1')  # the views aren't counted as the writes
+    await storage.create_short_url(FULL_URL)
+    await storage.create_short_url(FULL_URL)  # the third write makes a snapshot
+    await storage.delete_short_url('id2')
+    await storage._snapshot_task
+    assert json.loads((tmp_path / 'snapshot').read_text())['urls'] == {
+        'id1': FULL_URL,
+        'id2': FULL_URL,
+        'id3': FULL_URL,
+    }
+    assert (tmp_path / 'log').read_text().splitlines() == [
+        json.dumps(['generation', 2]),
+        json.dumps(['delete', 'id2']),
+    ]
+
+    restored = EmbeddedStorage(**paths)
+    await restored.start()
+    assert await restored.get_short_urls(['id1', 'id2', 'id3']) == [
+        FULL_URL,
+        None,
+        FULL_URL,
+    ]
+    assert await restored.get_view_count('id1') == 1
+    await restored.stop()
+    assert (tmp_path / 'log').read_text() == json.dumps(['generation', 4]) + '\n'
+
+
+@pytest.mark.asyncio
+@freeze_time(FROZEN_TIME)
+async def test_embedded_storage_views_log(mock_id_allocator, tmp_path):
+    """Test the views are logged in batches and don't make the snapshots."""
+    mock_id_allocator.allocate.side_effect = [['id1']]
+    log_path = tmp_path / 'log'
+    storage = EmbeddedStorage(log_path, tmp_path / 'snapshot', snapshot_every=2)
+    await storage.start()
+    await storage.create_short_url(FULL_URL)
+    for _ in range(3):
+        await storage.get_short_url('id1')
+    await storage.get_short_urls(['id1', 'missing'], count_views=True)
+    assert storage._snapshot_task is None
+    assert len(log_path.read_text().splitlines()) == 2
+    assert await storage.flush_views() == 1
+    assert log_path.read_text().splitlines()[-1] == json.dumps(
+        ['views', 'id1', FROZEN_TS, 4]
+    )
+    assert await storage.flush_views() == 0
+    await storage.stop()
+
+
+@pytest.mark.asyncio
+async def test_embedded_storage_untruncated_log(tmp_path):
+    """Test the log left over by a crash right after the snapshot is replayed."""
+    log = json.dumps(['generation', 1]) + '\n' + json.dumps(['set', 'id1', 'a', {}])
+    (tmp_path / 'snapshot').write_text(
+        json.dumps(
+            dict(
+                generation=2,
+                log_offset=len(log) + 1,
+                urls={'id1': 'a'},
+                labels={'id1': {}},
+                views={'id1': []},
+            )
+        )
+    )
+    (tmp_path / 'log').write_text(log + '\n' + json.dumps(['set', 'id2', 'b', {}]))
+    storage = EmbeddedStorage(tmp_path / 'log', tmp_path / 'snapshot')
+    await storage.start()
+    assert await storage.get_short_urls(['id1', 'id2']) == ['a', 'b']
+    await storage.stop()
+
+
+@pytest.mark.asyncio
+async def test_embedded_storage_stale_log(tmp_path):
+    """Test the log of an older snapshot generation is skipped."""
+    (tmp_path / 'snapshot').write_text(
+        json.dumps(dict(generation=2, urls={}, labels={}, views={}))
+    )
+    (tmp_path / 'log').write_text(
+        json.dumps(['generation', 1]) + '\n' + json.dumps(['set', 'id1', 'url', {}])
+    )
+    storage = EmbeddedStorage(tmp_path / 'log', tmp_path / 'snapshot')
+    with patch('urlshrtr.embedded.logger') as logger_mock:
+        await storage.start()
+    logger_mock.warning.assert_called_once()
+    assert await storage.get_short_url('id1') is None
+
+
+@pytest.mark.asyncio
+async def test_embedded_storage_legacy_urls(tmp_path):
+    """Test the percent-encoded URLs of the version 1 files are loaded raw."""
+    quoted = parse.quote_plus(FULL_URL)
+    (tmp_path / 'snapshot').write_text(
+        json.dumps(
+            dict(generation=1, urls={'id1': quoted}, labels={'id1': {}}, views={})
+        )
+    )
+    (tmp_path / 'log').write_text(
+        json.dumps(['generation', 1])
+        + '\n'
+        + json.dumps(['set', 'id2', quoted, {}])
+        + '\n'
+        + json.dumps(['update', 'id1', 'https://example.com/a+b'])
+    )
+    storage = EmbeddedStorage(tmp_path / 'log', tmp_path / 'snapshot')
+    await storage.start()
+    assert await storage.get_short_urls(['id1', 'id2']) == [
+        'https://example.com/a+b',
+        FULL_URL,
+    ]
+    assert json.loads((tmp_path / 'snapshot').read_text())['urls']['id2'] == FULL_URL
+    await storage.stop()
@@ -0,0 +1,187 @@
+"""Test the static redirect map export tool."""
+
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from urlshrtr import export_tool
+from urlshrtr.compact import UrlCodec
+from urlshrtr.config import settings
+
+LINKS = [
+    ('abc123', 'https://example.com/a?b=c'),
+    ('id1', 'https://example.org'),
+    ('id2', 'https://example.net/ünï'),
+]
+
+
+def _scan(keys):
+    """Make a scan_iter mock yielding the keys."""
+
+    async def scan_iter(**kwargs):
+        for key in keys:
+            yield key
+
+    return MagicMock(side_effect=scan_iter)
+
+
+@pytest.mark.parametrize('export_format', sorted(export_tool.FORMATS))
+def test_formats(tmp_path, export_format):
+    """Test the links written in every format are read back in order."""
+    path = str(tmp_path / 'links')
+    write, read = export_tool.FORMATS[export_format]
+    assert write(iter(LINKS), path) == 3
+    links = list(read(path))
+    if export_format == 'nginx':
+        assert links[2] == ('id2', 'https://example.net/%C3%BCn%C3%AF')
+        links[2] = LINKS[2]
+    assert links == LINKS
+
+
+def test_write_nginx_escapes_urls(tmp_path):
+    """Test the URLs of the nginx map can't expand variables or break quotes."""
+    path = str(tmp_path / 'links.map')
+    export_tool.write_nginx([('id1', 'https://example.com/$host "x"')], path)
+    with open(path) as map_file:
+        lines = map_file.read().splitlines()
+    assert lines[2] == 'map $uri $urlshrtr_redirect {'
+    assert lines[4] == '    /urls/id1 "https://example.com/%24host%20%22x%22";'
+    assert lines[5] == '}'
+
+
+def test_lookup(tmp_path):
+    """Test the links are found with a binary search of the binary file."""
+    path = str(tmp_path / 'links.bin')
+    links = [(f'id{i:03}', f'https://example.com/{i}') for i in range(100)]
+    export_tool.write_binary(links, path)
+    for url_id, url in links:
+        assert export_tool.lookup(path, url_id) == url
+    assert export_tool.lookup(path, 'id') is None
+    assert export_tool.lookup(path, 'id100') is None
+
+
+def test_lookup_not_binary(tmp_path):
+    """Test lookup rejects the files of the other formats."""
+    path = str(tmp_path / 'links.csv')
+    export_tool.write_csv(LINKS, path)
+    with pytest.raises(ValueError):
+        export_tool.lookup(path, 'id1')
+
+
+@pytest.mark.asyncio
+async def test_scan_links(mock_redis_client, mock_redis_pipeline):
+    """Test the non-expiring string records are read with pipelined MGETs."""
+    mock_redis_client.scan_iter = _scan([b'id1', b'id1:stats', b'{id2}', b'id3'])
+    mock_redis_pipeline.execute.return_value = [
+        [b'https%3A%2F%2Fexample.org', b'https%3A%2F%2Fexample.net', None],
+        -1,
+        100,
+        -2,
+    ]
+    links = [
+        link
+        async for link in export_tool.scan_links(
+            mock_redis_client, UrlCodec(compact=False), 10
+        )
+    ]
+    assert links == [('id1', 'https://example.org')]
+    mock_redis_pipeline.mget.assert_called_once_with([b'id1', b'{id2}', b'id3'])
+
+
+@pytest.mark.asyncio
+@patch.object(settings, 'url_layout', 'compact')
+async def test_scan_links_compact(mock_redis_client, mock_redis_pipeline):
+    """Test the non-expiring compact records are read from the hash buckets."""
+    codec = UrlCodec(compact=True)
+    mock_redis_client.scan_iter = _scan([b'urlshrtr:u:1', b'urlshrtr:u:2'])
+    mock_redis_pipeline.execute.side_effect = [
+        [
+            {b'id1': codec.encode('https://example.org')},
+            {b'id2': codec.encode('https://example.net', 2000000000)},
+        ]
+    ]
+    links = [
+        link async for link in export_tool.scan_links(mock_redis_client, codec, 10)
+    ]
+    assert links == [('id1', 'https://example.org')]
+    mock_redis_client.scan_iter.assert_called_once_with(
+        match=f'{settings.url_bucket_prefix}*', count=10, _type='HASH'
+    )
+
+
+@pytest.mark.asyncio
+async def test_export_links(tmp_path, mock_redis_client, mock_redis_pipeline):
+    """Test the links are exported sorted and unique with the change log position."""
+    path = str(tmp_path / 'links.csv')
+    mock_redis_client.xrevrange.return_value = [(b'5-0', {})]
+    mock_redis_client.scan_iter = _scan([b'id2', b'abc123', b'id1', b'id2'])
+    mock_redis_pipeline.execute.side_effect = [
+        [
+            [
+                b'https%3A%2F%2Fexample.net%2F%C3%BCn%C3%AF',
+                b'https%3A%2F%2Fexample.com%2Fa%3Fb%3Dc',
+            ],
+            -1,
+            -1,
+        ],
+        [
+            [
+                b'https%3A%2F%2Fexample.org',
+                b'https%3A%2F%2Fexample.net%2F%C3%BCn%C3%AF',
+            ],
+            -1,
+            -1,
+        ],
+    ]
+    count = await export_tool.export_links(
+        [mock_redis_client], UrlCodec(compact=False), path, 'csv', batch=2, chunk=1
+    )
+    assert count == 3
+    assert list(export_tool.read_csv(path)) == LINKS
+    with open(f'{path}.state') as state_file:
+        assert json.load(state_file) == dict(format='csv', changes=['5-0'])
+
+
+@pytest.mark.asyncio
+async def test_update_export(tmp_path, mock_redis_client, mock_redis_pipeline):
+    """Test the changed links are applied to the exported file."""
+    path = str(tmp_path / 'links.csv')
+    export_tool.write_csv(LINKS, path)
+    export_tool._write_state(path, 'csv', ['5-0'])
+    mock_redis_client.xrange.return_value = [
+        (b'6-0', {b'id': b'id1', b'key': b'id1', b'field': b''}),
+        (b'7-0', {b'id': b'id3', b'key': b'id3', b'field': b''}),
+        (b'8-0', {b'id': b'abc123', b'key': b'abc123', b'field': b''}),
+        (b'9-0', {b'id': b'id4', b'key': b'id4', b'field': b''}),
+    ]
+    mock_redis_pipeline.execute.side_effect = [
+        [[(b'1-0', {})], 10],
+        [b'https%3A%2F%2Fexample.com%2F1', -1, b'https%3A%2F%2Fexample.com%2F3', -1]
+        + [None, -2, b'https%3A%2F%2Fexample.com%2F4', 100],
+    ]
+    assert (
+        await export_tool.update_export(
+            [mock_redis_client], UrlCodec(compact=False), path, batch=10
+        )
+        == 4
+    )
+    assert list(export_tool.read_csv(path)) == [
+        ('id1', 'https://example.com/1'),
+        ('id2', 'https://example.net/ünï'),
+        ('id3', 'https://example.com/3'),
+    ]
+    mock_redis_client.xrange.assert_awaited_with(
+        settings.url_changelog_key, min='(5-0', count=10
+    )
+    with open(f'{path}.state') as state_file:
+        assert json.load(state_file)['changes'] == ['9-0']
+
+
+@pytest.mark.asyncio
+@patch.object(settings, 'url_changelog_maxlen', 10)
+async def test_read_changes_trimmed(mock_redis_client, mock_redis_pipeline):
+    """Test the update fails if the change log was trimmed past the last entry."""
+    mock_redis_pipeline.execute.return_value = [[(b'6-0', {})], 10]
+    with pytest.raises(ValueError):
+        await export_tool.read_changes(mock_redis_client, '5-0', 10)
@@ -0,0 +1,72 @@
+"""Test the redirect fast path."""
+
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from tests.constants import URL_ID
+from urlshrtr.app import app
+from urlshrtr.config import settings
+from urlshrtr.embedded import EmbeddedStorage
+from urlshrtr.fastpath import RedirectFastPath
+
+route_client = TestClient(app)
+fast_client = TestClient(RedirectFastPath(app))
+
+URL = 'https://example.com/a b/ü?q=1&r=a+b#top'
+
+
+@pytest.fixture
+def backend():
+    """Patch the storage backend with the embedded storage."""
+    with patch('urlshrtr.storage.backend', EmbeddedStorage()) as backend:
+        yield backend
+
+
+@pytest.mark.asyncio
+@patch.object(settings, 'redirect_max_age', 3600)
+async def test_redirect(backend):
+    """Test the fast path redirect is the same as the route, the views are counted."""
+    url_id = await backend.create_short_url(URL)
+    route = route_client.get(f'/urls/{url_id}', allow_redirects=False)
+    fast = TestClient(RedirectFastPath(app)).get(
+        f'/urls/{url_id}', allow_redirects=False
+    )
+    assert fast.status_code == route.status_code == 307
+    assert fast.headers == route.headers
+    assert fast.content == route.content == b''
+    assert await backend.get_view_count(url_id) == 2
+
+
+def test_not_found(backend):
+    """Test the missing links get the same 404 as the route."""
+    route = route_client.get(f'/urls/{URL_ID}', allow_redirects=False)
+    fast = fast_client.get(f'/urls/{URL_ID}', allow_redirects=False)
+    assert fast.status_code == route.status_code == 404
+    assert fast.json() == route.json()
+
+
+def test_storage_error():
+    """Test the storage errors are returned as the route does."""
+    error = HTTPException(status_code=500, detail='Redis error')
+    with patch('urlshrtr.storage.backend.get_short_url', AsyncMock(side_effect=error)):
+        response = fast_client.get(f'/urls/{URL_ID}')
+    assert response.status_code == 500
+    assert response.json() == {'detail': 'Redis error'}
+
+
+def test_other_requests(backend):
+    """Test the other paths and methods are passed to the application."""
+    assert fast_client.get('/health').status_code == 200
+    assert fast_client.get(f'/urls/{URL_ID}/stats').status_code == 404
+    response = fast_client.post('/urls/', json={'url': 'https://example.com'})
+    assert response.status_code == 200
+    assert fast_client.get('/urls/').status_code == 405
+
+
+def test_invalid_url_id(backend):
+    """Test the IDs the route rejects are passed to it."""
+    response = fast_client.get('/urls/urlshrtr:id-counter', allow_redirects=False)
+    assert response.status_code == 422
@@ -6,6 +6,17 @@ from fastapi.testclient import TestClient
 
 from tests.constants import FULL_URL, URL_ID
 from urlshrtr.app import app
+from urlshrtr.config import settings
+from urlshrtr.schema import (
+    ShortUrlBatchItem,
+    ShortUrlBatchResponse,
+    ShortUrlResolveItem,
+    ShortUrlResolveResponse,
+    ShortUrlStatsBatchResponse,
+    ShortUrlStatsResponse,
+    ShortUrlViewItem,
+    ShortUrlViewsResponse,
+)
 
 client = TestClient(app)
 
@@ -42,6 +53,138 @@ def test_get_short_url_not_found(logic_mock):
     assert response.json() == {'detail': error_detail}
 
 
+@patch('urlshrtr.handlers.logic')
+def test_create_urls(logic_mock):
+    """Test create_urls success."""
+    logic_mock.create_short_urls = AsyncMock(
+        return_value=ShortUrlBatchResponse(
+            results=[ShortUrlBatchItem(url=FULL_URL, url_id=URL_ID)]
+        )
+    )
+    response = client.post('/urls/batch', json={'urls': [FULL_URL]})
+    assert response.status_code == 200
+    assert response.json() == {
+        'results': [{'url': FULL_URL, 'url_id': URL_ID, 'error': None}]
+    }
+    logic_mock.create_short_urls.assert_awaited_with(
+        [FULL_URL], owner=None, campaign=None, ttl=None, expires_at=None
+    )
+
+
+def test_create_urls_too_many():
+    """Test create_urls rejects the batches over the max size."""
+    urls = [FULL_URL] * (settings.batch_max_size + 1)
+    response = client.post('/urls/batch', json={'urls': urls})
+    assert response.status_code == 422
+
+
+@patch('urlshrtr.handlers.logic')
+def test_resolve_urls(logic_mock):
+    """Test resolve_urls success."""
+    logic_mock.resolve_short_urls = AsyncMock(
+        return_value=ShortUrlResolveResponse(
+            results=[ShortUrlResolveItem(url_id=URL_ID, url=FULL_URL)]
+        )
+    )
+    response = client.post('/urls/resolve', json={'url_ids': [URL_ID]})
+    assert response.status_code == 200
+    assert response.json() == {'results': [{'url_id': URL_ID, 'url': FULL_URL}]}
+    logic_mock.resolve_short_urls.assert_awaited_with([URL_ID], count_views=False)
+
+
+@patch('urlshrtr.handlers.logic')
+def test_get_urls_stats(logic_mock):
+    """Test get_urls_stats success."""
+    logic_mock.get_short_urls_stats = AsyncMock(
+        return_value=ShortUrlStatsBatchResponse(
+            results=[ShortUrlStatsResponse(url_id=URL_ID, last_24h=1)]
+        )
+    )
+    response = client.post('/urls/stats', json={'campaign': 'sale'})
+    assert response.status_code == 200
+    assert response.json() == {'results': [{'url_id': URL_ID, 'last_24h': 1}]}
+    logic_mock.get_short_urls_stats.assert_awaited_with(
+        None, owner=None, campaign='sale'
+    )
+
+
+def test_get_urls_stats_no_filters():
+    """Test get_urls_stats requires the url IDs or the label filters."""
+    response = client.post('/urls/stats', json={})
+    assert response.status_code == 422
+
+
+@patch.object(settings, 'redirect_status_code', 308)
+@patch.object(settings, 'redirect_max_age', 3600)
+@patch('urlshrtr.handlers.logic')
+def test_get_short_url_cached(logic_mock):
+    """Test get_short_url returns the configured status and Cache-Control."""
+    logic_mock.get_short_url = AsyncMock(return_value=FULL_URL)
+    response = client.get(f'/urls/{URL_ID}', allow_redirects=False)
+    assert response.status_code == 308
+    assert response.headers['Cache-Control'] == 'public, max-age=3600'
+
+
+@patch('urlshrtr.handlers.logic')
+def test_get_url_stats_not_modified(logic_mock):
+    """Test get_url_stats returns 304 if the stats ETag is not changed."""
+    logic_mock.get_short_url_stats = AsyncMock(
+        return_value=ShortUrlStatsResponse(url_id=URL_ID, last_24h=1)
+    )
+    response = client.get(f'/urls/{URL_ID}/stats')
+    assert response.status_code == 200
+    assert response.json() == {'url_id': URL_ID, 'last_24h': 1}
+    assert response.headers['Cache-Control'] == 'no-cache'
+    etag = response.headers['ETag']
+    response = client.get(
+        f'/urls/{URL_ID}/stats', headers={'If-None-Match': f'"other", W/{etag}'}
+    )
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+
+@patch('urlshrtr.handlers.logic')
+def test_record_views(logic_mock):
+    """Test record_views success."""
+    logic_mock.record_views = AsyncMock(return_value=ShortUrlViewsResponse(recorded=3))
+    response = client.post(
+        '/urls/views', json={'views': [{'url_id': URL_ID, 'count': 3}]}
+    )
+    assert response.status_code == 200
+    assert response.json() == {'recorded': 3}
+    logic_mock.record_views.assert_awaited_with(
+        [ShortUrlViewItem(url_id=URL_ID, count=3)]
+    )
+
+
+@patch('urlshrtr.handlers.logic')
+def test_internal_keys_rejected(logic_mock):
+    """Test the internal Redis keys can't be read or written as url IDs."""
+    url_id = settings.id_counter_key
+    assert client.get(f'/urls/{url_id}', allow_redirects=False).status_code == 422
+    assert client.put(f'/urls/{url_id}', json={'url': FULL_URL}).status_code == 422
+    assert client.delete(f'/urls/{url_id}').status_code == 422
+    assert client.get(f'/urls/{url_id}/stats').status_code == 422
+    response = client.post('/urls/resolve', json={'url_ids': [url_id]})
+    assert response.status_code == 422
+    response = client.post('/urls/views', json={'views': [{'url_id': url_id}]})
+    assert response.status_code == 422
+    assert not logic_mock.mock_calls
+
+
+@patch('urlshrtr.handlers.logic')
+def test_expiry_out_of_range(logic_mock):
+    """Test the expiry past the max expiry unix time is rejected before any write."""
+    for expiry in ({'ttl': 10**12}, {'expires_at': '2200-01-01T00:00:00'}):
+        response = client.post('/urls/', json={'url': FULL_URL, **expiry})
+        assert response.status_code == 422
+        response = client.post('/urls/batch', json={'urls': [FULL_URL], **expiry})
+        assert response.status_code == 422
+        response = client.put(f'/urls/{URL_ID}', json={'url': FULL_URL, **expiry})
+        assert response.status_code == 422
+    assert not logic_mock.mock_calls
+
+
 # TODO: complete the handler module tests
 # Tests for the rest of the API handler functions will be similar
 # to the ones above. They are skipped for now to save the development time.
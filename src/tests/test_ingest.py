@@ -0,0 +1,89 @@
+"""Test the batched view events ingestion."""
+
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+from freezegun import freeze_time
+
+from tests.constants import FROZEN_TIME, FROZEN_TS, URL_ID
+from urlshrtr.ingest import ClickIngestor
+
+
+def _ingestor(flush=None, maxsize=10, batch_size=2, bucket_size=1):
+    """Make an ingestor with a flush mock."""
+    return ClickIngestor(
+        flush or AsyncMock(),
+        maxsize=maxsize,
+        batch_size=batch_size,
+        flush_interval=60,
+        bucket_size=bucket_size,
+    )
+
+
+@pytest.mark.asyncio
+@freeze_time(FROZEN_TIME)
+async def test_flush_batches():
+    """Test the events are aggregated and flushed in batches."""
+    ingestor = _ingestor()
+    for _ in range(3):
+        ingestor.record(URL_ID)
+    await ingestor.flush()
+    ingestor.flush_batches.assert_awaited_with(
+        [{(URL_ID, FROZEN_TS): 2}, {(URL_ID, FROZEN_TS): 1}]
+    )
+    assert ingestor.stats() == dict(
+        recorded=3, dropped=0, flushed=3, failed=0, queue_depth=0
+    )
+
+
+@freeze_time('2020-01-01T00:00:59')
+def test_record_truncates_to_bucket():
+    """Test the events timestamps are truncated to the bucket size."""
+    ingestor = _ingestor(bucket_size=60000)
+    ingestor.record(URL_ID)
+    assert ingestor._events == [(URL_ID, FROZEN_TS)]
+
+
+@pytest.mark.asyncio
+async def test_record_drops_when_full():
+    """Test the events over the buffer size are dropped."""
+    ingestor = _ingestor(maxsize=1)
+    ingestor.record(URL_ID)
+    ingestor.record(URL_ID)
+    assert ingestor.recorded == 1
+    assert ingestor.dropped == 1
+    assert ingestor.queue_depth == 1
+
+
+@pytest.mark.asyncio
+async def test_flush_error():
+    """Test the failed events are counted and don't break the ingestor."""
+    ingestor = _ingestor(flush=AsyncMock(side_effect=Exception('Redis error')))
+    ingestor.record(URL_ID)
+    await ingestor.flush()
+    assert ingestor.failed == 1
+    assert ingestor.queue_depth == 0
+
+
+@pytest.mark.asyncio
+async def test_flush_by_batch_size():
+    """Test the background task flushes a full batch before the interval."""
+    ingestor = _ingestor()
+    ingestor.start()
+    ingestor.record(URL_ID)
+    ingestor.record(URL_ID)
+    await asyncio.sleep(0.01)
+    ingestor.flush_batches.assert_awaited_once()
+    await ingestor.stop()
+
+
+@pytest.mark.asyncio
+async def test_stop_drains_events():
+    """Test stopping the ingestor flushes the buffered events."""
+    ingestor = _ingestor()
+    ingestor.start()
+    ingestor.record(URL_ID)
+    await ingestor.stop()
+    assert ingestor.flushed == 1
+    assert ingestor.queue_depth == 0
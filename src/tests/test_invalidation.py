@@ -0,0 +1,66 @@
+"""Test the cross-worker cache invalidation."""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, call, patch
+
+import pytest
+from redis.exceptions import RedisError
+
+from tests.constants import FULL_URL, URL_ID
+from urlshrtr import invalidation
+from urlshrtr.cache import UrlCache
+from urlshrtr.config import settings
+
+
+def _pubsub_mock():
+    """Make a PubSub mock."""
+    pubsub = MagicMock()
+    pubsub.subscribe = AsyncMock()
+    pubsub.reset = AsyncMock()
+    return pubsub
+
+
+@pytest.mark.asyncio
+@patch('urlshrtr.invalidation.asyncio.sleep', side_effect=asyncio.CancelledError)
+async def test_listen_invalidations(sleep_mock):
+    """Test the published url IDs are removed from the cache."""
+    cache = UrlCache(maxsize=10, ttl=60)
+    cache.set('other', FULL_URL)
+    pubsub = _pubsub_mock()
+    redis_mock = MagicMock(pubsub=MagicMock(return_value=pubsub))
+
+    async def listen():
+        cache.set(URL_ID, FULL_URL)
+        yield {'data': URL_ID.encode()}
+        assert cache.get(URL_ID) is None
+        raise RedisError('Connection lost')
+
+    pubsub.listen = listen
+    with patch('urlshrtr.invalidation.url_cache', cache):
+        with pytest.raises(asyncio.CancelledError):
+            await invalidation.listen_invalidations(redis_mock)
+    pubsub.subscribe.assert_awaited_with(settings.url_cache_channel)
+    pubsub.reset.assert_awaited()
+    sleep_mock.assert_awaited_with(settings.url_cache_reconnect_delay)
+    assert cache.stats()['size'] == 0
+
+
+@pytest.mark.asyncio
+@patch('urlshrtr.redis_connector.redis_clients', ['shard1', 'shard2'])
+@patch('urlshrtr.redis_connector.replica_clients', [['replica1'], []])
+@patch('urlshrtr.invalidation.listen_invalidations')
+async def test_start_stop_listener(listen_mock):
+    """Test the listener tasks are started once per client and cancelled on stop."""
+    listen_mock.side_effect = lambda client: asyncio.sleep(60)
+    invalidation.start_listener()
+    tasks = list(invalidation._listener_tasks)
+    invalidation.start_listener()
+    assert invalidation._listener_tasks == tasks
+    assert listen_mock.call_args_list == [
+        call('shard1'),
+        call('shard2'),
+        call('replica1'),
+    ]
+    await invalidation.stop_listener()
+    assert all(task.cancelled() for task in tasks)
+    assert invalidation._listener_tasks == []
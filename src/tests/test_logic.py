@@ -1,29 +1,36 @@
 """Test the logic layer functions."""
 from unittest.mock import AsyncMock, patch
-from urllib import parse
 
 import pytest
 from fastapi import HTTPException
+from freezegun import freeze_time
 
-from tests.constants import FULL_URL, FULL_URL_BYTES, URL_ID
+from tests.constants import FROZEN_TIME, FROZEN_TS, FULL_URL, URL_ID
 from urlshrtr import logic
+from urlshrtr.config import settings
+from urlshrtr.schema import (
+    ShortUrlBatchItem,
+    ShortUrlResolveItem,
+    ShortUrlStatsResponse,
+    ShortUrlViewItem,
+)
 
 
 @pytest.mark.asyncio
-@patch('urlshrtr.logic.model')
-async def test_get_short_url(model_mock):
+@patch('urlshrtr.storage.backend')
+async def test_get_short_url(backend_mock):
     """Test get_short_url success."""
-    model_mock.get_short_url = AsyncMock(return_value=parse.quote_plus(FULL_URL_BYTES))
+    backend_mock.get_short_url = AsyncMock(return_value=FULL_URL)
     result = await logic.get_short_url(URL_ID)
     assert result == FULL_URL
-    model_mock.get_short_url.assert_awaited_with(URL_ID)
+    backend_mock.get_short_url.assert_awaited_with(URL_ID)
 
 
 @pytest.mark.asyncio
-@patch('urlshrtr.logic.model')
-async def test_get_short_url_redis_error(model_mock):
+@patch('urlshrtr.storage.backend')
+async def test_get_short_url_redis_error(backend_mock):
     """Test get_short_url raises HTTPException in case of RedisError raised."""
-    model_mock.get_short_url = AsyncMock(
+    backend_mock.get_short_url = AsyncMock(
         side_effect=HTTPException(status_code=500, detail='Redis error')
     )
     with pytest.raises(HTTPException):
@@ -31,14 +38,92 @@ async def test_get_short_url_redis_error(model_mock):
 
 
 @pytest.mark.asyncio
-@patch('urlshrtr.logic.model')
-async def test_get_short_url_not_found(model_mock):
+@patch('urlshrtr.storage.backend')
+async def test_get_short_url_not_found(backend_mock):
     """Test get_short_url raises HTTPException in case of URL not found."""
-    model_mock.get_short_url = AsyncMock(return_value=None)
+    backend_mock.get_short_url = AsyncMock(return_value=None)
     with pytest.raises(HTTPException):
         await logic.get_short_url(URL_ID)
 
 
+@pytest.mark.asyncio
+@freeze_time(FROZEN_TIME)
+@patch.object(settings, 'url_default_ttl', 60)
+@patch('urlshrtr.storage.backend')
+async def test_create_short_url_expiry(backend_mock):
+    """Test create_short_url sets the expiry of ttl or the default one."""
+    backend_mock.create_short_url = AsyncMock(return_value=URL_ID)
+    now = FROZEN_TS // 1000
+    result = await logic.create_short_url(FULL_URL, ttl=10)
+    assert int(result.expires_at.timestamp()) == now + 10
+    backend_mock.create_short_url.assert_awaited_with(FULL_URL, {}, now + 10)
+    result = await logic.create_short_url(FULL_URL)
+    assert int(result.expires_at.timestamp()) == now + 60
+
+
+@pytest.mark.asyncio
+@patch('urlshrtr.storage.backend')
+async def test_create_short_urls(backend_mock):
+    """Test create_short_urls returns the per-item results in the input order."""
+    backend_mock.create_short_urls = AsyncMock(return_value=[URL_ID, None])
+    result = await logic.create_short_urls(
+        [FULL_URL, 'invalid', f'  {FULL_URL}  '], campaign='sale'
+    )
+    assert result.results == [
+        ShortUrlBatchItem(url=FULL_URL, url_id=URL_ID),
+        ShortUrlBatchItem(url='invalid', error='invalid or missing URL scheme'),
+        ShortUrlBatchItem(url=FULL_URL, error='Failed to create the short url'),
+    ]
+    backend_mock.create_short_urls.assert_awaited_with(
+        [FULL_URL] * 2, {'campaign': 'sale'}, None
+    )
+
+
+@pytest.mark.asyncio
+@patch('urlshrtr.storage.backend')
+async def test_resolve_short_urls(backend_mock):
+    """Test resolve_short_urls returns the URLs in the input order."""
+    backend_mock.get_short_urls = AsyncMock(return_value=[FULL_URL, None])
+    result = await logic.resolve_short_urls([URL_ID, 'missing'], count_views=True)
+    assert result.results == [
+        ShortUrlResolveItem(url_id=URL_ID, url=FULL_URL),
+        ShortUrlResolveItem(url_id='missing'),
+    ]
+    backend_mock.get_short_urls.assert_awaited_with(
+        [URL_ID, 'missing'], count_views=True
+    )
+
+
+@pytest.mark.asyncio
+@patch('urlshrtr.storage.backend')
+async def test_get_short_urls_stats(backend_mock):
+    """Test get_short_urls_stats filters by the url IDs and the labels."""
+    backend_mock.get_view_counts = AsyncMock(return_value={URL_ID: 2})
+    result = await logic.get_short_urls_stats([URL_ID], owner='me')
+    assert result.results == [ShortUrlStatsResponse(url_id=URL_ID, last_24h=2)]
+    backend_mock.get_view_counts.assert_awaited_with([URL_ID], {'owner': 'me'})
+
+
 # TODO: complete the logic module tests
 # Tests for the rest of the logic functions will be similar
 # to the ones above. They are skipped for now to save the development time.
+
+
+@pytest.mark.asyncio
+@freeze_time(FROZEN_TIME)
+@patch('urlshrtr.storage.backend')
+async def test_record_views(backend_mock):
+    """Test record_views counts the views of the found URLs in the stats buckets."""
+    backend_mock.get_short_urls = AsyncMock(return_value=[FULL_URL, None])
+    backend_mock.update_view_counts = AsyncMock()
+    result = await logic.record_views(
+        [
+            ShortUrlViewItem(url_id=URL_ID, count=2),
+            ShortUrlViewItem(url_id='missing', count=5),
+            ShortUrlViewItem(url_id=URL_ID, timestamp='2020-01-01T00:00:30'),
+            ShortUrlViewItem(url_id=URL_ID, timestamp='2019-01-01T00:00:00'),
+        ]
+    )
+    assert result.recorded == 3
+    backend_mock.get_short_urls.assert_awaited_with([URL_ID, 'missing'])
+    backend_mock.update_view_counts.assert_awaited_with([{(URL_ID, FROZEN_TS): 3}])
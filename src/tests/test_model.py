@@ -1,19 +1,28 @@
 """Test the model layer."""
 
-from unittest.mock import AsyncMock, MagicMock, patch
+from collections import OrderedDict
+from unittest.mock import AsyncMock, MagicMock, call, patch
+from urllib import parse
 
 import pytest
 from fastapi import HTTPException
 from freezegun import freeze_time
-from nanoid.resources import alphabet
-from redis.exceptions import RedisError
+from redis.exceptions import NoScriptError, RedisError
 
-from tests.constants import FROZEN_TIME, FULL_URL, FULL_URL_BYTES, URL_ID
-from urlshrtr import model
+from tests.constants import (
+    FROZEN_TIME,
+    FROZEN_TS,
+    FULL_URL,
+    FULL_URL_BYTES,
+    URL_ID,
+)
+from urlshrtr import model, scripts
+from urlshrtr.compact import UrlCodec
 from urlshrtr.config import settings
 
 
 @pytest.mark.asyncio
+@patch.object(settings, 'click_ingest_enabled', False)
 @patch('urlshrtr.model.update_view_count')
 @pytest.mark.parametrize(
     'full_url,expected_result',
@@ -25,15 +34,97 @@ from urlshrtr.config import settings
 async def test_get_short_url(
     update_view_count_mock, mock_redis_client, full_url, expected_result
 ):
-    """Test get_short_url success."""
-    mock_redis_client.get.return_value = full_url
+    """Test get_short_url gets the URL and counts the view in one script."""
+    mock_redis_client.evalsha.return_value = full_url
     result = await model.get_short_url(URL_ID)
     assert result == expected_result
-    mock_redis_client.get.assert_awaited_with(URL_ID)
-    if expected_result:
-        update_view_count_mock.assert_awaited_with(URL_ID)
-    else:
-        update_view_count_mock.assert_not_awaited()
+    mock_redis_client.evalsha.assert_awaited_with(
+        scripts.get_url.sha,
+        2,
+        URL_ID,
+        model._stats_key(URL_ID),
+        '',
+        model._ts_bucket(),
+        settings.stats_retention,
+        URL_ID,
+    )
+    mock_redis_client.get.assert_not_awaited()
+    update_view_count_mock.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@patch('urlshrtr.model.update_view_count')
+@patch('urlshrtr.model.click_ingestor')
+async def test_get_short_url_ingest(
+    click_ingestor_mock, update_view_count_mock, mock_redis_client
+):
+    """Test get_short_url records the view in the background ingestor."""
+    mock_redis_client.get.return_value = FULL_URL_BYTES
+    assert await model.get_short_url(URL_ID) == FULL_URL
+    click_ingestor_mock.record.assert_called_with(URL_ID)
+    update_view_count_mock.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@patch('urlshrtr.model.click_ingestor')
+async def test_get_short_url_migrate(
+    click_ingestor_mock, mock_redis_client, mock_redis_pipeline
+):
+    """Test a version 1 record is read and rewritten with the raw URL."""
+    legacy_url = parse.quote_plus(FULL_URL).encode()
+    mock_redis_client.get.return_value = legacy_url
+    assert await model.get_short_url(URL_ID) == FULL_URL
+    mock_redis_pipeline.evalsha.assert_called_once_with(
+        scripts.migrate_url.sha, 1, URL_ID, legacy_url, FULL_URL
+    )
+    mock_redis_client.get.return_value = FULL_URL_BYTES
+    assert await model.get_short_url(URL_ID) == FULL_URL
+    mock_redis_pipeline.evalsha.assert_called_once()
+
+
+@pytest.mark.asyncio
+@patch('urlshrtr.model.click_ingestor')
+async def test_get_short_url_migrate_error(
+    click_ingestor_mock, mock_redis_client, mock_redis_pipeline
+):
+    """Test a failed migration doesn't fail the read."""
+    mock_redis_client.get.return_value = parse.quote_plus(FULL_URL).encode()
+    mock_redis_pipeline.execute.side_effect = RedisError('Redis error')
+    assert await model.get_short_url(URL_ID) == FULL_URL
+
+
+@pytest.mark.asyncio
+@patch('urlshrtr.model.click_ingestor')
+async def test_get_short_url_cached(click_ingestor_mock, mock_redis_client, url_cache):
+    """Test get_short_url returns the cached URL without a Redis request."""
+    mock_redis_client.get.return_value = FULL_URL_BYTES
+    assert await model.get_short_url(URL_ID) == FULL_URL
+    assert await model.get_short_url(URL_ID) == FULL_URL
+    mock_redis_client.get.assert_awaited_once_with(URL_ID)
+    assert click_ingestor_mock.record.call_count == 2
+    assert url_cache.hits == 1
+
+
+@pytest.mark.asyncio
+@patch.object(settings, 'redis_read_your_writes', 5)
+@patch('urlshrtr.model._recent_writes', OrderedDict())
+@patch('urlshrtr.model.click_ingestor')
+@patch('urlshrtr.redis_connector.get_read_client')
+async def test_get_short_url_read_your_writes(
+    get_read_client_mock, click_ingestor_mock, mock_redis_client
+):
+    """Test the URL is read from a replica unless it was just written."""
+    get_read_client_mock.return_value = AsyncMock(
+        get=AsyncMock(return_value=FULL_URL_BYTES)
+    )
+    mock_redis_client.get.return_value = FULL_URL_BYTES
+    await model.get_short_url(URL_ID)
+    mock_redis_client.get.assert_not_awaited()
+    mock_redis_client.evalsha.return_value = 1
+    await model.update_short_url(FULL_URL, URL_ID)
+    await model.get_short_url(URL_ID)
+    mock_redis_client.get.assert_awaited_once_with(URL_ID)
+    assert get_read_client_mock.call_count == 1
 
 
 @pytest.mark.asyncio
@@ -45,13 +136,69 @@ async def test_get_short_url_redis_error(mock_redis_client):
 
 
 @pytest.mark.asyncio
+@freeze_time(FROZEN_TIME)
 async def test_update_view_count(mock_redis_client):
     """Test update_view_count success."""
     ts_mock = AsyncMock()
     mock_redis_client.ts = MagicMock(return_value=ts_mock)
     await model.update_view_count(URL_ID)
     expected_key = model._stats_key(URL_ID)
-    ts_mock.add.assert_awaited_with(expected_key, '*', 1)
+    ts_mock.add.assert_awaited_with(
+        expected_key,
+        FROZEN_TS,
+        1,
+        retention_msecs=settings.stats_retention,
+        labels={'url_id': URL_ID},
+        duplicate_policy='sum',
+    )
+
+
+@pytest.mark.asyncio
+async def test_update_view_counts(mock_redis_client, mock_redis_pipeline):
+    """Test update_view_counts sends a TS.ADD per sample in one pipeline."""
+    await model.update_view_counts([{(URL_ID, 1): 2}, {(URL_ID, 2): 1}])
+    expected_key = model._stats_key(URL_ID)
+    options = dict(
+        retention_msecs=settings.stats_retention,
+        labels={'url_id': URL_ID},
+        duplicate_policy='sum',
+    )
+    assert mock_redis_pipeline.ts().add.call_args_list == [
+        call(expected_key, 1, 2, **options),
+        call(expected_key, 2, 1, **options),
+    ]
+    mock_redis_pipeline.execute.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+@freeze_time(FROZEN_TIME)
+@patch.object(settings, 'stats_sweep_batch', 2)
+async def test_sweep_stats(mock_redis_client, mock_redis_pipeline):
+    """Test sweep_stats checks the scanned stats series in batches."""
+
+    async def scan_iter(**kwargs):
+        for key in [b'id1:stats', b'id2:stats', b'id3:stats']:
+            yield key
+
+    mock_redis_client.set.return_value = True
+    mock_redis_client.scan_iter = MagicMock(side_effect=scan_iter)
+    mock_redis_pipeline.execute.side_effect = [[1, 0], [1]]
+    assert await model.sweep_stats() == 2
+    mock_redis_client.scan_iter.assert_called_once_with(
+        match='*:stats', count=2, _type='TSDB-TYPE'
+    )
+    min_timestamp = FROZEN_TS - settings.stats_retention
+    mock_redis_pipeline.evalsha.assert_called_with(
+        scripts.sweep_stats.sha, 2, 'id3', 'id3:stats', '', min_timestamp
+    )
+
+
+@pytest.mark.asyncio
+async def test_sweep_stats_locked(mock_redis_client):
+    """Test sweep_stats skips the shard swept by another worker."""
+    mock_redis_client.set.return_value = None
+    assert await model.sweep_stats() == 0
+    mock_redis_client.scan_iter.assert_not_called()
 
 
 @pytest.mark.asyncio
@@ -65,130 +212,552 @@ async def test_update_view_count_redis_error(mock_redis_client):
 
 
 @pytest.mark.asyncio
-@pytest.mark.parametrize(
-    'get_result,ts_result,expected_count',
-    [
-        (None, [], None),
-        (FULL_URL_BYTES, [(1, 1)], 1),
-        (FULL_URL_BYTES, [], 0),
-    ],
-)
-async def test_get_view_count(mock_redis_client, get_result, ts_result, expected_count):
+@freeze_time(FROZEN_TIME)
+@pytest.mark.parametrize('script_result', [None, 0, 3])
+async def test_get_view_count(mock_redis_client, script_result):
     """Test get_view_count success."""
-    ts_mock = AsyncMock()
-    mock_redis_client.ts = MagicMock(return_value=ts_mock)
-    ts_mock.range.return_value = ts_result
-    mock_redis_client.get.return_value = get_result
+    mock_redis_client.evalsha.return_value = script_result
     result = await model.get_view_count(URL_ID)
-    assert result == expected_count
-    mock_redis_client.get.assert_awaited_with(URL_ID)
-    if get_result:
-        ts_mock.range.assert_awaited_with(
-            model._stats_key(URL_ID),
+    assert result == script_result
+    mock_redis_client.evalsha.assert_awaited_with(
+        scripts.get_view_count.sha,
+        2,
+        URL_ID,
+        model._stats_key(URL_ID),
+        '',
+        model._ts_24h_ago(),
+        settings.stats_period,
+    )
+
+
+@pytest.mark.asyncio
+@freeze_time(FROZEN_TIME)
+@patch.object(settings, 'batch_chunk_size', 2)
+async def test_get_view_counts(mock_redis_pipeline):
+    """Test get_view_counts queries the labeled stats with chunked TS.MRANGE."""
+    mock_redis_pipeline.execute.return_value = [
+        1,
+        0,
+        1,
+        [{'id1:stats': [{'url_id': 'id1'}, [(1, 1.0), (2, 2.0)]]}],
+        [],
+    ]
+    result = await model.get_view_counts(['id1', 'id2', 'id3'], {'owner': 'me'})
+    assert result == {'id1': 3, 'id3': 0}
+    assert mock_redis_pipeline.ts().mrange.call_args_list == [
+        call(
+            model._ts_24h_ago(),
+            '+',
+            ['owner=me', 'url_id=(id1,id2)'],
+            aggregation_type='sum',
+            bucket_size_msec=settings.stats_period,
+            select_labels=['url_id'],
+        ),
+        call(
             model._ts_24h_ago(),
             '+',
+            ['owner=me', 'url_id=(id3)'],
             aggregation_type='sum',
-            bucket_size_msec=model.settings.stats_period,
-        )
+            bucket_size_msec=settings.stats_period,
+            select_labels=['url_id'],
+        ),
+    ]
+
+
+@pytest.mark.asyncio
+@freeze_time(FROZEN_TIME)
+@patch.object(settings, 'url_layout', 'compact')
+async def test_get_view_counts_compact_expired(mock_redis_pipeline):
+    """Test the expired compact records are skipped until they're purged."""
+    now = FROZEN_TS // 1000
+    codec = UrlCodec(compact=True)
+    mock_redis_pipeline.execute.return_value = [
+        codec.encode(FULL_URL, now + 60),
+        codec.encode(FULL_URL, now),
+        None,
+        [],
+    ]
+    result = await model.get_view_counts(['id1', 'id2', 'id3'])
+    assert result == {'id1': 0}
+    assert mock_redis_pipeline.hget.call_count == 3
 
 
 @pytest.mark.asyncio
-@pytest.mark.parametrize('get_failed', [True, False])
-async def test_get_view_count_redis_error(mock_redis_client, get_failed):
+async def test_get_view_counts_by_labels(mock_redis_pipeline):
+    """Test get_view_counts returns all the series matching the labels."""
+    mock_redis_pipeline.execute.return_value = [
+        [
+            {'id1:stats': [{'url_id': 'id1'}, [(1, 1.0)]]},
+            {'id2:stats': [{'url_id': 'id2'}, []]},
+        ],
+    ]
+    result = await model.get_view_counts(labels={'campaign': 'sale'})
+    assert result == {'id1': 1, 'id2': 0}
+    mock_redis_pipeline.exists.assert_not_called()
+    assert mock_redis_pipeline.ts().mrange.call_args[0][2] == ['campaign=sale']
+
+
+@pytest.mark.asyncio
+async def test_get_view_count_redis_error(mock_redis_client):
     """Test get_view_count raises HTTPException in case of RedisError raised."""
-    ts_mock = AsyncMock()
-    mock_redis_client.ts = MagicMock(return_value=ts_mock)
-    ts_mock.range.side_effect = RedisError('Redis error')
-    if get_failed:
-        mock_redis_client.get.side_effect = RedisError('Redis error')
+    mock_redis_client.evalsha.side_effect = RedisError('Redis error')
     with pytest.raises(HTTPException):
         await model.get_view_count(URL_ID)
 
 
 @pytest.mark.asyncio
-@patch('urlshrtr.model.nanoid.generate')
-async def test_create_short_url(nanoid_mock, mock_redis_client):
+async def test_create_short_url(mock_redis_pipeline, mock_id_allocator):
     """Test create_short_url success."""
-    ts_mock = AsyncMock()
-    mock_redis_client.ts = MagicMock(return_value=ts_mock)
-    nanoid_mock.return_value = URL_ID
-    result = await model.create_short_url(FULL_URL)
+    mock_id_allocator.allocate.return_value = [URL_ID]
+    mock_redis_pipeline.execute.return_value = [1]
+    result = await model.create_short_url(FULL_URL, {'owner': 'marketing'})
     assert result == URL_ID
-    nanoid_mock.assert_called_with(alphabet, settings.url_key_length)
-    mock_redis_client.set.assert_awaited_with(URL_ID, FULL_URL)
-    ts_mock.create.assert_awaited_with(
+    mock_id_allocator.allocate.assert_awaited_with(1)
+    mock_redis_pipeline.evalsha.assert_called_with(
+        scripts.create_url.sha,
+        2,
+        URL_ID,
         model._stats_key(URL_ID),
-        retention_msec=settings.stats_retention,
-        duplicate_policy='first',
+        '',
+        FULL_URL,
+        settings.stats_retention,
+        0,
+        0,
+        URL_ID,
+        'owner',
+        'marketing',
+        'url_id',
+        URL_ID,
     )
 
 
 @pytest.mark.asyncio
-@pytest.mark.parametrize('ts_create_failed', [True, False])
-async def test_create_short_url_redis_error(mock_redis_client, ts_create_failed):
+@patch.object(settings, 'id_max_retries', 1)
+@pytest.mark.parametrize(
+    'script_results,expected_url_id', [([0, 1], 'id2'), ([0, 0], None)]
+)
+async def test_create_short_url_collision(
+    mock_redis_pipeline, mock_id_allocator, script_results, expected_url_id
+):
+    """Test create_short_url allocates a new ID if the record already exists."""
+    mock_id_allocator.allocate.side_effect = [['id1'], ['id2']]
+    mock_redis_pipeline.execute.side_effect = [[result] for result in script_results]
+    result = await model.create_short_url(FULL_URL)
+    assert result == expected_url_id
+    assert [args[0][2] for args in mock_redis_pipeline.evalsha.call_args_list] == [
+        'id1',
+        'id2',
+    ]
+    assert mock_id_allocator.record_collision.call_args_list[0] == call(1)
+
+
+@pytest.mark.asyncio
+async def test_create_short_url_no_script(
+    mock_redis_client, mock_redis_pipeline, mock_id_allocator
+):
+    """Test create_short_url loads the scripts and retries on NOSCRIPT error."""
+    mock_id_allocator.allocate.side_effect = [['id1'], ['id2']]
+    mock_redis_pipeline.execute.side_effect = [[NoScriptError('No script')], [1]]
+    result = await model.create_short_url(FULL_URL)
+    assert result == 'id2'
+    assert mock_redis_client.script_load.await_count == len(scripts.SCRIPTS)
+    mock_id_allocator.record_collision.assert_called_with(0)
+
+
+@pytest.mark.asyncio
+async def test_create_short_url_redis_error(mock_redis_pipeline, mock_id_allocator):
     """Test create_short_url raises HTTPException in case of RedisError raised."""
-    ts_mock = AsyncMock()
-    mock_redis_client.ts = MagicMock(return_value=ts_mock)
-    mock_redis_client.set.side_effect = RedisError('Redis error')
-    if ts_create_failed:
-        ts_mock.create.side_effect = RedisError('Redis error')
+    mock_id_allocator.allocate.return_value = [URL_ID]
+    mock_redis_pipeline.execute.return_value = [RedisError('Redis error')]
     with pytest.raises(HTTPException):
         await model.create_short_url(FULL_URL)
 
 
 @pytest.mark.asyncio
-@pytest.mark.parametrize(
-    'get_result,expected_url_id', [(FULL_URL_BYTES, URL_ID), (None, None)]
-)
-async def test_update_short_url(mock_redis_client, get_result, expected_url_id):
+@patch.object(settings, 'batch_chunk_size', 2)
+@patch('urlshrtr.model.click_ingestor')
+async def test_get_short_urls(click_ingestor_mock, mock_redis_pipeline, url_cache):
+    """Test get_short_urls fetches the cache misses with chunked MGETs."""
+    url_cache.set('id2', FULL_URL)
+    mock_redis_pipeline.execute.return_value = [[FULL_URL_BYTES, None], [None]]
+    result = await model.get_short_urls(['id1', 'id2', 'id3', 'id4'])
+    assert result == [FULL_URL, FULL_URL, None, None]
+    assert mock_redis_pipeline.mget.call_args_list == [
+        call(['id1', 'id3']),
+        call(['id4']),
+    ]
+    assert url_cache.get('id1') == FULL_URL
+    click_ingestor_mock.record.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch('urlshrtr.redis_connector.group_by_shard')
+async def test_get_short_urls_sharded(group_by_shard_mock, url_cache):
+    """Test get_short_urls sends a pipeline per shard."""
+    shards = [MagicMock(), MagicMock()]
+    for shard, result in zip(shards, [[[b'http://url2']], [[b'http://url1', None]]]):
+        shard.pipeline().execute = AsyncMock(return_value=result)
+    group_by_shard_mock.return_value = [(shards[0], [1]), (shards[1], [0, 2])]
+    result = await model.get_short_urls(['id1', 'id2', 'id3'])
+    assert result == ['http://url1', 'http://url2', None]
+    shards[0].pipeline().mget.assert_called_once_with(['id2'])
+    shards[1].pipeline().mget.assert_called_once_with(['id1', 'id3'])
+
+
+@pytest.mark.asyncio
+@patch('urlshrtr.model.click_ingestor')
+async def test_get_short_urls_count_views(click_ingestor_mock, mock_redis_pipeline):
+    """Test get_short_urls records the views of the found URLs."""
+    mock_redis_pipeline.execute.return_value = [[FULL_URL_BYTES, None]]
+    await model.get_short_urls(['id1', 'id2'], count_views=True)
+    click_ingestor_mock.record.assert_called_once_with('id1')
+
+
+@pytest.mark.asyncio
+@freeze_time(FROZEN_TIME)
+@patch.object(settings, 'click_ingest_enabled', False)
+@patch('urlshrtr.model.update_view_counts')
+async def test_get_short_urls_count_views_sync(
+    update_view_counts_mock, mock_redis_pipeline
+):
+    """Test get_short_urls writes the views of the found URLs in one batch."""
+    mock_redis_pipeline.execute.return_value = [[FULL_URL_BYTES, FULL_URL_BYTES]]
+    await model.get_short_urls(['id1', 'id1'], count_views=True)
+    update_view_counts_mock.assert_awaited_with([{('id1', FROZEN_TS): 2}])
+
+
+@pytest.mark.asyncio
+@patch.object(settings, 'batch_chunk_size', 2)
+async def test_create_short_urls(mock_redis_pipeline, mock_id_allocator):
+    """Test create_short_urls writes the records in pipelined chunks."""
+    mock_id_allocator.allocate.side_effect = [['id1', 'id2'], ['id3']]
+    mock_redis_pipeline.execute.side_effect = [
+        [1, RedisError('Redis error')],
+        [1],
+    ]
+    result = await model.create_short_urls([FULL_URL] * 3)
+    assert result == ['id1', None, 'id3']
+    assert mock_redis_pipeline.execute.await_count == 2
+    mock_redis_pipeline.execute.assert_awaited_with(raise_on_error=False)
+    assert [args[0][2] for args in mock_redis_pipeline.evalsha.call_args_list] == [
+        'id1',
+        'id2',
+        'id3',
+    ]
+    mock_redis_pipeline.evalsha.assert_called_with(
+        scripts.create_url.sha,
+        2,
+        'id3',
+        model._stats_key('id3'),
+        '',
+        FULL_URL,
+        settings.stats_retention,
+        0,
+        0,
+        'id3',
+        'url_id',
+        'id3',
+    )
+
+
+@pytest.mark.asyncio
+@freeze_time(FROZEN_TIME)
+@patch.object(settings, 'url_layout', 'compact')
+@patch.object(settings, 'url_purge_batch', 2)
+async def test_purge_expired(mock_redis_client, mock_redis_pipeline):
+    """Test purge_expired deletes the due records of the expiry index in batches."""
+    mock_redis_client.zrangebyscore.side_effect = [[b'id1', b'id2'], [b'id3']]
+    mock_redis_pipeline.execute.side_effect = [[1, 1], [0]]
+    assert await model.purge_expired() == 2
+    now = FROZEN_TS // 1000
+    mock_redis_client.zrangebyscore.assert_awaited_with(
+        settings.url_expiry_key, '-inf', now, 0, 2
+    )
+    key, field = model._url_record('id3')
+    mock_redis_pipeline.evalsha.assert_called_with(
+        scripts.purge_url.sha,
+        3,
+        key,
+        model._stats_key('id3'),
+        settings.url_expiry_key,
+        'id3',
+        now,
+        '',
+        'id3',
+        0,
+    )
+
+
+@pytest.mark.asyncio
+async def test_purge_expired_string_layout(mock_redis_client):
+    """Test purge_expired skips the string records expired by Redis."""
+    assert await model.purge_expired() == 0
+    mock_redis_client.zrangebyscore.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@patch.object(settings, 'url_dedup', True)
+async def test_create_short_urls_dedup(mock_redis_pipeline, mock_id_allocator):
+    """Test create_short_urls reuses the indexed IDs and creates a new URL once."""
+    new_url = 'https://example.org'
+    mock_id_allocator.allocate.return_value = ['id2']
+    mock_redis_pipeline.execute.side_effect = [[b'id1', None, None], [1], [1]]
+    result = await model.create_short_urls(
+        [FULL_URL, new_url, new_url], {'owner': 'me'}
+    )
+    assert result == ['id1', 'id2', 'id2']
+    mock_id_allocator.allocate.assert_awaited_once_with(1)
+    assert mock_redis_pipeline.hget.call_args_list == [
+        call(model._dedup_key(FULL_URL), 'owner=me'),
+        call(model._dedup_key(new_url), 'owner=me'),
+        call(model._dedup_key(new_url), 'owner=me'),
+    ]
+    mock_redis_pipeline.hsetnx.assert_called_once_with(
+        model._dedup_key(new_url), 'owner=me', 'id2'
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('script_result,expected_url_id', [(1, URL_ID), (0, None)])
+async def test_update_short_url(mock_redis_client, script_result, expected_url_id):
     """Test update_short_url success."""
-    mock_redis_client.get.return_value = get_result
+    mock_redis_client.evalsha.return_value = script_result
     result = await model.update_short_url(FULL_URL, URL_ID)
     assert result == expected_url_id
-    mock_redis_client.get.assert_awaited_with(URL_ID)
-    if get_result:
-        mock_redis_client.set.assert_awaited_with(URL_ID, FULL_URL)
-    else:
-        mock_redis_client.set.assert_not_awaited()
+    mock_redis_client.evalsha.assert_awaited_with(
+        scripts.update_url.sha,
+        2,
+        URL_ID,
+        model._stats_key(URL_ID),
+        '',
+        FULL_URL,
+        '',
+        URL_ID,
+        '',
+        0,
+    )
+
+
+@pytest.mark.asyncio
+async def test_update_short_url_invalidates_cache(mock_redis_client, url_cache):
+    """Test update_short_url removes the URL from the cache."""
+    url_cache.set(URL_ID, FULL_URL)
+    await model.update_short_url(FULL_URL, URL_ID)
+    assert url_cache.get(URL_ID) is None
+    assert mock_redis_client.evalsha.await_args[0][-4:] == (
+        settings.url_cache_channel,
+        URL_ID,
+        '',
+        0,
+    )
 
 
 @pytest.mark.asyncio
-@pytest.mark.parametrize('get_failed', [True, False])
-async def test_update_short_url_redis_error(mock_redis_client, get_failed):
+@patch.object(settings, 'url_dedup', True)
+async def test_update_short_url_dedup(mock_redis_client, mock_redis_pipeline):
+    """Test update_short_url moves the dedup index entries to the new URL."""
+    new_url = 'https://example.org'
+    mock_redis_client.get.return_value = FULL_URL_BYTES
+    mock_redis_client.evalsha.side_effect = [[b'owner=me'], 1]
+    assert await model.update_short_url(new_url, URL_ID) == URL_ID
+    assert mock_redis_client.evalsha.await_args_list[0] == call(
+        scripts.release_dedup.sha, 1, model._dedup_key(FULL_URL), URL_ID
+    )
+    mock_redis_pipeline.hsetnx.assert_called_once_with(
+        model._dedup_key(new_url), b'owner=me', URL_ID
+    )
+
+
+@pytest.mark.asyncio
+@patch.object(settings, 'url_dedup', True)
+async def test_delete_short_url_dedup(mock_redis_client):
+    """Test delete_short_url removes the URL from the dedup index first."""
+    mock_redis_client.get.return_value = FULL_URL_BYTES
+    mock_redis_client.evalsha.side_effect = [[b''], 1]
+    assert await model.delete_short_url(URL_ID) == URL_ID
+    assert [args[0][0] for args in mock_redis_client.evalsha.await_args_list] == [
+        scripts.release_dedup.sha,
+        scripts.delete_url.sha,
+    ]
+
+
+@pytest.mark.asyncio
+@freeze_time(FROZEN_TIME)
+@patch.object(settings, 'url_dedup', True)
+@patch.object(settings, 'url_layout', 'compact')
+async def test_delete_short_url_dedup_expired(mock_redis_client):
+    """Test the expired compact record isn't looked up in the dedup index."""
+    codec = UrlCodec(compact=True)
+    mock_redis_client.hget.return_value = codec.encode(FULL_URL, FROZEN_TS // 1000)
+    mock_redis_client.evalsha.return_value = 0
+    with patch.object(model, 'url_codec', codec):
+        assert await model.delete_short_url(URL_ID) is None
+        assert await model.update_short_url(FULL_URL, URL_ID) is None
+    assert [args[0][0] for args in mock_redis_client.evalsha.await_args_list] == [
+        scripts.delete_url.sha,
+        scripts.update_url.sha,
+    ]
+
+
+@pytest.mark.asyncio
+async def test_update_short_url_redis_error(mock_redis_client):
     """Test update_short_url raises HTTPException in case of RedisError raised."""
-    if get_failed:
-        mock_redis_client.get.side_effect = RedisError('Redis error')
-    mock_redis_client.set.side_effect = RedisError('Redis error')
+    mock_redis_client.evalsha.side_effect = RedisError('Redis error')
     with pytest.raises(HTTPException):
         await model.update_short_url(FULL_URL, URL_ID)
 
 
 @pytest.mark.asyncio
-@pytest.mark.parametrize(
-    'delete_result,expected_url_id', [(True, URL_ID), (False, None)]
-)
-async def test_delete_short_url(mock_redis_client, delete_result, expected_url_id):
-    """Test delete_short_url success."""
-    mock_redis_client.delete.return_value = delete_result
+@pytest.mark.parametrize('script_result,expected_url_id', [(1, URL_ID), (0, None)])
+async def test_delete_short_url(mock_redis_client, script_result, expected_url_id):
+    """Test delete_short_url deletes the record and its stats."""
+    mock_redis_client.evalsha.return_value = script_result
     result = await model.delete_short_url(URL_ID)
     assert result == expected_url_id
-    mock_redis_client.delete.assert_awaited_with(URL_ID)
+    mock_redis_client.evalsha.assert_awaited_with(
+        scripts.delete_url.sha,
+        2,
+        URL_ID,
+        model._stats_key(URL_ID),
+        '',
+        '',
+        URL_ID,
+        0,
+    )
+
+
+@pytest.mark.asyncio
+async def test_delete_short_url_invalidates_cache(mock_redis_client, url_cache):
+    """Test delete_short_url removes the URL from the cache."""
+    url_cache.set(URL_ID, FULL_URL)
+    await model.delete_short_url(URL_ID)
+    assert url_cache.get(URL_ID) is None
+    assert mock_redis_client.evalsha.await_args[0][-3:] == (
+        settings.url_cache_channel,
+        URL_ID,
+        0,
+    )
+
+
+@pytest.mark.asyncio
+@patch.object(settings, 'url_changelog', True)
+async def test_delete_short_url_changelog(mock_redis_client):
+    """Test delete_short_url appends the delete to the capped change log."""
+    await model.delete_short_url(URL_ID)
+    assert mock_redis_client.evalsha.await_args[0][-1] == settings.url_changelog_maxlen
+    assert mock_redis_client.evalsha.await_args[0][1:5] == (
+        3,
+        URL_ID,
+        model._stats_key(URL_ID),
+        settings.url_changelog_key,
+    )
 
 
 @pytest.mark.asyncio
 async def test_delete_short_url_redis_error(mock_redis_client):
     """Test delete_short_url raises HTTPException in case of RedisError raised."""
-    mock_redis_client.delete.side_effect = RedisError('Redis error')
+    mock_redis_client.evalsha.side_effect = RedisError('Redis error')
     with pytest.raises(HTTPException):
         await model.delete_short_url(URL_ID)
 
 
+@pytest.mark.asyncio
+@patch.object(settings, 'batch_chunk_size', 2)
+async def test_dump_stats(mock_redis_client, mock_redis_pipeline):
+    """Test dump_stats reads the whole labeled series with chunked TS.MRANGE."""
+    mock_redis_pipeline.execute.return_value = [
+        [{'id1:stats': [{'url_id': 'id1', 'owner': 'me'}, [(1, 1.0), (2, 2.0)]]}],
+        [],
+    ]
+    result = await model.dump_stats(mock_redis_client, ['id1', 'id2', 'id3'])
+    assert result == {'id1': ({'owner': 'me'}, [(1, 1), (2, 2)])}
+    assert mock_redis_pipeline.ts().mrange.call_args_list == [
+        call('-', '+', ['url_id=(id1,id2)'], with_labels=True),
+        call('-', '+', ['url_id=(id3)'], with_labels=True),
+    ]
+
+
+@pytest.mark.asyncio
+@freeze_time(FROZEN_TIME)
+async def test_restore_short_urls(mock_redis_pipeline):
+    """Test restore_short_urls keeps the url IDs and replaces the stats samples.
+
+    The stats samples of the existing records are skipped.
+    """
+    now = FROZEN_TS // 1000
+    mock_redis_pipeline.execute.side_effect = [[1, 0], [b'ok']]
+    links = [
+        dict(id='id1', url=FULL_URL, labels={'owner': 'me'}, stats=[(1000, 2)]),
+        dict(id='id2', url=FULL_URL, expires_at=now - 1),
+        dict(id='id3', url=FULL_URL, expires_at=now + 60, stats=[(1000, 5)]),
+    ]
+    assert await model.restore_short_urls(links) == 1
+    assert mock_redis_pipeline.evalsha.call_args_list == [
+        call(
+            scripts.create_url.sha,
+            2,
+            'id1',
+            model._stats_key('id1'),
+            '',
+            FULL_URL,
+            settings.stats_retention,
+            0,
+            0,
+            'id1',
+            'owner',
+            'me',
+            'url_id',
+            'id1',
+        ),
+        call(
+            scripts.create_url.sha,
+            2,
+            'id3',
+            model._stats_key('id3'),
+            '',
+            FULL_URL,
+            settings.stats_retention,
+            now + 60,
+            0,
+            'id3',
+            'url_id',
+            'id3',
+        ),
+    ]
+    mock_redis_pipeline.ts().add.assert_called_once_with(
+        model._stats_key('id1'),
+        1000,
+        2,
+        retention_msecs=settings.stats_retention,
+        labels={'owner': 'me', 'url_id': 'id1'},
+        duplicate_policy='last',
+    )
+
+
 def test_stats_key():
     """Test stats_key success."""
     result = model._stats_key(URL_ID)
     assert result == f'{URL_ID}:stats'
 
 
+@patch.object(settings, 'redis_hash_tags', True)
+def test_keys_hash_tags():
+    """Test the record and its stats keys share the hash tag."""
+    assert model._url_key(URL_ID) == f'{{{URL_ID}}}'
+    assert model._stats_key(URL_ID) == f'{{{URL_ID}}}:stats'
+    assert model._record_keys(URL_ID, *model._url_record(URL_ID)) == [
+        f'{{{URL_ID}}}',
+        f'{{{URL_ID}}}:stats',
+    ]
+
+
+@freeze_time(FROZEN_TIME)
+def test_ts_bucket():
+    """Test ts_bucket truncates the current time to the stats bucket."""
+    with freeze_time('2020-01-01T00:00:59'):
+        assert model._ts_bucket() == FROZEN_TS
+
+
 @freeze_time(FROZEN_TIME)
 def test_ts_24h_ago():
     """Test ts_24h_ago success."""
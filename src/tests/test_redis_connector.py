@@ -0,0 +1,111 @@
+"""Test the Redis connector."""
+
+import os
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from redis.exceptions import ConnectionError
+
+from urlshrtr import redis_connector
+from urlshrtr.config import settings
+
+
+def _connection_mock(**kwargs):
+    """Make a connected Connection mock."""
+    return MagicMock(
+        pid=os.getpid(), connect=AsyncMock(), can_read=AsyncMock(return_value=False)
+    )
+
+
+@pytest.mark.asyncio
+async def test_pool_stats():
+    """Test the pool counts the connections and fails fast when exhausted."""
+    pool = redis_connector.MonitoredConnectionPool(
+        max_connections=1, timeout=0.01, connection_class=_connection_mock
+    )
+    connection = await pool.get_connection('GET')
+    assert pool.stats() == dict(
+        max_connections=1, created=1, in_use=1, idle=0, waiting=0, timeouts=0
+    )
+    with pytest.raises(ConnectionError):
+        await pool.get_connection('GET')
+    await pool.release(connection)
+    assert pool.stats() == dict(
+        max_connections=1, created=1, in_use=0, idle=1, waiting=0, timeouts=1
+    )
+
+
+@pytest.mark.asyncio
+async def test_pool_stats_connect_error():
+    """Test a connection failing to connect isn't counted in use nor a timeout."""
+
+    def failing_connection(**kwargs):
+        connection = _connection_mock()
+        connection.connect.side_effect = ConnectionError('Connection refused')
+        return connection
+
+    pool = redis_connector.MonitoredConnectionPool(
+        max_connections=4, timeout=0.01, connection_class=failing_connection
+    )
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            await pool.get_connection('GET')
+    assert pool.stats() == dict(
+        max_connections=4, created=1, in_use=0, idle=1, waiting=0, timeouts=0
+    )
+
+
+@pytest.mark.asyncio
+async def test_connect_disconnect():
+    """Test the worker client is made once and closed with its pool."""
+    client = redis_connector.connect()
+    assert redis_connector.connect() is client
+    assert client.connection_pool.max_connections == settings.redis_max_connections
+    client.close = AsyncMock()
+    await redis_connector.disconnect()
+    client.close.assert_awaited_once_with(close_connection_pool=True)
+    assert redis_connector.redis_client is None
+    assert redis_connector.pool_stats()['created'] == 0
+
+
+@pytest.mark.asyncio
+@patch.object(settings, 'redis_shards', ['redis://a:6379/0', 'redis://b:6379/0'])
+async def test_connect_shards():
+    """Test a client is made per shard and the url IDs are grouped by shard."""
+    client = redis_connector.connect()
+    clients = redis_connector.get_clients()
+    assert len(clients) == 2 and clients[0] is client
+    url_ids = [f'id{i}' for i in range(10)]
+    groups = redis_connector.group_by_shard(url_ids)
+    assert sorted(i for _, positions in groups for i in positions) == list(range(10))
+    for shard, positions in groups:
+        assert all(redis_connector.get_client(url_ids[i]) is shard for i in positions)
+    await redis_connector.disconnect()
+    assert redis_connector.get_clients() == [None]
+
+
+@pytest.mark.asyncio
+@patch.object(settings, 'redis_replicas', [['redis://r1:6379/0', 'redis://r2:6379/0']])
+async def test_read_replicas():
+    """Test the reads are spread over the replicas round-robin."""
+    client = redis_connector.connect()
+    replicas = redis_connector.replica_clients[0]
+    reads = [redis_connector.get_read_client('id1') for _ in range(4)]
+    assert {id(read) for read in reads} == {id(replica) for replica in replicas}
+    assert reads[0] is not reads[1] and reads[0] is reads[2]
+    assert redis_connector.get_client('id1') is client
+    assert redis_connector.group_by_shard(['id1'], read=True)[0][0] in replicas
+    assert len(redis_connector.get_clients(replicas=True)) == 3
+    await redis_connector.disconnect()
+
+
+@pytest.mark.asyncio
+@patch.object(settings, 'redis_replica_policy', 'least_connections')
+@patch.object(settings, 'redis_replicas', [['redis://r1:6379/0', 'redis://r2:6379/0']])
+async def test_read_replicas_least_connections():
+    """Test the reads go to the replica with the fewest connections in use."""
+    redis_connector.connect()
+    busy, idle = redis_connector.replica_clients[0]
+    busy.connection_pool.in_use = 3
+    assert redis_connector.get_read_client('id1') is idle
+    await redis_connector.disconnect()
@@ -0,0 +1,79 @@
+"""Test the fast JSON responses."""
+
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from urlshrtr import responses
+from urlshrtr.app import app
+from urlshrtr.config import settings
+from urlshrtr.embedded import EmbeddedStorage
+from urlshrtr.schema import ShortUrlBatchItem, ShortUrlBatchResponse, ShortUrlResponse
+
+client = TestClient(app)
+
+EXPIRES_AT = datetime(2100, 1, 1, 12, 30, 15, 500, tzinfo=timezone.utc)
+
+
+def _requests():
+    """Send a request to every JSON endpoint, return the responses."""
+    created = client.post(
+        '/urls/', json={'url': 'https://example.com/ü?a=b+c', 'owner': 'me'}
+    )
+    url_id = created.json()['url_id']
+    return [
+        created,
+        client.post(
+            '/urls/batch',
+            json={'urls': ['https://example.com/1', 'invalid']},
+        ),
+        client.post('/urls/resolve', json={'url_ids': [url_id, 'missing']}),
+        client.post('/urls/views', json={'views': [{'url_id': url_id, 'count': 2}]}),
+        client.get(f'/urls/{url_id}/stats'),
+        client.post('/urls/stats', json={'owner': 'me'}),
+        client.put(
+            f'/urls/{url_id}',
+            json={'url': 'https://example.org', 'expires_at': EXPIRES_AT.isoformat()},
+        ),
+        client.delete(f'/urls/{url_id}'),
+        client.get('/health'),
+        client.get('/health/sweeper'),
+    ]
+
+
+@patch.object(settings, 'storage_backend', 'embedded')
+def test_same_responses(mock_id_allocator):
+    """Test the fast responses are the same as the FastAPI serialized ones."""
+    results = []
+    for fast in (False, True):
+        mock_id_allocator.allocate.side_effect = [['id1'], ['id2']]
+        with patch.object(settings, 'fast_json_responses', fast):
+            with patch('urlshrtr.storage.backend', EmbeddedStorage()):
+                results.append(_requests())
+    for default, fast in zip(*results):
+        assert fast.status_code == default.status_code == 200
+        assert fast.headers == default.headers
+        assert fast.content == default.content
+
+
+@pytest.mark.parametrize('orjson', [responses.orjson, None])
+def test_render(orjson):
+    """Test the dataclasses are rendered as the FastAPI default response."""
+    content = ShortUrlBatchResponse(
+        results=[
+            ShortUrlBatchItem(url='https://example.com/ü', url_id='abc123'),
+            ShortUrlBatchItem(url='invalid', error='invalid or missing URL scheme'),
+        ]
+    )
+    single = ShortUrlResponse(
+        url='https://example.com', url_id='abc123', expires_at=EXPIRES_AT
+    )
+    with patch.object(responses, 'orjson', orjson):
+        for data in (content, single):
+            default = responses.json_response(data, headers={})
+            with patch.object(settings, 'fast_json_responses', True):
+                fast = responses.json_response(data)
+            assert isinstance(fast, responses.FastJSONResponse)
+            assert fast.body == default.body
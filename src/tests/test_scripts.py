@@ -0,0 +1,38 @@
+"""Test the server-side Lua scripts."""
+
+from unittest.mock import AsyncMock
+
+import pytest
+from redis.exceptions import NoScriptError
+
+from urlshrtr import scripts
+
+
+@pytest.mark.asyncio
+async def test_script_call():
+    """Test the script is called with EVALSHA."""
+    client = AsyncMock()
+    client.evalsha.return_value = 1
+    assert await scripts.update_url(client, ['id1'], ['url', '', 'id1']) == 1
+    client.evalsha.assert_awaited_once_with(
+        scripts.update_url.sha, 1, 'id1', 'url', '', 'id1'
+    )
+    client.script_load.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_script_call_no_script():
+    """Test the script is loaded and called again on NOSCRIPT error."""
+    client = AsyncMock()
+    client.evalsha.side_effect = [NoScriptError('No script'), 1]
+    assert await scripts.delete_url(client, ['id1', 'id1:stats'], ['', 'id1']) == 1
+    client.script_load.assert_awaited_once_with(scripts.delete_url.source)
+    assert client.evalsha.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_load_scripts():
+    """Test all the scripts are loaded."""
+    client = AsyncMock()
+    await scripts.load_scripts(client)
+    assert client.script_load.await_count == len(scripts.SCRIPTS)
@@ -0,0 +1,34 @@
+"""Test the consistent hash ring."""
+
+import pytest
+
+from urlshrtr.sharding import HashRing
+
+KEYS = [f'id{i}' for i in range(1000)]
+
+
+def test_hash_ring_spreads_keys():
+    """Test the keys are spread over all the nodes."""
+    ring = HashRing(['a', 'b', 'c'])
+    nodes = [ring.get_node(key) for key in KEYS]
+    assert all(nodes.count(node) > 200 for node in range(3))
+
+
+def test_hash_ring_stable():
+    """Test the nodes order doesn't matter and a new node moves few keys."""
+    ring = HashRing(['a', 'b', 'c'])
+    reordered = HashRing(['c', 'a', 'b'])
+    assert all(
+        ring.nodes[ring.get_node(key)] == reordered.nodes[reordered.get_node(key)]
+        for key in KEYS
+    )
+    grown = HashRing(['a', 'b', 'c', 'd'])
+    moved = [key for key in KEYS if grown.get_node(key) != ring.get_node(key)]
+    assert all(grown.get_node(key) == 3 for key in moved)
+    assert len(moved) < len(KEYS) / 3
+
+
+def test_hash_ring_no_nodes():
+    """Test the ring can't be empty."""
+    with pytest.raises(ValueError):
+        HashRing([])
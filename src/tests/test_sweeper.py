@@ -0,0 +1,23 @@
+"""Test the periodic sweeper."""
+
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from urlshrtr.sweeper import Sweeper
+
+
+@pytest.mark.asyncio
+async def test_sweeper():
+    """Test the sweeps are run on the interval and the failures are counted."""
+    sweep = AsyncMock(side_effect=[3, Exception('Sweep error')] + [0] * 100)
+    sweeper = Sweeper(sweep, interval=0.001, name='Test')
+    sweeper.start()
+    while sweep.await_count < 3:
+        await asyncio.sleep(0.001)
+    await sweeper.stop()
+    stats = sweeper.stats()
+    assert stats['swept'] == 3
+    assert stats['failed'] == 1
+    assert stats['sweeps'] == sweep.await_count - 1
@@ -0,0 +1,223 @@
+"""Short url ID allocators."""
+
+import abc
+import asyncio
+import os
+import string
+import time
+from typing import Dict, List, Optional
+
+import nanoid
+from nanoid.resources import alphabet
+from redis.asyncio.client import Redis
+
+from urlshrtr import redis_connector
+from urlshrtr.config import settings
+
+BASE62_ALPHABET = string.digits + string.ascii_letters
+SNOWFLAKE_EPOCH = 1640995200000  # 2022-01-01T00:00:00 in msec
+SNOWFLAKE_WORKER_BITS = 10
+SNOWFLAKE_SEQUENCE_BITS = 12
+
+
+def encode_base62(number: int) -> str:
+    """Encode a non-negative number in base62.
+
+    Args:
+        number (int): The number to encode.
+
+    Returns:
+        str: The base62 encoded number.
+    """
+    chars = []
+    while True:
+        number, remainder = divmod(number, 62)
+        chars.append(BASE62_ALPHABET[remainder])
+        if not number:
+            return ''.join(reversed(chars))
+
+
+class IdAllocator(abc.ABC):
+    """A base short url ID allocator counting the allocations and collisions.
+
+    The allocated IDs are written with SET NX by the model layer, so a collision
+    with an existing record is never overwritten. It's reported back with
+    record_collision and a new ID is allocated.
+    """
+
+    def __init__(self):
+        """Init the allocator counters."""
+        self.allocations = 0
+        self.collisions = 0
+        self.started_at = time.monotonic()
+
+    async def allocate(self, count: int = 1) -> List[str]:
+        """Allocate new short url IDs.
+
+        Args:
+            count (int): The number of IDs to allocate.
+
+        Returns:
+            list: The allocated IDs.
+        """
+        url_ids = await self._allocate(count)
+        self.allocations += count
+        return url_ids
+
+    @abc.abstractmethod
+    async def _allocate(self, count: int) -> List[str]:
+        """Allocate new short url IDs, implemented by the subclasses."""
+
+    def record_collision(self, count: int = 1):
+        """Count the allocated IDs which are already taken.
+
+        Args:
+            count (int): The number of collisions.
+        """
+        self.collisions += count
+
+    def stats(self) -> Dict[str, float]:
+        """Get the allocator counters.
+
+        Returns:
+            dict: The allocations and collisions counters, the collision rate
+                and the allocations per second since the allocator start.
+        """
+        elapsed = time.monotonic() - self.started_at
+        return dict(
+            allocations=self.allocations,
+            collisions=self.collisions,
+            collision_rate=(
+                self.collisions / self.allocations if self.allocations else 0.0
+            ),
+            allocations_per_sec=self.allocations / elapsed if elapsed else 0.0,
+        )
+
+
+class RandomIdAllocator(IdAllocator):
+    """Random nanoid IDs of url_key_length chars.
+
+    No round-trips, but the collision rate grows with the number of links.
+    """
+
+    async def _allocate(self, count: int) -> List[str]:
+        """Generate the random IDs."""
+        return [
+            nanoid.generate(alphabet, settings.url_key_length) for _ in range(count)
+        ]
+
+
+class CounterIdAllocator(IdAllocator):
+    """Sequential base62 IDs leased from a Redis counter in blocks.
+
+    Every worker leases a block of block_size numbers with one INCRBY and
+    allocates IDs from it locally. The numbers start from 62 ** (length - 1),
+    so the IDs have at least url_key_length chars. The IDs are guessable.
+    """
+
+    def __init__(self, key: str, block_size: int, client: Optional[Redis] = None):
+        """Init the allocator.
+
+        Args:
+            key (str): The counter key.
+            block_size (int): The number of IDs leased at once.
+            client (Redis): The Redis client keeping the counter,
+                the worker client by default.
+        """
+        super().__init__()
+        self.key = key
+        self.block_size = block_size
+        self.client = client
+        self.offset = 62 ** (settings.url_key_length - 1)
+        self._next = 0
+        self._end = 0
+        self._lock = None
+
+    async def _allocate(self, count: int) -> List[str]:
+        """Allocate the IDs from the leased blocks, leasing new ones if needed."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._end - self._next < count:
+                lease_size = max(self.block_size, count)
+                client = self.client or redis_connector.redis_client
+                end = await client.incrby(self.key, lease_size)
+                self._next, self._end = end - lease_size, end
+            start, self._next = self._next, self._next + count
+        return [
+            encode_base62(self.offset + number)
+            for number in range(start, start + count)
+        ]
+
+
+class SnowflakeIdAllocator(IdAllocator):
+    """Time + worker + sequence IDs encoded in base62.
+
+    No round-trips and no collisions while the worker IDs are unique,
+    but the IDs are about 11 chars long.
+    """
+
+    def __init__(self, worker_id: int):
+        """Init the allocator.
+
+        Args:
+            worker_id (int): The worker ID, only the lower 10 bits are used.
+        """
+        super().__init__()
+        self.worker_id = worker_id % (1 << SNOWFLAKE_WORKER_BITS)
+        self._timestamp = 0
+        self._sequence = 0
+
+    async def _allocate(self, count: int) -> List[str]:
+        """Generate the IDs, waiting for the next ms if the sequence is over.
+
+        The state is updated and the ID is made before the wait, so the
+        concurrent allocations don't reuse the timestamp and the sequence.
+        """
+        url_ids = []
+        for _ in range(count):
+            timestamp = int(time.time() * 1000) - SNOWFLAKE_EPOCH
+            wrapped = False
+            if timestamp <= self._timestamp:
+                timestamp = self._timestamp
+                self._sequence = (self._sequence + 1) % (1 << SNOWFLAKE_SEQUENCE_BITS)
+                if not self._sequence:
+                    timestamp += 1
+                    wrapped = True
+            else:
+                self._sequence = 0
+            self._timestamp = timestamp
+            number = (
+                timestamp << (SNOWFLAKE_WORKER_BITS + SNOWFLAKE_SEQUENCE_BITS)
+                | self.worker_id << SNOWFLAKE_SEQUENCE_BITS
+                | self._sequence
+            )
+            url_ids.append(encode_base62(number))
+            if wrapped:
+                await asyncio.sleep(0.001)  # not to run ahead of the clock
+        return url_ids
+
+
+def make_allocator(name: str) -> IdAllocator:
+    """Make the short url ID allocator.
+
+    Args:
+        name (str): The allocator name: 'random', 'counter' or 'snowflake'.
+
+    Returns:
+        IdAllocator: The allocator.
+
+    Raises:
+        ValueError: if the allocator name is unknown.
+    """
+    if name == 'random':
+        return RandomIdAllocator()
+    if name == 'counter':
+        return CounterIdAllocator(settings.id_counter_key, settings.id_block_size)
+    if name == 'snowflake':
+        worker_id = settings.id_worker_id
+        return SnowflakeIdAllocator(os.getpid() if worker_id is None else worker_id)
+    raise ValueError(f'Unknown short url ID allocator: {name}')
+
+
+id_allocator = make_allocator(settings.id_allocator)
@@ -1,16 +1,99 @@
 """URL Shortener Application."""
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 
+from urlshrtr import metrics, model, redis_connector, storage
+from urlshrtr.allocator import id_allocator
+from urlshrtr.cache import url_cache
 from urlshrtr.config import settings
+from urlshrtr.fastpath import RedirectFastPath
 from urlshrtr.handlers import router
-from urlshrtr.schema import HealthCheckResponse
+from urlshrtr.responses import json_response
+from urlshrtr.schema import (
+    CacheStatsResponse,
+    HealthCheckResponse,
+    IdAllocatorStatsResponse,
+    IngestStatsResponse,
+    RedisPoolStatsResponse,
+    SweeperStatsResponse,
+)
 
 app = FastAPI(debug=settings.debug)
 app.include_router(router)
+if settings.redirect_fast_path:
+    app.add_middleware(RedirectFastPath)
+app.add_middleware(metrics.MetricsMiddleware)
+
+# the worker counters exported as the metrics, and by the /health endpoints
+worker_stats = {
+    'cache': url_cache.stats,
+    'ingest': model.click_ingestor.stats,
+    'sweeper': model.stats_sweeper.stats,
+    'purge': storage.backend.expiry_purger.stats,
+    'allocator': id_allocator.stats,
+    'redis_pool': redis_connector.pool_stats,
+}
+
+
+@app.on_event('startup')
+async def startup():
+    """Start the storage backend and the metrics updates of the worker."""
+    await storage.backend.start()
+    metrics.stats_updater.start(worker_stats)
+
+
+@app.on_event('shutdown')
+async def shutdown():
+    """Stop the storage backend and the metrics updates of the worker."""
+    await metrics.stats_updater.stop()
+    await storage.backend.stop()
+
+
+@app.get('/metrics', include_in_schema=False)
+def metrics_endpoint():
+    """Prometheus metrics of all the workers."""
+    metrics.update_stats(worker_stats)
+    content, content_type = metrics.render()
+    return Response(content, media_type=content_type)
 
 
 @app.get('/health', response_model=HealthCheckResponse)
 async def health():
     """Health check endpoint."""
-    return HealthCheckResponse()
+    return json_response(HealthCheckResponse())
+
+
+@app.get('/health/cache', response_model=CacheStatsResponse)
+async def cache_stats():
+    """In-process URL cache counters of the current worker."""
+    return json_response(CacheStatsResponse(**url_cache.stats()))
+
+
+@app.get('/health/ingest', response_model=IngestStatsResponse)
+async def ingest_stats():
+    """View events ingestion counters of the current worker."""
+    return json_response(IngestStatsResponse(**model.click_ingestor.stats()))
+
+
+@app.get('/health/sweeper', response_model=SweeperStatsResponse)
+async def sweeper_stats():
+    """Stats series sweeper counters of the current worker."""
+    return json_response(SweeperStatsResponse(**model.stats_sweeper.stats()))
+
+
+@app.get('/health/purge', response_model=SweeperStatsResponse)
+async def purge_stats():
+    """Expired links purge counters of the current worker."""
+    return json_response(SweeperStatsResponse(**storage.backend.expiry_purger.stats()))
+
+
+@app.get('/health/allocator', response_model=IdAllocatorStatsResponse)
+async def allocator_stats():
+    """Short url ID allocator counters of the current worker."""
+    return json_response(IdAllocatorStatsResponse(**id_allocator.stats()))
+
+
+@app.get('/health/redis', response_model=RedisPoolStatsResponse)
+async def redis_pool_stats():
+    """Redis connection pool counters of the current worker."""
+    return json_response(RedisPoolStatsResponse(**redis_connector.pool_stats()))
@@ -0,0 +1,190 @@
+"""Streaming bulk export and import of the ShortURL records and their stats.
+
+Usage:
+    python -m urlshrtr.backup_tool export PATH [--batch N] [--no-stats]
+    python -m urlshrtr.backup_tool import PATH [--batch N] [--concurrency N] [--restart]
+
+The links are dumped as NDJSON, one link per line with its url ID, raw URL,
+expiry time, extra stats labels and stats samples. The percent-encoded URLs
+of the dumps of the format version 1 are imported as well. The dump is gzipped if
+the path ends with .gz. The export scans the records of every shard with
+SCAN and pipelined MGETs, or HGETALLs of the compact layout buckets, and
+reads the stats series with one TS.MRANGE per batch_chunk_size links,
+so the memory use doesn't depend on the number of links.
+
+The import writes the batches of links to the shards of the configured
+hash ring, so the links can be moved to another cluster, layout or number
+of shards. The concurrent batches are written in one pipeline per shard.
+The number of the imported lines is kept in PATH.checkpoint after every
+round of the concurrent batches and the interrupted import resumes from it.
+The batches restored again don't overwrite the records or double the stats.
+"""
+
+import argparse
+import asyncio
+import gzip
+import itertools
+import json
+import os
+import time
+from typing import List, TextIO
+
+from redis.asyncio.client import Redis
+
+from urlshrtr import model, redis_connector, scripts
+from urlshrtr.compact import UrlCodec, make_codec, raw_url, scan_records
+from urlshrtr.config import settings
+
+PROGRESS_INTERVAL = 10  # sec between the progress reports
+
+
+class Progress:
+    """Reports the number of the processed links and the throughput."""
+
+    def __init__(self, action: str, interval: float = PROGRESS_INTERVAL):
+        """Init the progress report.
+
+        Args:
+            action (str): The action of the report, e.g. 'exported'.
+            interval (float): Min time in seconds between the reports.
+        """
+        self.action = action
+        self.interval = interval
+        self.count = 0
+        self.started = self.reported = time.monotonic()
+
+    def update(self, count: int):
+        """Add the processed links and report them if the interval has passed."""
+        self.count += count
+        if time.monotonic() - self.reported >= self.interval:
+            self.report()
+
+    def report(self):
+        """Print the number of the processed links and the throughput."""
+        self.reported = time.monotonic()
+        rate = self.count / max(self.reported - self.started, 1e-6)
+        print(f'{self.action} {self.count} links, {rate:.0f} links/s', flush=True)
+
+
+def _open(path: str, mode: str) -> TextIO:
+    """Open the dump file, gzipped if the path ends with .gz."""
+    if path.endswith('.gz'):
+        return gzip.open(path, f'{mode}t')
+    return open(path, mode)
+
+
+async def export_links(
+    clients: List[Redis], codec: UrlCodec, path: str, batch: int, stats: bool = True
+) -> int:
+    """Dump the links of every shard.
+
+    Args:
+        clients (list): The Redis clients of every shard.
+        codec (UrlCodec): The codec of the configured layout.
+        path (str): The dump file path.
+        batch (int): The number of the keys read in one pipeline.
+        stats (bool): Dump the stats labels and samples.
+
+    Returns:
+        int: The number of the dumped links.
+    """
+    progress = Progress('exported')
+    with _open(path, 'w') as dump_file:
+        for client in clients:
+            async for links in scan_records(client, codec, batch):
+                if stats and links:
+                    links_stats = await model.dump_stats(
+                        client, [link['id'] for link in links]
+                    )
+                    for link in links:
+                        if link['id'] in links_stats:
+                            link['labels'], link['stats'] = links_stats[link['id']]
+                dump_file.writelines(json.dumps(link) + '\n' for link in links)
+                progress.update(len(links))
+    progress.report()
+    return progress.count
+
+
+def _read_link(line: str) -> dict:
+    """Read the link of the dump line, the URL is converted to the raw one."""
+    link = json.loads(line)
+    link['url'] = raw_url(link['url'])
+    return link
+
+
+async def import_links(
+    path: str, batch: int, concurrency: int, restart: bool = False
+) -> int:
+    """Restore the dumped links, resuming from the checkpoint.
+
+    Args:
+        path (str): The dump file path.
+        batch (int): The number of the links written in one pipeline per shard.
+        concurrency (int): The number of the batches written concurrently.
+        restart (bool): Ignore the checkpoint and import from the start.
+
+    Returns:
+        int: The number of the created records.
+    """
+    checkpoint_path = f'{path}.checkpoint'
+    done = 0
+    if not restart and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as checkpoint_file:
+            done = int(checkpoint_file.read())
+    progress = Progress('imported')
+    created = 0
+    with _open(path, 'r') as dump_file:
+        lines = itertools.islice(dump_file, done, None)
+        while True:
+            batches = [
+                [_read_link(line) for line in itertools.islice(lines, batch)]
+                for _ in range(concurrency)
+            ]
+            batches = [links for links in batches if links]
+            if not batches:
+                break
+            created += sum(
+                await asyncio.gather(*map(model.restore_short_urls, batches))
+            )
+            done += sum(map(len, batches))
+            with open(checkpoint_path, 'w') as checkpoint_file:
+                checkpoint_file.write(str(done))
+            progress.update(sum(map(len, batches)))
+    progress.report()
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return created
+
+
+async def main(args: argparse.Namespace):
+    """Run the tool command."""
+    redis_connector.connect()
+    try:
+        clients = redis_connector.get_clients()
+        if args.command == 'export':
+            codec = make_codec(settings.url_compression_dictionary)
+            await export_links(clients, codec, args.path, args.batch, args.stats)
+        elif args.command == 'import':
+            for client in clients:
+                await scripts.load_scripts(client)
+            created = await import_links(
+                args.path, args.batch, args.concurrency, args.restart
+            )
+            print(f'created {created} links')
+    finally:
+        await redis_connector.disconnect()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help='dump all the links')
+    export_parser.add_argument('path')
+    export_parser.add_argument('--batch', type=int, default=settings.batch_chunk_size)
+    export_parser.add_argument('--no-stats', dest='stats', action='store_false')
+    import_parser = commands.add_parser('import', help='restore the dumped links')
+    import_parser.add_argument('path')
+    import_parser.add_argument('--batch', type=int, default=settings.batch_chunk_size)
+    import_parser.add_argument('--concurrency', type=int, default=8)
+    import_parser.add_argument('--restart', action='store_true')
+    asyncio.run(main(parser.parse_args()))
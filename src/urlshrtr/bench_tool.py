@@ -0,0 +1,545 @@
+"""Benchmarks of the API endpoints and the hot paths.
+
+Usage:
+    python -m urlshrtr.bench_tool load [--requests N] [--concurrency N] [--links N]
+        [--zipf S] [--seed N] [--output PATH]
+    python -m urlshrtr.bench_tool redirect [--requests N] [--concurrency N]
+        [--links N] [--zipf S] [--seed N] [--output PATH]
+    python -m urlshrtr.bench_tool micro [--requests N] [--output PATH]
+    python -m urlshrtr.bench_tool metrics [--requests N]
+    python -m urlshrtr.bench_tool compare BASELINE RESULTS [--threshold RATIO]
+
+The load benchmark calls the ASGI application in-process with the configured
+storage backend: STORAGE_BACKEND=embedded runs without Redis, the Redis
+backend runs against the configured Redis, e.g. a local instance, and counts
+the Redis commands per request from INFO commandstats of all the shards.
+The redirects, the resolves and the stats reads pick the links of the
+populated set with a Zipf distribution, so a few links are hot like in
+a real traffic. Every scenario reports the p50 and p99 latency, the throughput,
+the errors and the Redis commands per request. The redirect benchmark runs
+the redirect scenario through the FastAPI route and the raw ASGI fast path.
+
+The micro benchmarks time the URL encoding of the model layer, the redirect
+Location header and the short url ID allocators. The metrics benchmark
+measures the metrics recording overhead on the redirect path, set
+PROMETHEUS_MULTIPROC_DIR to an empty directory to measure the gunicorn
+multiprocess mode.
+
+The results are written as JSON. compare exits with an error if the latency,
+the time per operation or the Redis commands per request of any benchmark
+grew, or its throughput dropped, by more than the threshold ratio.
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from itertools import accumulate
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+from starlette.middleware import Middleware
+
+from urlshrtr import redis_connector, storage
+from urlshrtr.allocator import RandomIdAllocator, SnowflakeIdAllocator, encode_base62
+from urlshrtr.app import app
+from urlshrtr.compact import UrlCodec
+from urlshrtr.config import settings
+from urlshrtr.error import handle_redis_errors
+from urlshrtr.fastpath import RedirectFastPath, location
+from urlshrtr.metrics import MetricsMiddleware
+
+URL = 'https://example.com'
+LONG_URL = 'https://www.example.com/products/shoes?utm_source=news&utm_medium=email'
+BATCH_SIZE = 100  # items in one bulk request
+LOWER_IS_BETTER = ('p50_ms', 'p99_ms', 'us_per_op', 'redis_commands_per_request')
+HIGHER_IS_BETTER = ('throughput',)
+
+Request = Tuple[str, str, Optional[dict]]
+
+
+async def call(app, method: str, path: str, body: Optional[dict] = None) -> int:
+    """Call the ASGI application with an HTTP request.
+
+    Args:
+        app: The ASGI application.
+        method (str): The HTTP method.
+        path (str): The request path.
+        body (dict): The JSON body.
+
+    Returns:
+        int: The response status code.
+    """
+    payload = json.dumps(body).encode() if body is not None else b''
+    headers = [(b'host', b'localhost'), (b'content-length', str(len(payload)).encode())]
+    if body is not None:
+        headers.append((b'content-type', b'application/json'))
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': headers,
+        'client': ('127.0.0.1', 0),
+        'server': ('localhost', 80),
+    }
+    status = 500
+    received = False
+
+    async def receive():
+        nonlocal received
+        if received:
+            return {'type': 'http.disconnect'}
+        received = True
+        return {'type': 'http.request', 'body': payload, 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await app(scope, receive, send)
+    return status
+
+
+def zipf_sampler(
+    items: List[str], exponent: float, rng: random.Random
+) -> Callable[[int], List[str]]:
+    """Make a sampler of the items with a Zipf distribution of the ranks.
+
+    Args:
+        items (list): The items, the first ones are the most frequent.
+        exponent (float): The distribution exponent, 0 for the uniform one.
+        rng (Random): The random generator.
+
+    Returns:
+        callable: The function sampling the given number of the items.
+    """
+    cum_weights = list(
+        accumulate(1 / rank**exponent for rank in range(1, len(items) + 1))
+    )
+    return lambda count: rng.choices(items, cum_weights=cum_weights, k=count)
+
+
+def scenarios(
+    sample: Callable[[int], List[str]], rng: random.Random
+) -> Dict[str, Callable[[], Request]]:
+    """Make the request generators of the load scenarios.
+
+    Args:
+        sample (callable): The sampler of the populated url IDs.
+        rng (Random): The random generator of the created URLs.
+
+    Returns:
+        dict: The functions making the next request by the scenario name.
+    """
+
+    def new_url() -> str:
+        return f'{URL}/{rng.getrandbits(64):x}'
+
+    return {
+        'redirect': lambda: ('GET', f'/urls/{sample(1)[0]}', None),
+        'create': lambda: ('POST', '/urls/', {'url': new_url()}),
+        'batch_create': lambda: (
+            'POST',
+            '/urls/batch',
+            {'urls': [new_url() for _ in range(BATCH_SIZE)]},
+        ),
+        'resolve': lambda: ('POST', '/urls/resolve', {'url_ids': sample(BATCH_SIZE)}),
+        'stats': lambda: ('GET', f'/urls/{sample(1)[0]}/stats', None),
+        'batch_stats': lambda: ('POST', '/urls/stats', {'url_ids': sample(BATCH_SIZE)}),
+    }
+
+
+async def redis_commands() -> Optional[int]:
+    """Get the number of the commands processed by all the Redis shards.
+
+    Returns:
+        int: The total number of the calls or None for the embedded backend.
+    """
+    if settings.storage_backend != 'redis':
+        return None
+    total = 0
+    for client in redis_connector.get_clients():
+        stats = await client.info('commandstats')
+        total += sum(command['calls'] for command in stats.values())
+    return total
+
+
+async def run_scenario(
+    app, make_request: Callable[[], Request], requests: int, concurrency: int
+) -> Dict[str, Optional[float]]:
+    """Send the requests of the scenario by the concurrent clients.
+
+    Args:
+        app: The ASGI application.
+        make_request (callable): The function making the next request.
+        requests (int): The number of the requests.
+        concurrency (int): The number of the concurrent clients.
+
+    Returns:
+        dict: The requests, the errors, the p50 and p99 latency in ms,
+            the throughput per second and the Redis commands per request.
+    """
+    latencies = []
+    errors = 0
+    remaining = requests
+
+    async def client():
+        nonlocal errors, remaining
+        while remaining > 0:
+            remaining -= 1
+            method, path, body = make_request()
+            started = perf_counter()
+            status = await call(app, method, path, body)
+            latencies.append(perf_counter() - started)
+            errors += status >= 400
+
+    commands = await redis_commands()
+    started = perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = perf_counter() - started
+    if commands is not None:
+        commands = (await redis_commands() - commands) / requests
+    latencies.sort()
+    return dict(
+        requests=requests,
+        errors=errors,
+        p50_ms=latencies[len(latencies) // 2] * 1000,
+        p99_ms=latencies[int(len(latencies) * 0.99)] * 1000,
+        throughput=requests / elapsed,
+        redis_commands_per_request=commands,
+    )
+
+
+def with_fast_path(app, fast_path: bool):
+    """Copy the application with or without the redirect fast path middleware.
+
+    The fast path is the innermost user middleware like in the application
+    module, so both the variants run through the same metrics middleware.
+
+    Args:
+        app: The FastAPI application.
+        fast_path (bool): Serve the redirects by the raw ASGI fast path.
+
+    Returns:
+        The application copy sharing the router of the application.
+    """
+    app = copy.copy(app)
+    app.user_middleware = [
+        middleware
+        for middleware in app.user_middleware
+        if middleware.cls is not RedirectFastPath
+    ]
+    if fast_path:
+        app.user_middleware.append(Middleware(RedirectFastPath))
+    app.middleware_stack = app.build_middleware_stack()
+    return app
+
+
+async def run_load(
+    app,
+    requests: int,
+    concurrency: int,
+    links: int,
+    exponent: float,
+    seed: int,
+    names: Optional[List[str]] = None,
+    fast_path: bool = False,
+) -> Dict[str, Dict[str, Optional[float]]]:
+    """Populate the links and run the load scenarios against the application.
+
+    Args:
+        app: The ASGI application, started and stopped by the benchmark.
+        requests (int): The number of the requests per scenario.
+        concurrency (int): The number of the concurrent clients.
+        links (int): The number of the populated links.
+        exponent (float): The Zipf distribution exponent of the link lookups.
+        seed (int): The random seed.
+        names (list): The scenarios to run, all by default.
+        fast_path (bool): Serve the redirects by the raw ASGI fast path.
+
+    Returns:
+        dict: The results by the scenario name.
+    """
+    rng = random.Random(seed)
+    handler = with_fast_path(app, fast_path)
+    await app.router.startup()
+    try:
+        url_ids = []
+        for start in range(0, links, settings.batch_max_size):
+            count = min(settings.batch_max_size, links - start)
+            url_ids.extend(
+                await storage.backend.create_short_urls(
+                    [f'{URL}/{start + i}' for i in range(count)]
+                )
+            )
+        sample = zipf_sampler([url_id for url_id in url_ids if url_id], exponent, rng)
+        return {
+            name: await run_scenario(handler, make_request, requests, concurrency)
+            for name, make_request in scenarios(sample, rng).items()
+            if not names or name in names
+        }
+    finally:
+        await app.router.shutdown()
+
+
+async def run_redirect(
+    app, requests: int, concurrency: int, links: int, exponent: float, seed: int
+) -> Dict[str, Dict[str, Optional[float]]]:
+    """Run the redirect scenario through the route and the fast path.
+
+    Returns:
+        dict: The results of the route and the fast_path redirects.
+    """
+    return {
+        name: (
+            await run_load(
+                app,
+                requests,
+                concurrency,
+                links,
+                exponent,
+                seed,
+                ['redirect'],
+                fast_path,
+            )
+        )['redirect']
+        for name, fast_path in (('route', False), ('fast_path', True))
+    }
+
+
+async def _time_call(func, requests: int) -> float:
+    """Get the mean time of the coroutine function call in seconds."""
+    started = perf_counter()
+    for _ in range(requests):
+        await func()
+    return (perf_counter() - started) / requests
+
+
+def _time_op(func, requests: int) -> float:
+    """Get the mean time of the function call in seconds."""
+    started = perf_counter()
+    for _ in range(requests):
+        func()
+    return (perf_counter() - started) / requests
+
+
+async def run_micro(requests: int) -> Dict[str, Dict[str, float]]:
+    """Time the URL encoding and the short url ID allocation.
+
+    Args:
+        requests (int): The number of the timed calls.
+
+    Returns:
+        dict: The microseconds per operation by the benchmark name.
+    """
+    codec = UrlCodec(compact=True, compression=True)
+    string_codec = UrlCodec(compact=False)
+    value = LONG_URL.encode()
+    encoded = codec.encode(LONG_URL)
+    random_allocator = RandomIdAllocator()
+    snowflake_allocator = SnowflakeIdAllocator(1)
+    timings = {
+        'string_decode': _time_op(lambda: string_codec.decode(value), requests),
+        'location_header': _time_op(lambda: location.__wrapped__(LONG_URL), requests),
+        'compact_encode': _time_op(lambda: codec.encode(LONG_URL), requests),
+        'compact_decode': _time_op(lambda: codec.decode(encoded), requests),
+        'encode_base62': _time_op(lambda: encode_base62(time.time_ns()), requests),
+        'random_id': await _time_call(random_allocator.allocate, requests),
+        'snowflake_id': await _time_call(snowflake_allocator.allocate, requests),
+    }
+    return {name: dict(us_per_op=timing * 1e6) for name, timing in timings.items()}
+
+
+async def redirect(scope, receive, send):
+    """A redirect ASGI application, the router sets the endpoint the same way."""
+    scope['endpoint'] = redirect
+    await send(
+        {
+            'type': 'http.response.start',
+            'status': 307,
+            'headers': [(b'location', URL.encode())],
+        }
+    )
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def get_short_url() -> str:
+    """A model layer lookup served from the cache."""
+    return URL
+
+
+async def _time_app(app, requests: int) -> float:
+    """Get the mean time of the application call in seconds."""
+    started = perf_counter()
+    for _ in range(requests):
+        await call(app, 'GET', '/urls/abc123')
+    return (perf_counter() - started) / requests
+
+
+async def measure_overhead(requests: int) -> Dict[str, Tuple[float, float]]:
+    """Measure the redirect path with and without the metrics recording.
+
+    A minimal redirect ASGI application is called with and without
+    the metrics middleware, and a model layer coroutine with and without
+    the recording handle_redis_errors decorator.
+
+    Args:
+        requests (int): The number of the timed calls.
+
+    Returns:
+        dict: The mean time in seconds without and with the metrics
+            of the request middleware and the model layer decorator.
+    """
+    return {
+        'middleware': (
+            await _time_app(redirect, requests),
+            await _time_app(MetricsMiddleware(redirect), requests),
+        ),
+        'model': (
+            await _time_call(get_short_url, requests),
+            await _time_call(handle_redis_errors(get_short_url), requests),
+        ),
+    }
+
+
+def compare(baseline: dict, results: dict, threshold: float) -> List[str]:
+    """Compare the benchmark results with the baseline.
+
+    Args:
+        baseline (dict): The baseline results file content.
+        results (dict): The compared results file content.
+        threshold (float): Max relative change of a metric, e.g. 0.1 for 10%.
+
+    Returns:
+        list: The regressions, empty if there are none.
+    """
+    regressions = []
+    for name, baseline_metrics in baseline['results'].items():
+        for metric, value in results['results'].get(name, {}).items():
+            base = baseline_metrics.get(metric)
+            if not base or value is None:
+                continue
+            change = value / base - 1
+            if (metric in LOWER_IS_BETTER and change > threshold) or (
+                metric in HIGHER_IS_BETTER and -change > threshold
+            ):
+                regressions.append(
+                    f'{name} {metric}: {base:.3f} -> {value:.3f} ({change:+.1%})'
+                )
+    return regressions
+
+
+def _save(path: Optional[str], benchmark: str, config: dict, results: dict):
+    """Print the results and write them to the JSON file."""
+    for name, result in results.items():
+        print(name, json.dumps(result))
+    if path:
+        report = dict(
+            benchmark=benchmark,
+            started_at=datetime.now(timezone.utc).isoformat(),
+            storage_backend=settings.storage_backend,
+            config=config,
+            results=results,
+        )
+        with open(path, 'w') as results_file:
+            json.dump(report, results_file, indent=2)
+
+
+async def main(args: argparse.Namespace) -> int:
+    """Run the tool command.
+
+    Returns:
+        int: The exit code, 1 if compare found regressions.
+    """
+    if args.command == 'load':
+        config = dict(
+            requests=args.requests,
+            concurrency=args.concurrency,
+            links=args.links,
+            zipf=args.zipf,
+            seed=args.seed,
+        )
+        results = await run_load(
+            app,
+            args.requests,
+            args.concurrency,
+            args.links,
+            args.zipf,
+            args.seed,
+            args.scenario,
+        )
+        _save(args.output, 'load', config, results)
+    elif args.command == 'redirect':
+        config = dict(
+            requests=args.requests,
+            concurrency=args.concurrency,
+            links=args.links,
+            zipf=args.zipf,
+            seed=args.seed,
+        )
+        results = await run_redirect(
+            app, args.requests, args.concurrency, args.links, args.zipf, args.seed
+        )
+        _save(args.output, 'redirect', config, results)
+        speedup = results['fast_path']['throughput'] / results['route']['throughput']
+        print(f'fast path speedup {speedup:.1f}x')
+    elif args.command == 'micro':
+        results = await run_micro(args.requests)
+        _save(args.output, 'micro', dict(requests=args.requests), results)
+    elif args.command == 'metrics':
+        for name, (bare, recorded) in (await measure_overhead(args.requests)).items():
+            print(
+                f'{name}: {bare * 1e6:.2f} us, with metrics {recorded * 1e6:.2f} us,'
+                f' overhead {(recorded - bare) * 1e6:.2f} us per request'
+            )
+    elif args.command == 'compare':
+        with open(args.baseline) as baseline_file, open(args.results) as results_file:
+            regressions = compare(
+                json.load(baseline_file), json.load(results_file), args.threshold
+            )
+        for regression in regressions:
+            print(regression)
+        print(f'{len(regressions)} regressions over {args.threshold:.0%}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    load_parser = commands.add_parser('load', help='load test the endpoints')
+    load_parser.add_argument('--requests', type=int, default=10000)
+    load_parser.add_argument('--concurrency', type=int, default=32)
+    load_parser.add_argument('--links', type=int, default=100000)
+    load_parser.add_argument('--zipf', type=float, default=1.1)
+    load_parser.add_argument('--seed', type=int, default=1)
+    load_parser.add_argument('--scenario', action='append', help='run only these')
+    load_parser.add_argument('--output')
+    redirect_parser = commands.add_parser('redirect', help='route vs fast path')
+    redirect_parser.add_argument('--requests', type=int, default=10000)
+    redirect_parser.add_argument('--concurrency', type=int, default=32)
+    redirect_parser.add_argument('--links', type=int, default=100000)
+    redirect_parser.add_argument('--zipf', type=float, default=1.1)
+    redirect_parser.add_argument('--seed', type=int, default=1)
+    redirect_parser.add_argument('--output')
+    micro_parser = commands.add_parser('micro', help='time the hot functions')
+    micro_parser.add_argument('--requests', type=int, default=100000)
+    micro_parser.add_argument('--output')
+    metrics_parser = commands.add_parser('metrics', help='metrics overhead')
+    metrics_parser.add_argument('--requests', type=int, default=100000)
+    compare_parser = commands.add_parser('compare', help='compare with a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('results')
+    compare_parser.add_argument('--threshold', type=float, default=0.2)
+    sys.exit(asyncio.run(main(parser.parse_args())))
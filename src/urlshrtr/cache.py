@@ -0,0 +1,115 @@
+"""In-process cache for the ShortURL records."""
+
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from urlshrtr.config import settings
+
+EVICTION_POLICIES = ('lru', 'fifo')
+
+
+class UrlCache:
+    """A bounded per-worker url_id -> url cache with TTL.
+
+    When the cache is full, the least recently used ('lru') or the oldest
+    inserted ('fifo') record is evicted. A cache with maxsize 0 is disabled.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, policy: str = 'lru'):
+        """Init the cache.
+
+        Args:
+            maxsize (int): Max number of cached records, 0 disables the cache.
+            ttl (float): Record time to live in seconds.
+            policy (str): Eviction policy, 'lru' or 'fifo'.
+
+        Raises:
+            ValueError: if the eviction policy is unknown.
+        """
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f'Unknown cache eviction policy: {policy}')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._records: OrderedDict = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        """Check if the cache is enabled."""
+        return self.maxsize > 0
+
+    def get(self, url_id: str) -> Optional[str]:
+        """Get the cached URL.
+
+        Args:
+            url_id (str): The short url ID.
+
+        Returns:
+            str: The cached URL or None if it's missing or expired.
+        """
+        if not self.enabled:
+            return None
+        record = self._records.get(url_id)
+        if record is None:
+            self.misses += 1
+            return None
+        url, expires_at = record
+        if expires_at <= time.monotonic():
+            del self._records[url_id]
+            self.misses += 1
+            return None
+        if self.policy == 'lru':
+            self._records.move_to_end(url_id)
+        self.hits += 1
+        return url
+
+    def set(self, url_id: str, url: str):
+        """Put the URL to the cache, evicting the records over the maxsize.
+
+        Args:
+            url_id (str): The short url ID.
+            url (str): The URL to cache.
+        """
+        if not self.enabled:
+            return
+        self._records.pop(url_id, None)
+        self._records[url_id] = (url, time.monotonic() + self.ttl)
+        while len(self._records) > self.maxsize:
+            self._records.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, url_id: str):
+        """Remove the URL from the cache.
+
+        Args:
+            url_id (str): The short url ID.
+        """
+        self._records.pop(url_id, None)
+
+    def clear(self):
+        """Remove all the records from the cache."""
+        self._records.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Get the cache counters.
+
+        Returns:
+            dict: The hits, misses, evictions counters and the cache size.
+        """
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            size=len(self._records),
+        )
+
+
+url_cache = UrlCache(
+    maxsize=settings.url_cache_size if settings.url_cache_enabled else 0,
+    ttl=settings.url_cache_ttl,
+    policy=settings.url_cache_policy,
+)
@@ -0,0 +1,326 @@
+"""Memory-compact layout of the ShortURL records.
+
+The records are kept as fields of url_buckets small Redis hashes, so they
+are listpack encoded and don't pay the per-key overhead. The hash buckets
+should fit the hash-max-listpack-entries and hash-max-listpack-value
+Redis settings, e.g. about 100 links per bucket and 256 bytes per value.
+The URLs are stored as raw UTF-8, the long ones are deflated with a preset
+dictionary. The hash fields have no native TTL, so the expiry time of
+an expiring link is kept in its value.
+
+The string layout values are raw UTF-8 too since the format version 2.
+The version 1 values are percent-encoded with quote_plus, they're read
+as well and migrated by the model layer on read.
+"""
+
+import re
+import time
+import zlib
+from collections import Counter
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+from urllib import parse
+
+from redis.asyncio.client import Redis
+
+from urlshrtr.config import settings
+
+DEFLATED = b'\x01'  # a raw URL never starts with a control char
+EXPIRING = b'\x02'  # followed by the 4 bytes expiry unix time
+URL_TOKEN = re.compile(r'[^/?&=#.]+[/?&=#.]?')
+DEFAULT_DICTIONARY = (
+    b'.html.php.aspx.pdf.jpg.png?id=&page=&ref=&lang=en'
+    b'&utm_term=&utm_content=&utm_campaign=&utm_medium=&utm_source='
+    b'.co.uk/.io/.org/.net/.com/index/news/blog/products/'
+    b'https://docs.https://m.https://www.http://www.https://'
+)
+
+
+class UrlCodec:
+    """Encodes the URLs stored by the model layer.
+
+    The raw URLs are stored as is in the string layout, or percent-encoded
+    in the format version 1. In the compact layout they are deflated with
+    the dictionary if they are at least min_length bytes long and it
+    makes them shorter. The deflated values are tagged with the dictionary
+    checksum, so a value deflated with another dictionary is never
+    decoded silently. The value of an expiring link is prefixed with
+    its expiry time and decoded as a missing link once it's expired.
+    """
+
+    def __init__(
+        self,
+        compact: bool,
+        raw: bool = True,
+        compression: bool = False,
+        min_length: int = 64,
+        dictionary: bytes = DEFAULT_DICTIONARY,
+    ):
+        """Init the codec.
+
+        Args:
+            compact (bool): Use the compact layout values.
+            raw (bool): Store the string layout URLs as raw UTF-8 (version 2),
+                percent-encoded otherwise (version 1).
+            compression (bool): Deflate the long URLs.
+            min_length (int): Min length in bytes of the deflated URLs.
+            dictionary (bytes): The preset deflate dictionary.
+        """
+        self.compact = compact
+        self.raw = raw
+        self.compression = compression
+        self.min_length = min_length
+        self.dictionary = dictionary
+        self.tag = (zlib.crc32(dictionary) & 0xFFFF).to_bytes(2, 'big')
+
+    def encode(self, url: str, expires_at: Optional[int] = None):
+        """Encode the URL for Redis.
+
+        Args:
+            url (str): The raw URL.
+            expires_at (int): The link expiry unix time, kept in the value
+                in the compact layout only.
+
+        Returns:
+            The value to store, the URL string in the default layout.
+        """
+        if not self.compact:
+            return url if self.raw else parse.quote_plus(url)
+        value = url.encode()
+        if self.compression and len(value) >= self.min_length:
+            compressor = zlib.compressobj(
+                9, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=self.dictionary
+            )
+            deflated = compressor.compress(value) + compressor.flush()
+            if len(deflated) + 3 < len(value):
+                value = DEFLATED + self.tag + deflated
+        if expires_at:
+            value = EXPIRING + expires_at.to_bytes(4, 'big') + value
+        return value
+
+    def decode(self, value: bytes) -> Optional[str]:
+        """Decode the value stored in Redis to the raw URL.
+
+        Args:
+            value (bytes): The stored value of any format version.
+
+        Returns:
+            str: The raw URL or None if the link is expired.
+
+        Raises:
+            ValueError: if the value is deflated with another dictionary.
+        """
+        if not self.compact:
+            return raw_url(value.decode())
+        if value.startswith(EXPIRING):
+            if is_expired(value):
+                return None
+            value = value[5:]
+        if value.startswith(DEFLATED):
+            if value[1:3] != self.tag:
+                raise ValueError('The URL is deflated with another dictionary')
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=self.dictionary)
+            value = decompressor.decompress(value[3:]) + decompressor.flush()
+        return value.decode()
+
+    def is_legacy(self, value: bytes) -> bool:
+        """Check if the value should be migrated to the raw URL format.
+
+        Args:
+            value (bytes): The stored value.
+
+        Returns:
+            bool: True for a version 1 string layout value read
+                in the version 2 format.
+        """
+        return self.raw and not self.compact and b':' not in value
+
+
+def is_expired(value: bytes) -> bool:
+    """Check if the compact record value is expired.
+
+    Args:
+        value (bytes): The stored compact value.
+
+    Returns:
+        bool: True if the expiry of the expiring value has passed.
+    """
+    return (
+        value.startswith(EXPIRING) and int.from_bytes(value[1:5], 'big') <= time.time()
+    )
+
+
+def raw_url(value: str) -> str:
+    """Get the raw URL of a string layout value of any format version.
+
+    The version 1 values are percent-encoded with quote_plus, so they never
+    contain ':', while the raw http(s) URLs always have it after the scheme.
+
+    Args:
+        value (str): The stored value.
+
+    Returns:
+        str: The raw URL.
+    """
+    return value if ':' in value else parse.unquote_plus(value)
+
+
+def url_record(url_id: str, key: str) -> Tuple[str, str]:
+    """Get the Redis key and the hash field of the ShortURL record.
+
+    Args:
+        url_id (str): The short url ID.
+        key (str): The Redis key of the default layout.
+
+    Returns:
+        tuple: The hash bucket key and the url ID in the compact layout,
+            the default layout key and an empty field otherwise.
+    """
+    if settings.url_layout != 'compact':
+        return key, ''
+    bucket = zlib.crc32(url_id.encode()) % settings.url_buckets
+    return f'{settings.url_bucket_prefix}{bucket}', url_id
+
+
+def record_url_id(key: bytes) -> str:
+    """Get the url ID of the string record key.
+
+    Args:
+        key (bytes): The Redis key.
+
+    Returns:
+        str: The url ID, '' for the keys of the other records.
+    """
+    key = key.decode()
+    if key.startswith('{') and key.endswith('}'):
+        key = key[1:-1]
+    return '' if ':' in key or '{' in key else key
+
+
+async def scan_records(
+    client: Redis, codec: UrlCodec, batch: int
+) -> AsyncIterator[List[dict]]:
+    """Scan the ShortURL records of the shard in the configured layout.
+
+    The keys are read with pipelined MGETs and TTLs, or HGETALLs of the
+    compact layout buckets. The expired links are skipped.
+
+    Args:
+        client (Redis): The shard Redis client.
+        codec (UrlCodec): The codec of the configured layout.
+        batch (int): The number of the keys read in one pipeline.
+
+    Yields:
+        list: The batch of the links, dicts of the url ID, the raw URL
+            and the expiry unix time of the expiring links.
+    """
+    if settings.url_layout == 'compact':
+        scan = client.scan_iter(
+            match=f'{settings.url_bucket_prefix}*', count=batch, _type='HASH'
+        )
+        read = _read_buckets
+    else:
+        scan = client.scan_iter(count=batch, _type='STRING')
+        read = _read_strings
+    keys = []
+    async for key in scan:
+        keys.append(key)
+        if len(keys) >= batch:
+            yield await read(client, codec, keys)
+            keys = []
+    if keys:
+        yield await read(client, codec, keys)
+
+
+async def _read_strings(
+    client: Redis, codec: UrlCodec, keys: List[bytes]
+) -> List[dict]:
+    """Read the string records of the batch of keys."""
+    records = [(key, record_url_id(key)) for key in keys]
+    records = [(key, url_id) for key, url_id in records if url_id]
+    if not records:
+        return []
+    pipeline = client.pipeline(transaction=False)
+    pipeline.mget([key for key, _ in records])
+    for key, _ in records:
+        pipeline.ttl(key)
+    values, *ttls = await pipeline.execute()
+    now = int(time.time())
+    links = []
+    for (_, url_id), value, ttl in zip(records, values, ttls):
+        if value is not None and ttl != -2:
+            link = dict(id=url_id, url=codec.decode(value))
+            if ttl >= 0:
+                link['expires_at'] = now + ttl
+            links.append(link)
+    return links
+
+
+async def _read_buckets(
+    client: Redis, codec: UrlCodec, keys: List[bytes]
+) -> List[dict]:
+    """Read the compact records of the batch of hash buckets."""
+    pipeline = client.pipeline(transaction=False)
+    for key in keys:
+        pipeline.hgetall(key)
+    links = []
+    for bucket in await pipeline.execute():
+        for field, value in bucket.items():
+            url = codec.decode(value)
+            if url is not None:
+                link = dict(id=field.decode(), url=url)
+                if value.startswith(EXPIRING):
+                    link['expires_at'] = int.from_bytes(value[1:5], 'big')
+                links.append(link)
+    return links
+
+
+def train_dictionary(urls: Iterable[str], size: int = 4096) -> bytes:
+    """Build a deflate dictionary of the URL fragments saving the most bytes.
+
+    Args:
+        urls (iterable): The sample of the raw URLs.
+        size (int): Max dictionary size in bytes.
+
+    Returns:
+        bytes: The dictionary, the most valuable fragments are at the end,
+            closest to the deflated data.
+    """
+    tokens = Counter(
+        token for url in urls for token in URL_TOKEN.findall(url) if len(token) > 3
+    )
+    dictionary = []
+    length = 0
+    for token, count in sorted(
+        tokens.items(), key=lambda item: len(item[0]) * item[1], reverse=True
+    ):
+        if count < 2 or length + len(token) > size:
+            continue
+        dictionary.append(token.encode())
+        length += len(token)
+    return b''.join(reversed(dictionary))
+
+
+def make_codec(dictionary_path: Optional[str] = None) -> UrlCodec:
+    """Make the URL codec of the configured layout.
+
+    Args:
+        dictionary_path (str): The trained dictionary file,
+            the default dictionary is used if it's not set.
+
+    Returns:
+        UrlCodec: The codec.
+    """
+    dictionary = DEFAULT_DICTIONARY
+    if dictionary_path:
+        with open(dictionary_path, 'rb') as dictionary_file:
+            dictionary = dictionary_file.read()
+    return UrlCodec(
+        compact=settings.url_layout == 'compact',
+        raw=settings.url_format_version >= 2,
+        compression=settings.url_compression,
+        min_length=settings.url_compression_min_length,
+        dictionary=dictionary,
+    )
+
+
+url_codec = make_codec(settings.url_compression_dictionary)
@@ -0,0 +1,252 @@
+"""Migration and memory report tool of the compact ShortURL records layout.
+
+Usage:
+    python -m urlshrtr.compact_tool report [--sample N]
+    python -m urlshrtr.compact_tool train-dict PATH [--sample N] [--size BYTES]
+    python -m urlshrtr.compact_tool migrate [--batch N]
+
+The migration moves the string records of every shard to the hash buckets
+of the configured url_buckets, url_compression and dictionary settings.
+A record updated while it's migrated is skipped and moved by the next run.
+A string record of a url ID already in the hash buckets is kept as is.
+The workers in the string layout don't see the migrated records, so switch
+them to url_layout=compact right after the migration and run it once more.
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Dict, List, Tuple
+
+from redis.asyncio.client import Redis
+
+from urlshrtr import redis_connector
+from urlshrtr.compact import (
+    UrlCodec,
+    make_codec,
+    raw_url,
+    record_url_id,
+    train_dictionary,
+    url_record,
+)
+from urlshrtr.config import settings
+from urlshrtr.scripts import LuaScript
+
+# KEYS: string record, hash bucket, expiry index;
+# ARGV: field, value read, encoded value, expiry unix time or '0'.
+# Returns 1 if moved, 0 if the record was changed or deleted since read, or the
+# url ID already exists in the bucket, the string record is kept then.
+# The expiring records are added to the expiry index for the purge.
+move_record = LuaScript("""
+if redis.call('GET', KEYS[1]) ~= ARGV[2] then
+    return 0
+end
+if redis.call('HSETNX', KEYS[2], ARGV[1], ARGV[3]) == 0 then
+    return 0
+end
+if ARGV[4] ~= '0' then
+    redis.call('ZADD', KEYS[3], ARGV[4], ARGV[1])
+end
+redis.call('DEL', KEYS[1])
+return 1
+""")
+
+
+async def _string_records(client: Redis, count: int) -> List[Tuple[bytes, str]]:
+    """Scan the string records of the shard.
+
+    Args:
+        client (Redis): The shard Redis client.
+        count (int): Max number of the records.
+
+    Returns:
+        list: The keys and the url IDs.
+    """
+    records = []
+    async for key in client.scan_iter(count=1000, _type='STRING'):
+        url_id = record_url_id(key)
+        if url_id:
+            records.append((key, url_id))
+            if len(records) >= count:
+                break
+    return records
+
+
+async def _buckets(client: Redis, count: int) -> List[bytes]:
+    """Scan the compact layout hash buckets of the shard.
+
+    Args:
+        client (Redis): The shard Redis client.
+        count (int): Max number of the buckets.
+
+    Returns:
+        list: The bucket keys.
+    """
+    buckets = []
+    async for key in client.scan_iter(
+        match=f'{settings.url_bucket_prefix}*', count=1000, _type='HASH'
+    ):
+        buckets.append(key)
+        if len(buckets) >= count:
+            break
+    return buckets
+
+
+async def memory_report(client: Redis, sample: int) -> Dict[str, float]:
+    """Estimate the memory per link of both layouts on a sample of the shard.
+
+    Args:
+        client (Redis): The shard Redis client.
+        sample (int): Max number of the sampled keys of every layout.
+
+    Returns:
+        dict: The number of the sampled links and the average bytes per link
+            of the string records and the compact buckets.
+    """
+    report = dict(string_links=0, string_bytes=0.0, compact_links=0, compact_bytes=0.0)
+    records = await _string_records(client, sample)
+    if records:
+        pipeline = client.pipeline(transaction=False)
+        for key, _ in records:
+            pipeline.memory_usage(key, samples=0)
+        usage = await pipeline.execute()
+        report['string_links'] = len(records)
+        report['string_bytes'] = sum(filter(None, usage)) / len(records)
+    buckets = await _buckets(client, sample)
+    if buckets:
+        pipeline = client.pipeline(transaction=False)
+        for key in buckets:
+            pipeline.memory_usage(key, samples=0)
+            pipeline.hlen(key)
+        results = await pipeline.execute()
+        links = sum(results[1::2])
+        report['compact_links'] = links
+        report['compact_bytes'] = sum(filter(None, results[::2])) / max(links, 1)
+    return report
+
+
+async def sample_urls(client: Redis, codec: UrlCodec, sample: int) -> List[str]:
+    """Read a sample of the raw URLs of the shard in both layouts.
+
+    Args:
+        client (Redis): The shard Redis client.
+        codec (UrlCodec): The codec of the compact records.
+        sample (int): Max number of the URLs.
+
+    Returns:
+        list: The URLs.
+    """
+    records = await _string_records(client, sample)
+    values = await client.mget([key for key, _ in records]) if records else []
+    urls = [raw_url(value.decode()) for value in values if value]
+    for key in await _buckets(client, sample):
+        if len(urls) >= sample:
+            break
+        urls.extend(codec.decode(value) for value in await client.hvals(key))
+    return urls[:sample]
+
+
+async def migrate(client: Redis, codec: UrlCodec, batch: int) -> int:
+    """Move the string records of the shard to the hash buckets.
+
+    Args:
+        client (Redis): The shard Redis client.
+        codec (UrlCodec): The codec of the compact records.
+        batch (int): The number of the records moved in one pipeline.
+
+    Returns:
+        int: The number of the moved records.
+    """
+    moved = 0
+    records = []
+    async for key in client.scan_iter(count=1000, _type='STRING'):
+        url_id = record_url_id(key)
+        if url_id:
+            records.append((key, url_id))
+        if len(records) >= batch:
+            moved += await _move_records(client, codec, records)
+            records = []
+    if records:
+        moved += await _move_records(client, codec, records)
+    return moved
+
+
+async def _move_records(
+    client: Redis, codec: UrlCodec, records: List[Tuple[bytes, str]]
+) -> int:
+    """Move the batch of the string records to the hash buckets.
+
+    The values are read with their TTLs in one pipeline, the expiry is
+    kept in the compact value and the expiry index.
+
+    Args:
+        client (Redis): The shard Redis client.
+        codec (UrlCodec): The codec of the compact records.
+        records (list): The keys and the url IDs.
+
+    Returns:
+        int: The number of the moved records.
+    """
+    pipeline = client.pipeline(transaction=False)
+    for key, _ in records:
+        pipeline.get(key)
+        pipeline.pttl(key)
+    results = await pipeline.execute()
+    now = time.time()
+    pipeline = client.pipeline(transaction=False)
+    for (key, url_id), value, ttl in zip(records, results[::2], results[1::2]):
+        if value is not None:
+            bucket, field = url_record(url_id, key)
+            expires_at = round(now + ttl / 1000) if ttl > 0 else None
+            move_record.queue(
+                pipeline,
+                [key, bucket, settings.url_expiry_key],
+                [
+                    field,
+                    value,
+                    codec.encode(raw_url(value.decode()), expires_at),
+                    expires_at or 0,
+                ],
+            )
+    return sum(await pipeline.execute())
+
+
+async def main(args: argparse.Namespace):
+    """Run the tool command on every shard."""
+    settings.url_layout = 'compact'
+    codec = make_codec(settings.url_compression_dictionary)
+    redis_connector.connect()
+    try:
+        clients = redis_connector.get_clients()
+        if args.command == 'report':
+            for shard, client in enumerate(clients):
+                print(f'shard {shard}:', await memory_report(client, args.sample))
+        elif args.command == 'train-dict':
+            urls = []
+            for client in clients:
+                urls.extend(await sample_urls(client, codec, args.sample))
+            dictionary = train_dictionary(urls, args.size)
+            with open(args.path, 'wb') as dictionary_file:
+                dictionary_file.write(dictionary)
+            print(f'{len(dictionary)} bytes dictionary of {len(urls)} URLs')
+        elif args.command == 'migrate':
+            for client in clients:
+                await client.script_load(move_record.source)
+            for shard, client in enumerate(clients):
+                print(f'shard {shard}: moved', await migrate(client, codec, args.batch))
+    finally:
+        await redis_connector.disconnect()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    report_parser = commands.add_parser('report', help='memory per link report')
+    report_parser.add_argument('--sample', type=int, default=1000)
+    train_parser = commands.add_parser('train-dict', help='train the dictionary')
+    train_parser.add_argument('path')
+    train_parser.add_argument('--sample', type=int, default=10000)
+    train_parser.add_argument('--size', type=int, default=4096)
+    migrate_parser = commands.add_parser('migrate', help='move to the hash buckets')
+    migrate_parser.add_argument('--batch', type=int, default=settings.batch_chunk_size)
+    asyncio.run(main(parser.parse_args()))
@@ -1,6 +1,7 @@
 """Application configuration."""
 
 import sys
+from typing import List, Literal
 
 from loguru import logger
 from pydantic import BaseSettings
@@ -10,13 +11,75 @@ class Settings(BaseSettings):
     """Application settings."""
 
     environment = 'development'
+    storage_backend = 'redis'  # 'redis' or 'embedded'
+    embedded_log_path: str = None  # the embedded storage is memory only without it
+    embedded_snapshot_path: str = None
+    embedded_snapshot_every = 10000  # number of the logged writes between snapshots
+    embedded_views_flush_interval = 1  # sec between the logged view count batches
     redis_host = 'localhost'
     redis_port = 6379
     redis_db = 0
     redis_password: str = None
+    redis_shards: List[str] = []  # Redis URLs of the hash ring shards
+    redis_shard_replicas = 160  # hash ring points per shard
+    redis_hash_tags = False  # {url_id} keys, a link and its stats share a slot
+    redis_replicas: List[List[str]] = []  # read replica URLs of every shard
+    redis_replica_policy = 'round_robin'  # or 'least_connections'
+    redis_read_your_writes = 0  # sec to read the updated URLs from the primary
+    redis_max_connections = 50  # per worker
+    redis_pool_timeout = 2  # sec to wait for a free connection
+    redis_socket_timeout = 5  # sec
+    redis_connect_timeout = 2  # sec
+    redis_socket_keepalive = True
+    redis_health_check_interval = 30  # sec, idle connections are checked on use
     stats_period = 86400 * 1000  # 1 day in msec
     stats_retention = 86400 * 1000 * 7  # 7 days in msec
+    stats_bucket = 60 * 1000  # views are counted in 1 minute buckets, in msec
+    stats_max_age = 0  # sec of the stats responses caching, revalidated by ETag if 0
+    stats_sweep_enabled = True  # delete the orphaned and expired stats series
+    stats_sweep_interval = 3600  # sec
+    stats_sweep_batch = 1000  # number of the stats keys checked in one pipeline
+    stats_sweep_lock = 'urlshrtr:stats-sweeper'
     url_key_length = 6
+    redirect_status_code: Literal[301, 302, 307, 308] = 307  # 301/308 are permanent
+    redirect_max_age = 0  # sec of the redirects caching, the views are not counted
+    redirect_fast_path = False  # serve the redirects by the raw ASGI fast path
+    fast_json_responses = False  # render the responses without the model validation
+    url_layout = 'string'  # 'string' keys or 'compact' hash buckets
+    url_format_version = 2  # string layout values: 1 percent-encoded, 2 raw UTF-8
+    url_migrate_on_read = True  # rewrite the version 1 values read to version 2
+    url_buckets = 1 << 20  # number of the compact layout buckets, ~100 links each
+    url_bucket_prefix = 'urlshrtr:u:'
+    url_compression = False  # deflate the long URLs in the compact layout
+    url_compression_min_length = 64  # bytes
+    url_compression_dictionary: str = None  # trained dictionary file path
+    url_default_ttl = 0  # sec, the links without ttl or expires_at never expire if 0
+    url_expiry_key = 'urlshrtr:expiry'  # the compact layout expiry index
+    url_purge_interval = 60  # sec between the purges of the expired compact records
+    url_purge_batch = 1000  # number of the expired records deleted in one pipeline
+    url_dedup = False  # return the existing short url ID for a known URL
+    url_dedup_prefix = 'urlshrtr:dedup:'
+    url_changelog = False  # append the link writes to a stream for the edge exports
+    url_changelog_key = 'urlshrtr:changes'
+    url_changelog_maxlen = 1000000  # approx. number of the entries kept on every shard
+    id_allocator = 'random'  # short url ID allocator: 'random', 'counter', 'snowflake'
+    id_max_retries = 3  # max number of new IDs allocated on collisions
+    id_counter_key = 'urlshrtr:id-counter'
+    id_block_size = 1000  # number of IDs leased by the 'counter' allocator at once
+    id_worker_id: int = None  # 'snowflake' allocator worker ID, defaults to the pid
+    batch_max_size = 10000  # max number of items in one bulk request
+    batch_chunk_size = 500  # max number of items in one Redis pipeline
+    url_cache_enabled = False
+    url_cache_size = 10000  # max number of cached url_id -> url records
+    url_cache_ttl = 60  # sec
+    url_cache_policy = 'lru'  # eviction policy: 'lru' or 'fifo'
+    url_cache_channel = 'urlshrtr:cache-invalidation'
+    url_cache_reconnect_delay = 1  # sec
+    click_ingest_enabled = True  # record the views in background batches
+    click_queue_size = 100000  # max number of buffered view events per worker
+    click_batch_size = 1000  # max number of view events in one flush batch
+    click_flush_interval = 1.0  # sec
+    metrics_stats_interval = 5  # sec between the worker stats metrics updates
     debug = False
     app_port = 8000
     app_host = 'localhost'
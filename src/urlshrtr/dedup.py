@@ -0,0 +1,61 @@
+"""Deduplication of the shortened URLs.
+
+The reverse index maps the fingerprint of the normalized URL to the short
+url IDs created for it, one per set of the stats labels, so the links
+of different owners and campaigns keep their own stats.
+"""
+
+from hashlib import sha1
+from typing import Dict, Optional
+from urllib import parse
+
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+
+def normalize_url(url: str) -> str:
+    """Normalize the URL, so the equivalent URLs have the same fingerprint.
+
+    The scheme and the host are lowercased, the default port is dropped
+    and the empty path is replaced with '/'. The path, the query and
+    the fragment are kept as is.
+
+    Args:
+        url (str): The raw URL.
+
+    Returns:
+        str: The normalized URL.
+    """
+    parts = parse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    userinfo, at, host = parts.netloc.rpartition('@')
+    host = host.lower()
+    default_port = DEFAULT_PORTS.get(scheme)
+    if default_port and host.endswith(f':{default_port}'):
+        host = host[: -len(default_port) - 1]
+    return parse.urlunsplit(
+        (scheme, userinfo + at + host, parts.path or '/', parts.query, parts.fragment)
+    )
+
+
+def url_fingerprint(url: str) -> str:
+    """Get the fingerprint of the normalized URL.
+
+    Args:
+        url (str): The raw URL.
+
+    Returns:
+        str: The hex digest.
+    """
+    return sha1(normalize_url(url).encode()).hexdigest()
+
+
+def labels_field(labels: Optional[Dict[str, str]]) -> str:
+    """Get the reverse index field of the stats labels.
+
+    Args:
+        labels (dict): The stats labels.
+
+    Returns:
+        str: The labels in the canonical order, '' for no labels.
+    """
+    return parse.urlencode(sorted((labels or {}).items()))
@@ -0,0 +1,559 @@
+"""Embedded in-process storage engine."""
+
+import asyncio
+import heapq
+import json
+import os
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from urlshrtr.allocator import id_allocator
+from urlshrtr.compact import raw_url
+from urlshrtr.config import logger, settings
+from urlshrtr.dedup import labels_field, url_fingerprint
+from urlshrtr.ingest import ViewCounts
+from urlshrtr.sweeper import Sweeper
+
+
+class EmbeddedStorage:
+    """An in-process storage for the single node deployments and benchmarks.
+
+    The records are kept in a dict and every write is appended to the log.
+    The log is compacted to a snapshot every snapshot_every writes and on
+    stop, the state is restored from the snapshot and the log on start.
+    The views are counted in stats_bucket time buckets, they are logged
+    in batches every views_flush_interval and don't count as the writes
+    between the snapshots. With url_dedup the known URLs are indexed
+    by the fingerprint and the labels. The expired links are read as
+    missing and purged in background in the order of a heap of the
+    expiry times.
+
+    The log I/O is synchronous, the log is flushed once per operation.
+    The snapshots are written in a thread. The URLs are kept raw, the
+    percent-encoded URLs of the snapshots and logs of the format version 1
+    are converted on load.
+    Without log_path the storage is memory only. The state is per process,
+    so it's meant for a single worker.
+    """
+
+    def __init__(
+        self,
+        log_path: Optional[str] = None,
+        snapshot_path: Optional[str] = None,
+        snapshot_every: int = 10000,
+        views_flush_interval: float = 1,
+    ):
+        """Init the storage.
+
+        Args:
+            log_path (str): The append-only log file path.
+            snapshot_path (str): The snapshot file path.
+            snapshot_every (int): The number of the logged writes
+                between the snapshots.
+            views_flush_interval (float): Time in seconds between
+                the logged view count batches.
+        """
+        self.log_path = log_path
+        self.snapshot_path = snapshot_path
+        self.snapshot_every = snapshot_every
+        self._urls: Dict[str, str] = {}
+        self._labels: Dict[str, Dict[str, str]] = {}
+        self._views: Dict[str, Dict[int, int]] = {}
+        self._dedup: Dict[Tuple[str, str], str] = {}
+        self._expires: Dict[str, int] = {}
+        self._expiry_queue: List[Tuple[int, str]] = []
+        self._generation = 0
+        self._writes = 0
+        self._log = None
+        self._log_offset = 0  # of the log entries following the snapshot
+        self._log_tail: Optional[List[str]] = None  # logged while snapshotting
+        self._pending_views: Counter = Counter()
+        self._snapshot_task: Optional[asyncio.Task] = None
+        self.expiry_purger = Sweeper(
+            self.purge_expired,
+            interval=settings.url_purge_interval,
+            name='Expiry purge',
+        )
+        self.views_flusher = Sweeper(
+            self.flush_views, interval=views_flush_interval, name='Views flush'
+        )
+
+    async def start(self):
+        """Restore the state from the snapshot and the log and open the log."""
+        self._load()
+        if self.log_path:
+            self._log = open(self.log_path, 'a')
+            if self.snapshot_path:
+                await self.snapshot()
+            elif not self._log.tell():
+                self._append([['generation', self._generation]])
+            self.views_flusher.start()
+        self.expiry_purger.start()
+
+    async def stop(self):
+        """Compact the log to a snapshot and close it."""
+        await self.expiry_purger.stop()
+        await self.views_flusher.stop()
+        if self._snapshot_task is not None:
+            await self._snapshot_task
+        if self._log is not None:
+            await self.flush_views()
+            await self.snapshot()
+            self._log.close()
+            self._log = None
+
+    async def get_short_url(self, url_id: str) -> Optional[str]:
+        """Get the URL and count the view.
+
+        Args:
+            url_id (str): The short url ID.
+
+        Returns:
+            str: The original URL or None.
+        """
+        url = self._get(url_id)
+        if url is not None:
+            self._count([(url_id, _ts_bucket(), 1)])
+        return url
+
+    async def get_short_urls(
+        self, url_ids: List[str], count_views: bool = False
+    ) -> List[Optional[str]]:
+        """Get the URLs in bulk.
+
+        Args:
+            url_ids (list): The short url IDs.
+            count_views (bool): Count the lookups as the URL views.
+
+        Returns:
+            list: The original URLs in the input order, None for the missing ones.
+        """
+        urls = [self._get(url_id) for url_id in url_ids]
+        if count_views:
+            timestamp = _ts_bucket()
+            self._count(
+                (url_id, timestamp, 1)
+                for url_id, url in zip(url_ids, urls)
+                if url is not None
+            )
+        return urls
+
+    async def create_short_url(
+        self,
+        url: str,
+        labels: Optional[Dict[str, str]] = None,
+        expires_at: Optional[int] = None,
+    ) -> Optional[str]:
+        """Create the ShortURL record.
+
+        Args:
+            url (str): The original URL.
+            labels (dict): The extra stats labels, e.g. owner and campaign.
+            expires_at (int): The link expiry unix time, it never expires if not set.
+
+        Returns:
+            str: The newly created short URL ID or None if no free ID was allocated.
+        """
+        url_ids = await self.create_short_urls([url], labels, expires_at)
+        return url_ids[0]
+
+    async def create_short_urls(
+        self,
+        urls: List[str],
+        labels: Optional[Dict[str, str]] = None,
+        expires_at: Optional[int] = None,
+    ) -> List[Optional[str]]:
+        """Create the ShortURL records, allocating new IDs for the collided ones.
+
+        Args:
+            urls (list): The original URLs.
+            labels (dict): The extra stats labels, e.g. owner and campaign.
+            expires_at (int): The links expiry unix time, they never expire if not set.
+
+        Returns:
+            list: The newly created short URL IDs in the input order,
+                None if no free ID was allocated. With url_dedup
+                the existing IDs of the known URLs are returned,
+                the expiring links are never deduplicated.
+        """
+        url_ids = [None] * len(urls)
+        pending = list(range(len(urls)))
+        dedup = settings.url_dedup and not expires_at
+        if dedup:
+            field = labels_field(labels)
+            dedup_keys = [(url_fingerprint(url), field) for url in urls]
+            new_urls = {}
+            for i, dedup_key in enumerate(dedup_keys):
+                url_ids[i] = self._dedup.get(dedup_key)
+                if url_ids[i] is None:
+                    new_urls.setdefault(dedup_key, i)
+            pending = list(new_urls.values())
+        created = []
+        for _ in range(settings.id_max_retries + 1):
+            if not pending:
+                break
+            new_ids = await id_allocator.allocate(len(pending))
+            collided = []
+            for i, url_id in zip(pending, new_ids):
+                if url_id in self._urls:
+                    collided.append(i)
+                else:
+                    self._apply(_set_entry(url_id, urls[i], labels, expires_at))
+                    url_ids[i] = url_id
+                    created.append(i)
+            id_allocator.record_collision(len(collided))
+            pending = collided
+        self._log_writes(
+            [
+                _set_entry(url_ids[i], urls[i], labels, expires_at)
+                for i in sorted(created)
+            ]
+        )
+        if dedup:
+            return [self._dedup.get(dedup_key) for dedup_key in dedup_keys]
+        return url_ids
+
+    async def update_short_url(
+        self, url: str, url_id: str, expires_at: Optional[int] = None
+    ) -> Optional[str]:
+        """Update the ShortURL record.
+
+        Args:
+            url (str): The new updated URL.
+            url_id (str): The short url ID.
+            expires_at (int): The new link expiry unix time, the current one
+                is kept if it's not set.
+
+        Returns:
+            str: The updated short URL ID or None if it's not found.
+        """
+        if self._get(url_id) is None:
+            return None
+        self._write([['update', url_id, url] + ([expires_at] if expires_at else [])])
+        return url_id
+
+    async def delete_short_url(self, url_id: str) -> Optional[str]:
+        """Delete the ShortURL record and its stats.
+
+        Args:
+            url_id (str): The short url ID.
+
+        Returns:
+            str: The deleted short URL ID or None if it's not found.
+        """
+        if self._get(url_id) is None:
+            return None
+        self._write([['delete', url_id]])
+        return url_id
+
+    async def update_view_counts(self, batches: List[ViewCounts]):
+        """Add the batches of the view counts.
+
+        Args:
+            batches (list): The view counts by the url ID and the timestamp.
+        """
+        self._count(
+            (url_id, timestamp, count)
+            for views in batches
+            for (url_id, timestamp), count in views.items()
+        )
+
+    async def get_view_count(
+        self, url_id: str, interval: int = settings.stats_period
+    ) -> Optional[int]:
+        """Get the URL view count stats.
+
+        Args:
+            url_id (str): The short url ID.
+            interval (int): The stats period in ms. (defaults to one day)
+
+        Returns:
+            int: The number of views for the last interval or None.
+        """
+        if self._get(url_id) is None:
+            return None
+        return self._count_views(url_id, _ts_now() - interval)
+
+    async def get_view_counts(
+        self,
+        url_ids: Optional[List[str]] = None,
+        labels: Optional[Dict[str, str]] = None,
+        interval: int = settings.stats_period,
+    ) -> Dict[str, int]:
+        """Get the view count stats of the URLs matching the query.
+
+        Args:
+            url_ids (list): The short url IDs.
+            labels (dict): The stats labels to filter by.
+            interval (int): The stats period in ms. (defaults to one day)
+
+        Returns:
+            dict: The number of views for the last interval by the url ID.
+                For the url_ids query the missing URLs are skipped
+                and the URLs without the labels have zero views.
+        """
+        labels = (labels or {}).items()
+        start = _ts_now() - interval
+        if not url_ids:
+            return {
+                url_id: self._count_views(url_id, start)
+                for url_id, url_labels in self._labels.items()
+                if labels <= url_labels.items() and self._get(url_id) is not None
+            }
+        return {
+            url_id: (
+                self._count_views(url_id, start)
+                if labels <= self._labels[url_id].items()
+                else 0
+            )
+            for url_id in url_ids
+            if self._get(url_id) is not None
+        }
+
+    async def purge_expired(self) -> int:
+        """Delete the expired ShortURL records.
+
+        Returns:
+            int: The number of the deleted records.
+        """
+        now = time.time()
+        entries = []
+        while self._expiry_queue and self._expiry_queue[0][0] <= now:
+            expires_at, url_id = heapq.heappop(self._expiry_queue)
+            if self._expires.get(url_id) == expires_at:
+                entries.append(['delete', url_id])
+        self._write(entries)
+        return len(entries)
+
+    async def flush_views(self) -> int:
+        """Append the view counts counted since the last flush to the log.
+
+        Returns:
+            int: The number of the logged view count entries.
+        """
+        return self._log_views()
+
+    def _log_views(self) -> int:
+        """Append the pending view counts to the log."""
+        entries = [
+            ['views', url_id, timestamp, count]
+            for (url_id, timestamp), count in self._pending_views.items()
+        ]
+        self._pending_views.clear()
+        if self._log is not None and entries:
+            self._append(entries)
+        return len(entries)
+
+    async def snapshot(self):
+        """Write the state to the snapshot file and truncate the log.
+
+        The log starts with the generation of the snapshot it follows,
+        so a log left over by a crash right after the snapshot is replayed
+        from the snapshot log_offset and a log of another generation
+        is skipped. The views older than stats_retention are dropped.
+        """
+        if not self.snapshot_path:
+            return
+        if self._snapshot_task is not None:
+            await self._snapshot_task
+        await self._write_snapshot(self._snapshot_state())
+
+    def _snapshot_state(self) -> dict:
+        """Copy the state of the next snapshot, start keeping the new log."""
+        self._log_views()
+        start = _ts_now() - settings.stats_retention
+        state = dict(
+            generation=self._generation + 1,
+            log_offset=self._log.tell() if self._log is not None else 0,
+            urls=dict(self._urls),
+            labels=dict(self._labels),
+            expires=dict(self._expires),
+            views={
+                url_id: [[ts, count] for ts, count in buckets.items() if ts >= start]
+                for url_id, buckets in self._views.items()
+            },
+        )
+        self._writes = 0
+        self._log_tail = []
+        return state
+
+    async def _write_snapshot(self, state: dict):
+        """Dump the state copy in a thread, then truncate the log.
+
+        The entries logged while the snapshot is written are kept in the log.
+        """
+        try:
+            await asyncio.to_thread(_dump, state, self.snapshot_path)
+        finally:
+            log_tail, self._log_tail = self._log_tail, None
+        self._generation = state['generation']
+        if self._log is not None:
+            self._log.close()
+            log_tmp = f'{self.log_path}.tmp'
+            with open(log_tmp, 'w') as log_file:
+                log_file.write(json.dumps(['generation', self._generation]) + '\n')
+                log_file.write(''.join(log_tail))
+            os.replace(log_tmp, self.log_path)
+            self._log = open(self.log_path, 'a')
+
+    def _load(self):
+        """Restore the state from the snapshot and replay the log."""
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as snapshot_file:
+                state = json.load(snapshot_file)
+            self._generation = state['generation']
+            self._log_offset = state.get('log_offset', 0)
+            self._urls = {url_id: raw_url(url) for url_id, url in state['urls'].items()}
+            self._labels = state['labels']
+            for url_id, expires_at in state.get('expires', {}).items():
+                self._expire(url_id, expires_at)
+            self._views = {
+                url_id: {ts: count for ts, count in buckets}
+                for url_id, buckets in state['views'].items()
+            }
+            for url_id in self._urls:
+                self._index(url_id)
+        if not self.log_path or not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, 'rb') as log_file:
+            log = log_file.read()
+        header, _, entries = log.partition(b'\n')
+        header = json.loads(header) if header.strip() else None
+        if header == ['generation', self._generation - 1] and self._log_offset:
+            # the log wasn't truncated after the snapshot
+            entries = log[self._log_offset :]
+        elif header != ['generation', self._generation]:
+            logger.warning('Skipped the log of another snapshot generation')
+            return
+        entries = [json.loads(line) for line in entries.splitlines() if line.strip()]
+        for entry in entries:
+            if entry[0] in ('set', 'update'):
+                entry[2] = raw_url(entry[2])
+            self._apply(entry)
+        self._writes = sum(entry[0] != 'views' for entry in entries)
+
+    def _write(self, entries: List[list]):
+        """Apply the write entries and append them to the log."""
+        for entry in entries:
+            self._apply(entry)
+        self._log_writes(entries)
+
+    def _log_writes(self, entries: List[list]):
+        """Append the applied write entries to the log, snapshot if it's due."""
+        if self._log is None or not entries:
+            return
+        self._append(entries)
+        self._writes += len(entries)
+        if (
+            self._writes >= self.snapshot_every
+            and self.snapshot_path
+            and (self._snapshot_task is None or self._snapshot_task.done())
+        ):
+            self._snapshot_task = asyncio.create_task(
+                self._background_snapshot(self._snapshot_state())
+            )
+
+    async def _background_snapshot(self, state: dict):
+        """Write the snapshot due by the number of the writes."""
+        try:
+            await self._write_snapshot(state)
+        except Exception:
+            logger.exception('Embedded storage snapshot error')
+
+    def _append(self, entries: List[list]):
+        """Append the entries to the log file."""
+        lines = [json.dumps(entry) + '\n' for entry in entries]
+        self._log.write(''.join(lines))
+        self._log.flush()
+        if self._log_tail is not None:
+            self._log_tail.extend(lines)
+
+    def _count(self, views: Iterable[Tuple[str, int, int]]):
+        """Add the view counts to the state and to the next logged batch."""
+        for url_id, timestamp, count in views:
+            if url_id in self._views:
+                self._apply(['views', url_id, timestamp, count])
+                if self._log is not None:
+                    self._pending_views[url_id, timestamp] += count
+
+    def _apply(self, entry: list):
+        """Apply the write entry to the state."""
+        operation, url_id, *args = entry
+        if operation == 'set':
+            self._urls[url_id], self._labels[url_id], *expiry = args
+            self._views[url_id] = {}
+            self._expire(url_id, *expiry)
+            self._index(url_id)
+        elif operation == 'update':
+            self._unindex(url_id)
+            self._urls[url_id], *expiry = args
+            self._expire(url_id, *expiry)
+            self._index(url_id)
+        elif operation == 'delete':
+            self._unindex(url_id)
+            del self._urls[url_id], self._labels[url_id], self._views[url_id]
+            self._expires.pop(url_id, None)
+        elif operation == 'views' and url_id in self._views:
+            timestamp, count = args
+            buckets = self._views[url_id]
+            buckets[timestamp] = buckets.get(timestamp, 0) + count
+
+    def _get(self, url_id: str) -> Optional[str]:
+        """Get the URL, None if it's missing or expired."""
+        expires_at = self._expires.get(url_id)
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return self._urls.get(url_id)
+
+    def _expire(self, url_id: str, expires_at: Optional[int] = None):
+        """Set the expiry unix time of the ShortURL record if it's given."""
+        if expires_at:
+            self._expires[url_id] = expires_at
+            heapq.heappush(self._expiry_queue, (expires_at, url_id))
+
+    def _dedup_key(self, url_id: str) -> Tuple[str, str]:
+        """Get the dedup index key of the ShortURL record."""
+        return url_fingerprint(self._urls[url_id]), labels_field(self._labels[url_id])
+
+    def _index(self, url_id: str):
+        """Add the ShortURL record to the dedup index, unless it's known or expiring."""
+        if settings.url_dedup and url_id not in self._expires:
+            self._dedup.setdefault(self._dedup_key(url_id), url_id)
+
+    def _unindex(self, url_id: str):
+        """Remove the ShortURL record from the dedup index."""
+        if settings.url_dedup:
+            dedup_key = self._dedup_key(url_id)
+            if self._dedup.get(dedup_key) == url_id:
+                del self._dedup[dedup_key]
+
+    def _count_views(self, url_id: str, start: int) -> int:
+        """Sum the URL views since the start timestamp in ms."""
+        return sum(count for ts, count in self._views[url_id].items() if ts >= start)
+
+
+def _dump(state: dict, path: str):
+    """Write the state to the snapshot file atomically."""
+    snapshot_tmp = f'{path}.tmp'
+    with open(snapshot_tmp, 'w') as snapshot_file:
+        json.dump(state, snapshot_file)
+    os.replace(snapshot_tmp, path)
+
+
+def _set_entry(
+    url_id: str, url: str, labels: Optional[Dict[str, str]], expires_at: Optional[int]
+) -> list:
+    """Make the log entry of the created ShortURL record."""
+    return ['set', url_id, url, labels or {}] + ([expires_at] if expires_at else [])
+
+
+def _ts_now() -> int:
+    """Get the current timestamp in ms."""
+    return int(time.time() * 1000)
+
+
+def _ts_bucket() -> int:
+    """Get the current stats bucket timestamp in ms."""
+    timestamp = _ts_now()
+    return timestamp - timestamp % settings.stats_bucket
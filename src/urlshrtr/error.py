@@ -1,17 +1,22 @@
 """Error handlers and utilities."""
 
 from functools import wraps
+from time import perf_counter
 from typing import Any
 
 from fastapi import HTTPException
 from redis.exceptions import RedisError
 
+from urlshrtr import metrics
 from urlshrtr.config import logger
 
 
 def handle_redis_errors(func):
     """A decorator to handle Redis exception and log it.
 
+    The latency and the errors of the decorated model layer functions
+    are recorded in the metrics by the function name.
+
     Args:
         func: Function to decorate.
 
@@ -21,6 +26,7 @@ def handle_redis_errors(func):
     Raises:
         HTTPException: If Redis exception is raised.
     """
+    latency, errors = metrics.operation_metrics(func.__name__)
 
     @wraps(func)
     async def wrapper(*args, **kwargs):
@@ -30,11 +36,15 @@ def handle_redis_errors(func):
             args: Function arguments.
             kwargs: Function keyword arguments.
         """
+        started = perf_counter()
         try:
             return await func(*args, **kwargs)
         except RedisError as e:
+            errors.inc()
             logger.exception('Redis error')
             raise HTTPException(status_code=500, detail=f'Redis error: {e}')
+        finally:
+            latency.observe(perf_counter() - started)
 
     return wrapper
 
@@ -53,3 +63,18 @@ def raise_if_url_not_found(url_id: str, result: Any):
         error_message = f'ShortUrl with id {url_id} not found'
         logger.error(error_message)
         raise HTTPException(status_code=404, detail=error_message)
+
+
+def raise_if_id_not_allocated(result: Any):
+    """Raise HTTPException if no free ShortURL ID was allocated.
+
+    Args:
+        result: Redis result received from the model layer.
+
+    Raises:
+        HTTPException: If no free ShortURL ID was allocated.
+    """
+    if result is None:
+        error_message = 'Failed to allocate a free ShortUrl id'
+        logger.error(error_message)
+        raise HTTPException(status_code=500, detail=error_message)
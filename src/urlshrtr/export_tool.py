@@ -0,0 +1,497 @@
+"""Static redirect map export of the ShortURL records for the edge servers.
+
+Usage:
+    python -m urlshrtr.export_tool export PATH [--format F] [--batch N] [--chunk N]
+    python -m urlshrtr.export_tool update PATH [--batch N]
+    python -m urlshrtr.export_tool lookup PATH URL_ID
+
+The export scans the records of every shard with SCAN and pipelined MGETs,
+or HGETALLs of the compact layout buckets, and writes them sorted by the url
+ID to an nginx map, a CSV or a binary file. The links are sorted in chunks
+spilled to temporary files and merged, so the memory use doesn't depend on
+the number of links. The expiring links are not exported, a static map
+can't expire them.
+
+The update regenerates the export from the change log of the links written
+since the last run (url_changelog=True), it reads only the changed records.
+The last read change log entries of every shard are kept in PATH.state.
+If the change log was trimmed past them, the update fails and a full export
+is needed.
+
+The binary file is a header (magic, number of links), the table of the
+record offsets and the records (url ID and URL lengths, url ID, URL) sorted
+by the url ID, so a link is found with a binary search over the mapped file.
+"""
+
+import argparse
+import asyncio
+import csv
+import heapq
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from contextlib import ExitStack
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+from urllib import parse
+
+from redis.asyncio.client import Redis
+
+from urlshrtr import redis_connector
+from urlshrtr.compact import EXPIRING, UrlCodec, make_codec, scan_records
+from urlshrtr.config import settings
+from urlshrtr.handlers import router
+
+Link = Tuple[str, str]
+
+MAGIC = b'USH1'
+HEADER = struct.Struct('>4sI')  # magic, number of links
+OFFSET = struct.Struct('>Q')  # record offset from the end of the offsets table
+RECORD = struct.Struct('>BI')  # url ID length, URL length
+NGINX_SAFE = "!#%&'()*+,/:;=?@[]"  # '$' would be expanded as an nginx variable
+NGINX_VARIABLE = '$urlshrtr_redirect'
+URL_PREFIX = f'{router.prefix}/'  # the short links path of the service
+
+
+def write_csv(links: Iterable[Link], path: str) -> int:
+    """Write the links as the url ID, URL rows of a CSV file.
+
+    Args:
+        links (iterable): The url IDs and the raw URLs.
+        path (str): The output file path.
+
+    Returns:
+        int: The number of the written links.
+    """
+    count = 0
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        for link in links:
+            writer.writerow(link)
+            count += 1
+    return count
+
+
+def read_csv(path: str) -> Iterator[Link]:
+    """Read the links of a CSV file."""
+    with open(path, newline='') as csv_file:
+        for url_id, url in csv.reader(csv_file):
+            yield url_id, url
+
+
+def write_nginx(links: Iterable[Link], path: str) -> int:
+    """Write the links as an nginx map of the request URI to the redirect URL.
+
+    The URIs are the short links paths of the service, /urls/{url_id}.
+    The URLs are percent-encoded, so they are safe in the quoted map values.
+
+    Args:
+        links (iterable): The url IDs and the raw URLs.
+        path (str): The output file path.
+
+    Returns:
+        int: The number of the written links.
+    """
+    count = 0
+    with open(path, 'w') as map_file:
+        map_file.write(
+            '# include in the http block and redirect with\n'
+            f'# if ({NGINX_VARIABLE}) {{ return 301 {NGINX_VARIABLE}; }}\n'
+            f'map $uri {NGINX_VARIABLE} {{\n'
+            '    default "";\n'
+        )
+        for url_id, url in links:
+            url = parse.quote(url, safe=NGINX_SAFE)
+            map_file.write(f'    {URL_PREFIX}{url_id} "{url}";\n')
+            count += 1
+        map_file.write('}\n')
+    return count
+
+
+def read_nginx(path: str) -> Iterator[Link]:
+    """Read the links of an nginx map file."""
+    with open(path) as map_file:
+        for line in map_file:
+            if line.startswith(f'    {URL_PREFIX}'):
+                uri, url = line.strip().rstrip(';').split(' ', 1)
+                yield uri[len(URL_PREFIX) :], url.strip('"')
+
+
+def write_binary(links: Iterable[Link], path: str) -> int:
+    """Write the links to a binary lookup file.
+
+    The offsets and the records are written to temporary files
+    and concatenated, as the number of links is known at the end only.
+
+    Args:
+        links (iterable): The url IDs and the raw URLs sorted by the url ID.
+        path (str): The output file path.
+
+    Returns:
+        int: The number of the written links.
+    """
+    count = 0
+    position = 0
+    with tempfile.TemporaryFile() as offsets, tempfile.TemporaryFile() as records:
+        for url_id, url in links:
+            url_id, url = url_id.encode(), url.encode()
+            record = RECORD.pack(len(url_id), len(url)) + url_id + url
+            offsets.write(OFFSET.pack(position))
+            records.write(record)
+            position += len(record)
+            count += 1
+        with open(path, 'wb') as binary_file:
+            binary_file.write(HEADER.pack(MAGIC, count))
+            for part in (offsets, records):
+                part.seek(0)
+                shutil.copyfileobj(part, binary_file)
+    return count
+
+
+def read_binary(path: str) -> Iterator[Link]:
+    """Read the links of a binary lookup file."""
+    with open(path, 'rb') as binary_file:
+        _, count = HEADER.unpack(binary_file.read(HEADER.size))
+        binary_file.seek(OFFSET.size * count, os.SEEK_CUR)
+        for _ in range(count):
+            id_length, url_length = RECORD.unpack(binary_file.read(RECORD.size))
+            url_id = binary_file.read(id_length).decode()
+            yield url_id, binary_file.read(url_length).decode()
+
+
+def lookup(path: str, url_id: str) -> Optional[str]:
+    """Find the URL of the link in a binary lookup file.
+
+    Args:
+        path (str): The binary file path.
+        url_id (str): The short url ID.
+
+    Returns:
+        str: The raw URL or None if the link is not in the file.
+
+    Raises:
+        ValueError: if it's not a binary lookup file.
+    """
+    target = url_id.encode()
+    with open(path, 'rb') as binary_file:
+        with mmap.mmap(binary_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, count = HEADER.unpack_from(data)
+            if magic != MAGIC:
+                raise ValueError(f'{path} is not a binary lookup file')
+            records_start = HEADER.size + OFFSET.size * count
+            low, high = 0, count
+            while low < high:
+                middle = (low + high) // 2
+                (offset,) = OFFSET.unpack_from(data, HEADER.size + OFFSET.size * middle)
+                record = records_start + offset
+                id_length, url_length = RECORD.unpack_from(data, record)
+                record += RECORD.size
+                found = data[record : record + id_length]
+                if found == target:
+                    record += id_length
+                    return data[record : record + url_length].decode()
+                if found < target:
+                    low = middle + 1
+                else:
+                    high = middle
+    return None
+
+
+FORMATS: Dict[str, Tuple[Callable[[Iterable[Link], str], int], Callable]] = {
+    'nginx': (write_nginx, read_nginx),
+    'csv': (write_csv, read_csv),
+    'binary': (write_binary, read_binary),
+}
+
+
+async def scan_links(client: Redis, codec: UrlCodec, batch: int) -> AsyncIterator[Link]:
+    """Scan the non-expiring links of the shard.
+
+    Args:
+        client (Redis): The shard Redis client.
+        codec (UrlCodec): The codec of the configured layout.
+        batch (int): The number of the keys read in one pipeline.
+
+    Yields:
+        tuple: The url ID and the raw URL.
+    """
+    async for links in scan_records(client, codec, batch):
+        for link in links:
+            if 'expires_at' not in link:
+                yield link['id'], link['url']
+
+
+async def _sorted_links(
+    links: AsyncIterator[Link], chunk: int, stack: ExitStack
+) -> Iterator[Link]:
+    """Sort the links by the url ID in chunks spilled to temporary files.
+
+    Args:
+        links (async iterator): The links.
+        chunk (int): Max number of the links sorted in memory.
+        stack (ExitStack): The stack closing the temporary files.
+
+    Returns:
+        iterator: The merged sorted links, the ones scanned twice are dropped.
+    """
+    chunks = []
+    links_chunk = []
+    async for link in links:
+        links_chunk.append(link)
+        if len(links_chunk) >= chunk:
+            chunks.append(_spill(sorted(links_chunk), stack))
+            links_chunk = []
+    links_chunk.sort()
+    return _unique(heapq.merge(*chunks, links_chunk))
+
+
+def _unique(links: Iterator[Link]) -> Iterator[Link]:
+    """Drop the repeated url IDs of the sorted links, SCAN may return a key twice."""
+    last_id = None
+    for url_id, url in links:
+        if url_id != last_id:
+            yield url_id, url
+            last_id = url_id
+
+
+def _spill(links: List[Link], stack: ExitStack) -> Iterator[Link]:
+    """Write the sorted links to a temporary file and read them back lazily."""
+    chunk_file = stack.enter_context(tempfile.TemporaryFile('w+', newline=''))
+    csv.writer(chunk_file).writerows(links)
+    chunk_file.seek(0)
+    return (tuple(row) for row in csv.reader(chunk_file))
+
+
+async def _all_links(
+    clients: List[Redis], codec: UrlCodec, batch: int
+) -> AsyncIterator[Link]:
+    """Scan the non-expiring links of every shard."""
+    for client in clients:
+        async for link in scan_links(client, codec, batch):
+            yield link
+
+
+def _write(path: str, export_format: str, links: Iterable[Link]) -> int:
+    """Write the export to a temporary file and replace the old one."""
+    write, _ = FORMATS[export_format]
+    count = write(links, f'{path}.tmp')
+    os.replace(f'{path}.tmp', path)
+    return count
+
+
+async def export_links(
+    clients: List[Redis],
+    codec: UrlCodec,
+    path: str,
+    export_format: str,
+    batch: int,
+    chunk: int,
+) -> int:
+    """Export all the non-expiring links.
+
+    The change log position is saved before the scan, so the changes written
+    during the export are applied again by the next update.
+
+    Args:
+        clients (list): The Redis clients of every shard.
+        codec (UrlCodec): The codec of the configured layout.
+        path (str): The output file path.
+        export_format (str): 'nginx', 'csv' or 'binary'.
+        batch (int): The number of the keys read in one pipeline.
+        chunk (int): Max number of the links sorted in memory.
+
+    Returns:
+        int: The number of the exported links.
+    """
+    last_ids = [await _last_change(client) for client in clients]
+    with ExitStack() as stack:
+        links = await _sorted_links(_all_links(clients, codec, batch), chunk, stack)
+        count = _write(path, export_format, links)
+    _write_state(path, export_format, last_ids)
+    return count
+
+
+async def update_export(
+    clients: List[Redis], codec: UrlCodec, path: str, batch: int
+) -> int:
+    """Apply the change log entries written since the last export or update.
+
+    Args:
+        clients (list): The Redis clients of every shard.
+        codec (UrlCodec): The codec of the configured layout.
+        path (str): The path of the exported file.
+        batch (int): The number of the change log entries read at once.
+
+    Returns:
+        int: The number of the changed links.
+
+    Raises:
+        ValueError: if the change log was trimmed past the last read entries
+            or the number of the shards has changed.
+    """
+    with open(f'{path}.state') as state_file:
+        state = json.load(state_file)
+    if len(state['changes']) != len(clients):
+        raise ValueError('The number of shards has changed, run a full export')
+    changes = {}
+    last_ids = []
+    for client, last_id in zip(clients, state['changes']):
+        records, last_id = await read_changes(client, last_id, batch)
+        changes.update(await _read_records(client, codec, records))
+        last_ids.append(last_id)
+    _, read = FORMATS[state['format']]
+    _write(path, state['format'], _apply_changes(read(path), changes))
+    _write_state(path, state['format'], last_ids)
+    return len(changes)
+
+
+async def read_changes(
+    client: Redis, last_id: str, batch: int
+) -> Tuple[Dict[str, Tuple[bytes, bytes]], str]:
+    """Read the change log entries of the shard after the last read one.
+
+    Args:
+        client (Redis): The shard Redis client.
+        last_id (str): The last read change log entry ID.
+        batch (int): The number of the entries read at once.
+
+    Returns:
+        tuple: The record key and field of every changed url ID,
+            and the new last read entry ID.
+
+    Raises:
+        ValueError: if the change log was trimmed past the last read entry.
+    """
+    key = settings.url_changelog_key
+    pipeline = client.pipeline(transaction=False)
+    pipeline.xrange(key, count=1)
+    pipeline.xlen(key)
+    first, length = await pipeline.execute()
+    if (
+        first
+        and _entry_id(first[0][0]) > _entry_id(last_id)
+        and length >= settings.url_changelog_maxlen
+    ):
+        raise ValueError('The change log was trimmed, run a full export')
+    records = {}
+    while True:
+        entries = await client.xrange(key, min=f'({last_id}', count=batch)
+        for entry_id, fields in entries:
+            records[fields[b'id'].decode()] = (fields[b'key'], fields[b'field'])
+            last_id = entry_id.decode()
+        if len(entries) < batch:
+            return records, last_id
+
+
+async def _read_records(
+    client: Redis, codec: UrlCodec, records: Dict[str, Tuple[bytes, bytes]]
+) -> Dict[str, Optional[str]]:
+    """Read the current URLs of the changed links.
+
+    Returns:
+        dict: The raw URL of every url ID, None for the deleted
+            and the expiring links.
+    """
+    pipeline = client.pipeline(transaction=False)
+    for key, field in records.values():
+        if field:
+            pipeline.hget(key, field)
+        else:
+            pipeline.get(key)
+            pipeline.ttl(key)
+    results = iter(await pipeline.execute())
+    urls = {}
+    for url_id, (_, field) in records.items():
+        value = next(results)
+        if field:
+            expiring = value is not None and value.startswith(EXPIRING)
+        else:
+            expiring = next(results) != -1
+        urls[url_id] = None if value is None or expiring else codec.decode(value)
+    return urls
+
+
+def _apply_changes(
+    links: Iterator[Link], changes: Dict[str, Optional[str]]
+) -> Iterator[Link]:
+    """Merge the changed links into the sorted exported links.
+
+    Args:
+        links (iterator): The exported links sorted by the url ID.
+        changes (dict): The raw URL of every changed url ID, None if removed.
+
+    Returns:
+        iterator: The url IDs and the raw URLs sorted by the url ID.
+    """
+    kept = (link for link in links if link[0] not in changes)
+    changed = sorted((url_id, url) for url_id, url in changes.items() if url)
+    return heapq.merge(kept, changed)
+
+
+async def _last_change(client: Redis) -> str:
+    """Get the ID of the last change log entry of the shard, '0-0' if none."""
+    entries = await client.xrevrange(settings.url_changelog_key, count=1)
+    return entries[0][0].decode() if entries else '0-0'
+
+
+def _entry_id(entry_id) -> Tuple[int, int]:
+    """Parse the stream entry ID for the comparison."""
+    if isinstance(entry_id, bytes):
+        entry_id = entry_id.decode()
+    milliseconds, sequence = entry_id.split('-')
+    return int(milliseconds), int(sequence)
+
+
+def _write_state(path: str, export_format: str, last_ids: List[str]):
+    """Save the export format and the last read change log entries."""
+    with open(f'{path}.state', 'w') as state_file:
+        json.dump(dict(format=export_format, changes=last_ids), state_file)
+
+
+async def main(args: argparse.Namespace):
+    """Run the tool command."""
+    if args.command == 'lookup':
+        print(lookup(args.path, args.url_id))
+        return
+    codec = make_codec(settings.url_compression_dictionary)
+    redis_connector.connect()
+    try:
+        clients = redis_connector.get_clients()
+        if args.command == 'export':
+            count = await export_links(
+                clients, codec, args.path, args.format, args.batch, args.chunk
+            )
+            print(f'exported {count} links')
+        elif args.command == 'update':
+            count = await update_export(clients, codec, args.path, args.batch)
+            print(f'updated {count} links')
+    finally:
+        await redis_connector.disconnect()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help='export all the links')
+    export_parser.add_argument('path')
+    export_parser.add_argument('--format', choices=sorted(FORMATS), default='nginx')
+    export_parser.add_argument('--batch', type=int, default=settings.batch_chunk_size)
+    export_parser.add_argument('--chunk', type=int, default=1000000)
+    update_parser = commands.add_parser('update', help='apply the change log')
+    update_parser.add_argument('path')
+    update_parser.add_argument('--batch', type=int, default=settings.batch_chunk_size)
+    lookup_parser = commands.add_parser('lookup', help='find a link in a binary file')
+    lookup_parser.add_argument('path')
+    lookup_parser.add_argument('url_id')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,85 @@
+"""Raw ASGI fast path of the redirects.
+
+The redirect is the hottest endpoint. With redirect_fast_path the GET
+/urls/{url_id} requests are served by a middleware before the FastAPI
+routing, validation and response classes. It does the same storage lookup
+and view counting as the route and writes the same headers, the Location
+header value is memoized by the stored URL. The other requests are passed
+to the application.
+"""
+
+import re
+from functools import lru_cache
+from urllib import parse
+
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+
+from urlshrtr import error, handlers, storage
+from urlshrtr.config import settings
+from urlshrtr.schema import ID_PATTERN
+
+PREFIX = '/urls/'
+URL_ID = re.compile(ID_PATTERN)  # the other paths are rejected by the route
+LOCATION_SAFE = ":/%#?=@[]!$&'()*+,;"  # the RedirectResponse quoting
+
+
+@lru_cache(maxsize=10000)
+def location(url: str) -> bytes:
+    """Make the Location header value of the URL.
+
+    Args:
+        url (str): The raw URL from the storage.
+
+    Returns:
+        bytes: The header value.
+    """
+    return parse.quote(url, safe=LOCATION_SAFE).encode('latin-1')
+
+
+class RedirectFastPath:
+    """ASGI middleware serving the redirects without the FastAPI routing."""
+
+    def __init__(self, app):
+        """Init the middleware.
+
+        Args:
+            app: The wrapped ASGI application.
+        """
+        self.app = app
+        self.status = settings.redirect_status_code
+        self.headers = [
+            (
+                b'cache-control',
+                handlers._cache_control(settings.redirect_max_age, 'no-store').encode(),
+            ),
+            (b'content-length', b'0'),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        """Serve the redirect or call the application."""
+        path = scope['path'] if scope['type'] == 'http' else ''
+        url_id = path[len(PREFIX) :]
+        if (
+            not path.startswith(PREFIX)
+            or not URL_ID.fullmatch(url_id)
+            or scope['method'] != 'GET'
+        ):
+            return await self.app(scope, receive, send)
+        scope['endpoint'] = handlers.redirect_to_url
+        try:
+            url = await storage.backend.get_short_url(url_id)
+            error.raise_if_url_not_found(url_id, url)
+        except HTTPException as e:
+            response = JSONResponse(
+                {'detail': e.detail}, status_code=e.status_code, headers=e.headers
+            )
+            return await response(scope, receive, send)
+        await send(
+            {
+                'type': 'http.response.start',
+                'status': self.status,
+                'headers': self.headers + [(b'location', location(url))],
+            }
+        )
+        await send({'type': 'http.response.body', 'body': b''})
@@ -1,47 +1,158 @@
-from fastapi import APIRouter
-from starlette.responses import RedirectResponse
+from hashlib import sha1
+
+from fastapi import APIRouter, Path, Request
+from starlette.responses import RedirectResponse, Response
 
 from urlshrtr import logic
+from urlshrtr.config import settings
+from urlshrtr.responses import json_response
 from urlshrtr.schema import (
+    ID_PATTERN,
     DeleteShortUrlResponse,
+    ShortUrlBatchRequest,
+    ShortUrlBatchResponse,
     ShortUrlRequest,
+    ShortUrlResolveRequest,
+    ShortUrlResolveResponse,
     ShortUrlResponse,
+    ShortUrlStatsBatchResponse,
+    ShortUrlStatsRequest,
     ShortUrlStatsResponse,
+    ShortUrlViewsRequest,
+    ShortUrlViewsResponse,
 )
 
 router = APIRouter(prefix='/urls')
 
+# the internal keys share the keyspace of the url records, they aren't url IDs
+URL_ID = Path(..., regex=ID_PATTERN)
+
 
 @router.get('/{url_id}')
-async def redirect_to_url(url_id: str) -> RedirectResponse:
-    """Redirect to the original URL."""
+async def redirect_to_url(url_id: str = URL_ID) -> RedirectResponse:
+    """Redirect to the original URL.
+
+    The redirects cached by the browsers and CDNs are not counted
+    as views, unless they're ingested with the views endpoint.
+    """
     url = await logic.get_short_url(url_id)
-    return RedirectResponse(url)
+    return RedirectResponse(
+        url,
+        status_code=settings.redirect_status_code,
+        headers={
+            'Cache-Control': _cache_control(settings.redirect_max_age, 'no-store')
+        },
+    )
 
 
 @router.post('/', response_model=ShortUrlResponse)
 async def create_url(url_data: ShortUrlRequest) -> ShortUrlResponse:
     """Create a new short URL."""
-    response = await logic.create_short_url(url_data.url)
-    return response
+    response = await logic.create_short_url(
+        url_data.url,
+        owner=url_data.owner,
+        campaign=url_data.campaign,
+        ttl=url_data.ttl,
+        expires_at=url_data.expires_at,
+    )
+    return json_response(response)
+
+
+@router.post('/batch', response_model=ShortUrlBatchResponse)
+async def create_urls(batch_data: ShortUrlBatchRequest) -> ShortUrlBatchResponse:
+    """Create new short URLs in bulk."""
+    result = await logic.create_short_urls(
+        batch_data.urls,
+        owner=batch_data.owner,
+        campaign=batch_data.campaign,
+        ttl=batch_data.ttl,
+        expires_at=batch_data.expires_at,
+    )
+    return json_response(result)
+
+
+@router.post('/resolve', response_model=ShortUrlResolveResponse)
+async def resolve_urls(resolve_data: ShortUrlResolveRequest) -> ShortUrlResolveResponse:
+    """Get the original URLs for the short url IDs in bulk."""
+    result = await logic.resolve_short_urls(
+        resolve_data.url_ids, count_views=resolve_data.count_views
+    )
+    return json_response(result)
+
+
+@router.post('/views', response_model=ShortUrlViewsResponse)
+async def record_views(views_data: ShortUrlViewsRequest) -> ShortUrlViewsResponse:
+    """Record the views of the redirects served by the edge caches."""
+    result = await logic.record_views(views_data.views)
+    return json_response(result)
+
+
+@router.post('/stats', response_model=ShortUrlStatsBatchResponse)
+async def get_urls_stats(
+    stats_data: ShortUrlStatsRequest,
+) -> ShortUrlStatsBatchResponse:
+    """Get the view count stats for many URLs."""
+    result = await logic.get_short_urls_stats(
+        stats_data.url_ids, owner=stats_data.owner, campaign=stats_data.campaign
+    )
+    return json_response(result)
 
 
 @router.put('/{url_id}', response_model=ShortUrlResponse)
-async def update_url(url_id: str, url_data: ShortUrlRequest) -> ShortUrlResponse:
+async def update_url(
+    url_data: ShortUrlRequest, url_id: str = URL_ID
+) -> ShortUrlResponse:
     """Update the existing short URL."""
-    result = await logic.update_short_url(url_data.url, url_id)
-    return result
+    result = await logic.update_short_url(
+        url_data.url, url_id, ttl=url_data.ttl, expires_at=url_data.expires_at
+    )
+    return json_response(result)
 
 
 @router.delete('/{url_id}', response_model=DeleteShortUrlResponse)
-async def delete_url(url_id: str) -> DeleteShortUrlResponse:
+async def delete_url(url_id: str = URL_ID) -> DeleteShortUrlResponse:
     """Delete the existing short URL."""
     result = await logic.delete_short_url(url_id)
-    return result
+    return json_response(result)
 
 
 @router.get('/{url_id}/stats', response_model=ShortUrlStatsResponse)
-async def get_url_stats(url_id: str) -> ShortUrlStatsResponse:
-    """Get the URL view count stats."""
+async def get_url_stats(request: Request, url_id: str = URL_ID) -> Response:
+    """Get the URL view count stats, 304 if they're not modified."""
     result = await logic.get_short_url_stats(url_id)
-    return result
+    return _conditional_response(request, result, settings.stats_max_age)
+
+
+def _cache_control(max_age: int, uncached: str) -> str:
+    """Make the Cache-Control header value.
+
+    Args:
+        max_age (int): The caching time in seconds.
+        uncached (str): The header value if max_age is 0.
+
+    Returns:
+        str: The header value.
+    """
+    return f'public, max-age={max_age}' if max_age else uncached
+
+
+def _conditional_response(request: Request, data, max_age: int) -> Response:
+    """Make the JSON response with an ETag, 304 if the client has it already.
+
+    Args:
+        request (Request): The request with the If-None-Match header.
+        data: The response data.
+        max_age (int): The caching time in seconds, the response is
+            revalidated on every request if it's 0.
+
+    Returns:
+        Response: The JSON response or the empty 304 one.
+    """
+    headers = {'Cache-Control': _cache_control(max_age, 'no-cache')}
+    response = json_response(data, headers=headers)
+    etag = f'"{sha1(response.body).hexdigest()}"'
+    if_none_match = request.headers.get('if-none-match', '')
+    if etag in (tag.strip().removeprefix('W/') for tag in if_none_match.split(',')):
+        return Response(status_code=304, headers=dict(headers, ETag=etag))
+    response.headers['ETag'] = etag
+    return response
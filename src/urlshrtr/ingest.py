@@ -0,0 +1,130 @@
+"""Asynchronous batched ingestion of the URL view events."""
+
+import asyncio
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from urlshrtr.config import logger
+
+# (url_id, bucket timestamp in ms) -> number of views
+ViewCounts = Dict[Tuple[str, int], int]
+
+
+class ClickIngestor:
+    """A bounded in-process buffer of the view events flushed in background.
+
+    The events are flushed when the buffer reaches the batch size or on the
+    flush interval, whichever comes first. The events recorded while the
+    buffer is full are dropped, so a Redis slowdown never blocks the redirects.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[List[ViewCounts]], Awaitable],
+        maxsize: int,
+        batch_size: int,
+        flush_interval: float,
+        bucket_size: int = 1,
+    ):
+        """Init the ingestor.
+
+        Args:
+            flush: Coroutine function writing the batches of view counts.
+            maxsize (int): Max number of the buffered events.
+            batch_size (int): Max number of the events in one batch.
+            flush_interval (float): Max time in seconds between the flushes.
+            bucket_size (int): The events timestamps are truncated to
+                the bucket size in ms, so the views are pre-aggregated.
+        """
+        self.flush_batches = flush
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.bucket_size = bucket_size
+        self.recorded = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.failed = 0
+        self._events: List[Tuple[str, int]] = []
+        self._running = False
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def queue_depth(self) -> int:
+        """Get the number of the buffered events."""
+        return len(self._events)
+
+    def record(self, url_id: str):
+        """Record a view event of the short URL.
+
+        Args:
+            url_id (str): The short url ID.
+        """
+        if len(self._events) >= self.maxsize:
+            self.dropped += 1
+            return
+        timestamp = int(time.time() * 1000)
+        self._events.append((url_id, timestamp - timestamp % self.bucket_size))
+        self.recorded += 1
+        if self._wakeup is not None and len(self._events) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Write all the buffered events in batches."""
+        events, self._events = self._events, []
+        if not events:
+            return
+        batches = [
+            Counter(events[i : i + self.batch_size])
+            for i in range(0, len(events), self.batch_size)
+        ]
+        try:
+            await self.flush_batches(batches)
+            self.flushed += len(events)
+        except Exception:
+            self.failed += len(events)
+            logger.exception('View events flush error')
+
+    async def run(self):
+        """Flush the events by the batch size or the flush interval."""
+        while self._running:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        """Start the background flush task."""
+        if self._task is None:
+            self._running = True
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stop the background flush task and drain the buffered events."""
+        if self._task is not None:
+            self._running = False
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._wakeup = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        """Get the ingestion counters.
+
+        Returns:
+            dict: The recorded, dropped, flushed, failed counters
+                and the queue depth.
+        """
+        return dict(
+            recorded=self.recorded,
+            dropped=self.dropped,
+            flushed=self.flushed,
+            failed=self.failed,
+            queue_depth=self.queue_depth,
+        )
@@ -0,0 +1,58 @@
+"""Cross-worker invalidation of the in-process URL cache over Redis pub/sub."""
+
+import asyncio
+from typing import List
+
+from redis.asyncio.client import Redis
+from redis.exceptions import RedisError
+
+from urlshrtr import redis_connector
+from urlshrtr.cache import url_cache
+from urlshrtr.config import logger, settings
+
+_listener_tasks: List[asyncio.Task] = []
+
+
+async def listen_invalidations(client: Redis):
+    """Drop the cached URLs updated or deleted by the other workers.
+
+    The url IDs are published to the invalidation channel of the shard
+    owning the URL by the model layer. The publishes are replicated, so a
+    listener on a read replica gets the url ID once the replica has the
+    update and the URLs read from a lagging replica aren't kept stale
+    in the cache. The cache is cleared on every
+    (re)subscribe, since the invalidations published while the listener
+    was disconnected are lost.
+
+    Args:
+        client (Redis): The shard or read replica Redis client.
+    """
+    while True:
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(settings.url_cache_channel)
+            url_cache.clear()
+            async for message in pubsub.listen():
+                url_cache.invalidate(message['data'].decode())
+        except RedisError:
+            logger.exception('Cache invalidation listener error')
+            await asyncio.sleep(settings.url_cache_reconnect_delay)
+        finally:
+            await pubsub.reset()
+
+
+def start_listener():
+    """Start the invalidation listener tasks, one per shard and read replica."""
+    if not _listener_tasks:
+        _listener_tasks.extend(
+            asyncio.create_task(listen_invalidations(client))
+            for client in redis_connector.get_clients(replicas=True)
+        )
+
+
+async def stop_listener():
+    """Stop the invalidation listener background tasks."""
+    for task in _listener_tasks:
+        task.cancel()
+    await asyncio.gather(*_listener_tasks, return_exceptions=True)
+    _listener_tasks.clear()
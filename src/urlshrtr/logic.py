@@ -1,12 +1,26 @@
 """Application business logic layer."""
 
-from urllib import parse
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
 
-from urlshrtr import error, model
+from pydantic import ValidationError
+
+from urlshrtr import error, storage
+from urlshrtr.config import settings
 from urlshrtr.schema import (
     DeleteShortUrlResponse,
+    ShortUrlBatchItem,
+    ShortUrlBatchResponse,
+    ShortUrlRequest,
+    ShortUrlResolveItem,
+    ShortUrlResolveResponse,
     ShortUrlResponse,
+    ShortUrlStatsBatchResponse,
     ShortUrlStatsResponse,
+    ShortUrlViewItem,
+    ShortUrlViewsResponse,
 )
 
 
@@ -22,33 +36,123 @@ async def get_short_url(url_id: str) -> str:
     Raises:
         HTTPException: if the ShortURL with url_id is not found in Redis.
     """
-    result = await model.get_short_url(url_id)
+    result = await storage.backend.get_short_url(url_id)
     error.raise_if_url_not_found(url_id, result)
-    return parse.unquote_plus(result)
+    return result
+
 
+async def resolve_short_urls(
+    url_ids: List[str], count_views: bool = False
+) -> ShortUrlResolveResponse:
+    """Get the original URLs for the short url IDs in bulk.
+
+    Args:
+        url_ids (list): The short url IDs.
+        count_views (bool): Count the lookups as the URL views.
+
+    Returns:
+        ShortUrlResolveResponse: The results in the input order,
+            url is None for the ShortURLs not found in Redis.
+    """
+    urls = await storage.backend.get_short_urls(url_ids, count_views=count_views)
+    return ShortUrlResolveResponse(
+        results=[
+            ShortUrlResolveItem(url_id=url_id, url=url)
+            for url_id, url in zip(url_ids, urls)
+        ]
+    )
 
-async def create_short_url(url: str) -> ShortUrlResponse:
+
+async def create_short_url(
+    url: str,
+    owner: Optional[str] = None,
+    campaign: Optional[str] = None,
+    ttl: Optional[int] = None,
+    expires_at: Optional[datetime] = None,
+) -> ShortUrlResponse:
     """Create a new short URL.
 
-    Url is normalized and stored in Redis.
+    The raw url is stored in Redis.
 
     Args:
         url (str): The original URL.
+        owner (str): The owner stats label.
+        campaign (str): The campaign stats label.
+        ttl (int): The link time to live in seconds.
+        expires_at (datetime): The link expiry time.
 
     Returns:
         ShortUrlResponse: The created short URL response item.
+
+    Raises:
+        HTTPException: if no free short url ID was allocated.
+    """
+    expiry = _expiry(ttl, expires_at, settings.url_default_ttl)
+    url_id = await storage.backend.create_short_url(
+        url, _labels(owner, campaign), expiry
+    )
+    error.raise_if_id_not_allocated(url_id)
+    return ShortUrlResponse(url=url, url_id=url_id, expires_at=_datetime(expiry))
+
+
+async def create_short_urls(
+    urls: List[str],
+    owner: Optional[str] = None,
+    campaign: Optional[str] = None,
+    ttl: Optional[int] = None,
+    expires_at: Optional[datetime] = None,
+) -> ShortUrlBatchResponse:
+    """Create new short URLs in bulk.
+
+    Every url is validated with the ShortUrlRequest rules, the valid ones
+    are stored in Redis and reported as normalized by the validation.
+
+    Args:
+        urls (list): The original URLs.
+        owner (str): The owner stats label.
+        campaign (str): The campaign stats label.
+        ttl (int): The links time to live in seconds.
+        expires_at (datetime): The links expiry time.
+
+    Returns:
+        ShortUrlBatchResponse: The results in the input order
+            with the per-item errors.
     """
-    safe_url = parse.quote_plus(url)
-    url_id = await model.create_short_url(safe_url)
-    return ShortUrlResponse(url=url, url_id=url_id)
+    results = [ShortUrlBatchItem(url=url) for url in urls]
+    valid_results = []
+    for result in results:
+        try:
+            result.url = ShortUrlRequest(url=result.url).url
+        except ValidationError as e:
+            result.error = e.errors()[0]['msg']
+        else:
+            valid_results.append(result)
+    url_ids = await storage.backend.create_short_urls(
+        [result.url for result in valid_results],
+        _labels(owner, campaign),
+        _expiry(ttl, expires_at, settings.url_default_ttl),
+    )
+    for result, url_id in zip(valid_results, url_ids):
+        if url_id is None:
+            result.error = 'Failed to create the short url'
+        result.url_id = url_id
+    return ShortUrlBatchResponse(results=results)
 
 
-async def update_short_url(url: str, url_id: str) -> ShortUrlResponse:
+async def update_short_url(
+    url: str,
+    url_id: str,
+    ttl: Optional[int] = None,
+    expires_at: Optional[datetime] = None,
+) -> ShortUrlResponse:
     """Update an existing short URL.
 
     Args:
         url (str): The new updated URL.
         url_id (str): The short url ID.
+        ttl (int): The new link time to live in seconds.
+        expires_at (datetime): The new link expiry time.
+            The current expiry is kept if neither is set.
 
     Returns:
         ShortUrlResponse: The updated short URL response item.
@@ -56,10 +160,10 @@ async def update_short_url(url: str, url_id: str) -> ShortUrlResponse:
     Raises:
         HTTPException: if the ShortURL with url_id is not found in Redis.
     """
-    safe_url = parse.quote_plus(url)
-    result = await model.update_short_url(safe_url, url_id)
+    expiry = _expiry(ttl, expires_at)
+    result = await storage.backend.update_short_url(url, url_id, expiry)
     error.raise_if_url_not_found(url_id, result)
-    return ShortUrlResponse(url=url, url_id=url_id)
+    return ShortUrlResponse(url=url, url_id=url_id, expires_at=_datetime(expiry))
 
 
 async def delete_short_url(url_id: str) -> DeleteShortUrlResponse:
@@ -74,7 +178,7 @@ async def delete_short_url(url_id: str) -> DeleteShortUrlResponse:
     Raises:
         HTTPException: if the ShortURL with url_id is not found in Redis.
     """
-    result = await model.delete_short_url(url_id)
+    result = await storage.backend.delete_short_url(url_id)
     error.raise_if_url_not_found(url_id, result)
     return DeleteShortUrlResponse(url_id=url_id)
 
@@ -91,6 +195,111 @@ async def get_short_url_stats(url_id: str) -> ShortUrlStatsResponse:
     Raises:
         HTTPException: if the ShortURL with url_id is not found in Redis.
     """
-    result = await model.get_view_count(url_id)
+    result = await storage.backend.get_view_count(url_id)
     error.raise_if_url_not_found(url_id, result)
     return ShortUrlStatsResponse(last_24h=result, url_id=url_id)
+
+
+async def get_short_urls_stats(
+    url_ids: Optional[List[str]] = None,
+    owner: Optional[str] = None,
+    campaign: Optional[str] = None,
+) -> ShortUrlStatsBatchResponse:
+    """Get the stats for many short URLs - number of clicks for the last 24h period.
+
+    Args:
+        url_ids (list): The short url IDs.
+        owner (str): The owner stats label to filter by.
+        campaign (str): The campaign stats label to filter by.
+
+    Returns:
+        ShortUrlStatsBatchResponse: The stats of the matching short URLs,
+            the url_ids not found in Redis are skipped.
+    """
+    view_counts = await storage.backend.get_view_counts(
+        url_ids, _labels(owner, campaign)
+    )
+    return ShortUrlStatsBatchResponse(
+        results=[
+            ShortUrlStatsResponse(url_id=url_id, last_24h=view_count)
+            for url_id, view_count in view_counts.items()
+        ]
+    )
+
+
+async def record_views(views: List[ShortUrlViewItem]) -> ShortUrlViewsResponse:
+    """Record the views of the redirects served by the edge caches.
+
+    The views are counted in the stats buckets of their timestamps,
+    the future ones are counted as the current ones.
+
+    Args:
+        views (list): The view counts.
+
+    Returns:
+        ShortUrlViewsResponse: The number of the recorded views,
+            the views older than the stats retention and the views
+            of the url IDs not found are skipped.
+    """
+    url_ids = list({view.url_id: None for view in views})
+    urls = await storage.backend.get_short_urls(url_ids)
+    found_ids = {url_id for url_id, url in zip(url_ids, urls) if url is not None}
+    now = int(time.time() * 1000)
+    view_counts = Counter()
+    for view in views:
+        if view.url_id not in found_ids:
+            continue
+        timestamp = now
+        if view.timestamp is not None:
+            timestamp = min(int(_utc(view.timestamp).timestamp() * 1000), now)
+        if timestamp > now - settings.stats_retention:
+            bucket = timestamp - timestamp % settings.stats_bucket
+            view_counts[view.url_id, bucket] += view.count
+    if view_counts:
+        await storage.backend.update_view_counts([view_counts])
+    return ShortUrlViewsResponse(recorded=sum(view_counts.values()))
+
+
+def _labels(owner: Optional[str], campaign: Optional[str]) -> Dict[str, str]:
+    """Make the stats labels skipping the empty ones.
+
+    Args:
+        owner (str): The owner label.
+        campaign (str): The campaign label.
+
+    Returns:
+        dict: The stats labels.
+    """
+    labels = dict(owner=owner, campaign=campaign)
+    return {name: value for name, value in labels.items() if value}
+
+
+def _expiry(
+    ttl: Optional[int], expires_at: Optional[datetime], default_ttl: int = 0
+) -> Optional[int]:
+    """Get the link expiry unix time.
+
+    Args:
+        ttl (int): The link time to live in seconds.
+        expires_at (datetime): The link expiry time.
+        default_ttl (int): The time to live if neither is set, 0 for none.
+
+    Returns:
+        int: The expiry unix time in seconds or None if the link never expires.
+    """
+    if expires_at is not None:
+        return int(expires_at.timestamp())
+    ttl = ttl or default_ttl
+    return int(time.time()) + ttl if ttl else None
+
+
+def _utc(timestamp: datetime) -> datetime:
+    """Treat the naive datetime as UTC."""
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def _datetime(expiry: Optional[int]) -> Optional[datetime]:
+    """Convert the expiry unix time to the UTC datetime, None is kept."""
+    return datetime.fromtimestamp(expiry, timezone.utc) if expiry else None
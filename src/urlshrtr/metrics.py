@@ -0,0 +1,179 @@
+"""Prometheus metrics of the application.
+
+The request latency histograms are recorded by an ASGI middleware and
+the storage operation latency and errors by the handle_redis_errors
+decorator of the model layer. The counters of the worker components
+(cache, ingestion, connection pool, etc.) are copied to the gauges
+every metrics_stats_interval, so nothing is recorded on the hot paths.
+
+Under gunicorn the values of every worker are kept in the files of
+the PROMETHEUS_MULTIPROC_DIR directory and aggregated on the scrape.
+"""
+
+import asyncio
+import os
+from time import perf_counter
+from typing import Callable, Dict, Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from urlshrtr.config import logger, settings
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+request_latency = Histogram(
+    'urlshrtr_http_request_duration_seconds',
+    'HTTP request latency by the handler.',
+    ['method', 'handler', 'status'],
+    buckets=LATENCY_BUCKETS,
+)
+operation_latency = Histogram(
+    'urlshrtr_redis_operation_duration_seconds',
+    'Model layer Redis operation latency.',
+    ['operation'],
+    buckets=LATENCY_BUCKETS,
+)
+operation_errors = Counter(
+    'urlshrtr_redis_operation_errors',
+    'Model layer Redis operation errors.',
+    ['operation'],
+)
+worker_stats = Gauge(
+    'urlshrtr_worker_stats',
+    'Counters of the worker components, summed up over the live workers.',
+    ['component', 'stat'],
+    multiprocess_mode='livesum',
+)
+
+StatsSources = Dict[str, Callable[[], Dict[str, float]]]
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the request latency by the handler.
+
+    The handler is the name of the endpoint function set by the router,
+    so the unmatched paths don't make new series.
+    """
+
+    def __init__(self, app):
+        """Init the middleware.
+
+        Args:
+            app: The wrapped ASGI application.
+        """
+        self.app = app
+        self._observers: Dict[Tuple[str, str, int], Callable[[float], None]] = {}
+
+    async def __call__(self, scope, receive, send):
+        """Call the application and record the request latency."""
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        status = 500
+        started = perf_counter()
+
+        async def send_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            endpoint = scope.get('endpoint')
+            labels = (
+                scope['method'],
+                endpoint.__name__ if endpoint else 'unmatched',
+                status,
+            )
+            observe = self._observers.get(labels)
+            if observe is None:
+                observe = request_latency.labels(*labels).observe
+                self._observers[labels] = observe
+            observe(perf_counter() - started)
+
+
+def operation_metrics(operation: str) -> Tuple[Histogram, Counter]:
+    """Get the latency histogram and the error counter of the operation.
+
+    Args:
+        operation (str): The model layer function name.
+
+    Returns:
+        tuple: The latency histogram and the error counter.
+    """
+    return operation_latency.labels(operation), operation_errors.labels(operation)
+
+
+def update_stats(sources: StatsSources):
+    """Copy the counters of the worker components to the gauges.
+
+    Args:
+        sources (dict): The stats functions by the component name.
+    """
+    for component, stats in sources.items():
+        for stat, value in stats().items():
+            worker_stats.labels(component, stat).set(value)
+
+
+def render() -> Tuple[bytes, str]:
+    """Render the metrics of all the workers.
+
+    Returns:
+        tuple: The metrics in the Prometheus text format and the content type.
+    """
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class StatsUpdater:
+    """Updates the worker stats gauges in the background."""
+
+    def __init__(self, interval: float):
+        """Init the updater.
+
+        Args:
+            interval (float): Time in seconds between the updates.
+        """
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self, sources: StatsSources):
+        """Update the gauges on the interval."""
+        while True:
+            try:
+                update_stats(sources)
+            except Exception:
+                logger.exception('Worker stats metrics update error')
+            await asyncio.sleep(self.interval)
+
+    def start(self, sources: StatsSources):
+        """Start the background update task.
+
+        Args:
+            sources (dict): The stats functions by the component name.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self.run(sources))
+
+    async def stop(self):
+        """Stop the background update task."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+stats_updater = StatsUpdater(settings.metrics_stats_interval)
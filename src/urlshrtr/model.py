@@ -1,27 +1,231 @@
 """Model layer."""
 
+import asyncio
 import time
-from typing import Optional
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
 
-import nanoid
-from nanoid.resources import alphabet
+from redis.asyncio.client import Redis
+from redis.exceptions import NoScriptError, RedisError
 
-from urlshrtr import error
-from urlshrtr.config import settings
-from urlshrtr.redis_connector import redis_client
+from urlshrtr import error, invalidation, redis_connector, scripts
+from urlshrtr.allocator import id_allocator
+from urlshrtr.cache import url_cache
+from urlshrtr.compact import is_expired, url_codec, url_record
+from urlshrtr.config import logger, settings
+from urlshrtr.dedup import labels_field, url_fingerprint
+from urlshrtr.ingest import ClickIngestor, ViewCounts
+from urlshrtr.sweeper import Sweeper
+
+# url_id -> the end of the read-your-writes window, in the insertion order
+_recent_writes: OrderedDict = OrderedDict()
+
+
+async def start():
+    """Connect to Redis, load the Lua scripts and start the background tasks."""
+    redis_connector.connect()
+    try:
+        for client in redis_connector.get_clients(replicas=True):
+            await scripts.load_scripts(client)
+    except RedisError:
+        # The scripts are loaded on the first NOSCRIPT error then
+        logger.exception('Lua scripts loading error')
+    if url_cache.enabled:
+        invalidation.start_listener()
+    if settings.click_ingest_enabled:
+        click_ingestor.start()
+    if settings.stats_sweep_enabled:
+        stats_sweeper.start()
+    if settings.url_layout == 'compact':
+        expiry_purger.start()
+
+
+async def stop():
+    """Stop the background tasks and close the Redis connections."""
+    await invalidation.stop_listener()
+    await click_ingestor.stop()
+    await stats_sweeper.stop()
+    await expiry_purger.stop()
+    await redis_connector.disconnect()
 
 
 @error.handle_redis_errors
 async def update_view_count(url_id: str):
     """Update (increase) the URL view count stats.
 
+    The stats series keeps one sample per bucket, duplicates are summed up.
+    The series is created by the first view.
+
     Args:
         url_id (str): The short url ID.
 
     Raises:
         HTTPException: if some error happened during the Redis update.
     """
-    await redis_client.ts().add(_stats_key(url_id), '*', 1)
+    await _add_views(redis_connector.get_client(url_id).ts(), url_id, _ts_bucket(), 1)
+
+
+@error.handle_redis_errors
+async def update_view_counts(batches: List[ViewCounts]):
+    """Write the batches of the view counts, one TS.ADD per sample.
+
+    All the batches are sent in a single pipeline per shard. TS.ADD is used
+    instead of TS.MADD, so the missing series are created by the first view.
+
+    Args:
+        batches (list): The view counts by the url ID and the timestamp.
+
+    Raises:
+        HTTPException: if some error happened during the Redis update.
+    """
+    pipelines = {}
+    for views in batches:
+        samples = list(views.items())
+        url_ids = [url_id for url_id, _ in views]
+        for client, positions in redis_connector.group_by_shard(url_ids):
+            if client not in pipelines:
+                pipelines[client] = client.pipeline(transaction=False)
+            ts = pipelines[client].ts()
+            for i in positions:
+                (url_id, timestamp), count = samples[i]
+                _add_views(ts, url_id, timestamp, count)
+    await asyncio.gather(*(pipeline.execute() for pipeline in pipelines.values()))
+
+
+def _add_views(ts, url_id: str, timestamp: int, count: int):
+    """Add the views to the stats series, creating it if it's missing.
+
+    Args:
+        ts: The Redis TimeSeries commands of a client or a pipeline.
+        url_id (str): The short url ID.
+        timestamp (int): The stats bucket timestamp in ms.
+        count (int): The number of views.
+
+    Returns:
+        The TS.ADD result, or the pipeline for the pipelined command.
+    """
+    return ts.add(
+        _stats_key(url_id),
+        timestamp,
+        count,
+        retention_msecs=settings.stats_retention,
+        labels={'url_id': url_id},
+        duplicate_policy='sum',
+    )
+
+
+click_ingestor = ClickIngestor(
+    update_view_counts,
+    maxsize=settings.click_queue_size,
+    batch_size=settings.click_batch_size,
+    flush_interval=settings.click_flush_interval,
+    bucket_size=settings.stats_bucket,
+)
+
+
+async def sweep_stats() -> int:
+    """Delete the orphaned and expired stats series of all the shards.
+
+    The series of the deleted URLs and the ones with the url_id label only
+    and no views for stats_retention are deleted, they are created again
+    by the next view. The series are scanned and checked in batches of
+    stats_sweep_batch, one script per series in one pipeline per batch.
+    Every shard is swept by one worker per interval, the one which got
+    the shard sweep lock.
+
+    Returns:
+        int: The number of the deleted series.
+    """
+    swept = 0
+    min_timestamp = int(time.time() * 1000) - settings.stats_retention
+    for client in redis_connector.get_clients():
+        locked = await client.set(
+            settings.stats_sweep_lock,
+            1,
+            nx=True,
+            ex=max(int(settings.stats_sweep_interval), 1),
+        )
+        if not locked:
+            continue
+        await client.script_load(scripts.sweep_stats.source)
+        keys = []
+        async for key in client.scan_iter(
+            match='*:stats', count=settings.stats_sweep_batch, _type='TSDB-TYPE'
+        ):
+            keys.append(key.decode())
+            if len(keys) >= settings.stats_sweep_batch:
+                swept += await _sweep_stats_batch(client, keys, min_timestamp)
+                keys = []
+        if keys:
+            swept += await _sweep_stats_batch(client, keys, min_timestamp)
+    return swept
+
+
+async def _sweep_stats_batch(client: Redis, keys: List[str], min_timestamp: int) -> int:
+    """Delete the orphaned and expired stats series of the batch.
+
+    Args:
+        client (Redis): The shard Redis client.
+        keys (list): The stats keys.
+        min_timestamp (int): The series without views since the timestamp
+            in ms are expired.
+
+    Returns:
+        int: The number of the deleted series.
+    """
+    pipeline = client.pipeline(transaction=False)
+    for key in keys:
+        url_id = key[: -len(':stats')].strip('{}')
+        record_key, field = _url_record(url_id)
+        scripts.sweep_stats.queue(pipeline, [record_key, key], [field, min_timestamp])
+    return sum(await pipeline.execute())
+
+
+stats_sweeper = Sweeper(
+    sweep_stats, interval=settings.stats_sweep_interval, name='Stats'
+)
+
+
+async def purge_expired() -> int:
+    """Delete the expired compact layout records of all the shards.
+
+    The string records expire with the native Redis TTLs, the compact ones
+    are indexed by the expiry time in a sorted set per shard. They are read
+    as missing once expired, the purge frees the memory. The due url IDs
+    are read by url_purge_batch and deleted with a script per record
+    in one pipeline per batch.
+
+    Returns:
+        int: The number of the deleted records.
+    """
+    if settings.url_layout != 'compact':
+        return 0
+    purged = 0
+    now = int(time.time())
+    for client in redis_connector.get_clients():
+        await client.script_load(scripts.purge_url.source)
+        while True:
+            url_ids = await client.zrangebyscore(
+                settings.url_expiry_key, '-inf', now, 0, settings.url_purge_batch
+            )
+            pipeline = client.pipeline(transaction=False)
+            for url_id in url_ids:
+                url_id = url_id.decode()
+                key, field = _url_record(url_id)
+                scripts.purge_url.queue(
+                    pipeline,
+                    _record_keys(url_id, key, field),
+                    [field, now, _invalidation_channel(), url_id, _changelog_maxlen()],
+                )
+            purged += sum(await pipeline.execute())
+            if len(url_ids) < settings.url_purge_batch:
+                break
+    return purged
+
+
+expiry_purger = Sweeper(
+    purge_expired, interval=settings.url_purge_interval, name='Expiry purge'
+)
 
 
 @error.handle_redis_errors
@@ -30,6 +234,11 @@ async def get_view_count(
 ) -> Optional[int]:
     """Get the URL view count stats.
 
+    The views are stored in per-bucket samples, so the range query reads at
+    most interval / stats_bucket samples regardless of the URL traffic.
+    The URL existence check and the range query are done in one script
+    on a read replica.
+
     Args:
         url_id (str): The short url ID.
         interval (int): The stats period in ms. (defaults to one day)
@@ -40,22 +249,126 @@ async def get_view_count(
     Raises:
         HTTPException: if some error happened during the Redis request.
     """
-    url_exists = await redis_client.get(url_id)
-    if not url_exists:
-        return None
-    result = await redis_client.ts().range(
-        _stats_key(url_id),
-        _ts_24h_ago(),
-        '+',
-        aggregation_type='sum',
-        bucket_size_msec=interval,
+    key, field = _url_record(url_id)
+    return await scripts.get_view_count(
+        _get_read_client(url_id),
+        [key, _stats_key(url_id)],
+        [field, _ts_24h_ago(), interval],
     )
-    return int(result[0][1]) if result else 0
+
+
+@error.handle_redis_errors
+async def get_view_counts(
+    url_ids: Optional[List[str]] = None,
+    labels: Optional[Dict[str, str]] = None,
+    interval: int = settings.stats_period,
+) -> Dict[str, int]:
+    """Get the view count stats for many URLs in one round-trip per shard.
+
+    The stats series are selected by the url_id and the other labels set
+    on create with TS.MRANGE, one per batch_chunk_size url IDs of a shard.
+    The URLs existence checks are sent in the same pipeline. The label
+    filters without url IDs are sent to all the shards. The queries are
+    sent to the read replicas.
+
+    Args:
+        url_ids (list): The short url IDs.
+        labels (dict): The stats labels to filter by.
+        interval (int): The stats period in ms. (defaults to one day)
+
+    Returns:
+        dict: The number of views for the last interval by the url ID.
+            For the url_ids query the missing URLs are skipped
+            and the URLs without the labeled stats have zero views.
+
+    Raises:
+        HTTPException: if some error happened during the Redis request.
+    """
+    url_ids = url_ids or []
+    label_filters = [f'{name}={value}' for name, value in (labels or {}).items()]
+    if url_ids:
+        shards = [
+            (client, [url_ids[i] for i in positions])
+            for client, positions in redis_connector.group_by_shard(
+                url_ids, read=not _read_from_primary(url_ids)
+            )
+        ]
+    else:
+        shards = [(client, []) for client in redis_connector.get_read_clients()]
+    view_counts = {}
+    for shard_view_counts in await asyncio.gather(
+        *(
+            _get_shard_view_counts(client, shard_url_ids, label_filters, interval)
+            for client, shard_url_ids in shards
+        )
+    ):
+        view_counts.update(shard_view_counts)
+    if not url_ids:
+        return view_counts
+    return {url_id: view_counts[url_id] for url_id in url_ids if url_id in view_counts}
+
+
+async def _get_shard_view_counts(
+    client: Redis, url_ids: List[str], label_filters: List[str], interval: int
+) -> Dict[str, int]:
+    """Get the view count stats of the shard URLs in one pipeline.
+
+    Args:
+        client (Redis): The shard Redis client.
+        url_ids (list): The short url IDs owned by the shard.
+        label_filters (list): The TS.MRANGE label filters.
+        interval (int): The stats period in ms.
+
+    Returns:
+        dict: The number of views for the last interval by the url ID.
+    """
+    chunks = [
+        url_ids[start : start + settings.batch_chunk_size]
+        for start in range(0, len(url_ids), settings.batch_chunk_size)
+    ]
+    pipeline = client.pipeline(transaction=False)
+    for url_id in url_ids:
+        key, field = _url_record(url_id)
+        if field:
+            pipeline.hget(key, field)
+        else:
+            pipeline.exists(key)
+    for chunk in chunks or [None]:
+        filters = label_filters + ([f'url_id=({",".join(chunk)})'] if chunk else [])
+        pipeline.ts().mrange(
+            _ts_24h_ago(),
+            '+',
+            filters,
+            aggregation_type='sum',
+            bucket_size_msec=interval,
+            select_labels=['url_id'],
+        )
+    results = await pipeline.execute()
+    view_counts = {}
+    for series in results[len(url_ids) :]:
+        for item in series:
+            for series_labels, samples in item.values():
+                url_id = series_labels['url_id']
+                view_counts[url_id] = view_counts.get(url_id, 0) + sum(
+                    int(value) for _, value in samples
+                )
+    if not url_ids:
+        return view_counts
+    return {
+        url_id: view_counts.get(url_id, 0)
+        for url_id, record in zip(url_ids, results)
+        if record and not (isinstance(record, bytes) and is_expired(record))
+    }
 
 
 @error.handle_redis_errors
 async def get_short_url(url_id: str) -> str:
-    """Get the ShortURL record from Redis.
+    """Get the ShortURL record from the in-process cache or Redis.
+
+    The view is recorded in the background ingestor and the URL is read
+    from a read replica, or the view is counted in the same script as
+    the lookup on the primary if the background ingestion is disabled.
+    A version 1 string record is rewritten with the raw URL on read.
 
     Args:
         url_id (str): The short url ID.
@@ -66,42 +379,175 @@ async def get_short_url(url_id: str) -> str:
     Raises:
         HTTPException: if some error happened during the Redis request.
     """
-    result = await redis_client.get(url_id)
-    if not result:
+    url = url_cache.get(url_id)
+    if url is not None:
+        if settings.click_ingest_enabled:
+            click_ingestor.record(url_id)
+        else:
+            await update_view_count(url_id)
+        return url
+    key, field = _url_record(url_id)
+    if not settings.click_ingest_enabled:
+        result = await scripts.get_url(
+            redis_connector.get_client(url_id),
+            [key, _stats_key(url_id)],
+            [field, _ts_bucket(), settings.stats_retention, url_id],
+        )
+    elif field:
+        result = await _get_read_client(url_id).hget(key, field)
+    else:
+        result = await _get_read_client(url_id).get(key)
+    url = url_codec.decode(result) if result else None
+    if url is None:
         return None
-    await update_view_count(url_id)
-    return result.decode()
+    if settings.url_migrate_on_read and url_codec.is_legacy(result):
+        await _migrate_records([(url_id, result)])
+    if settings.click_ingest_enabled:
+        click_ingestor.record(url_id)
+    url_cache.set(url_id, url)
+    return url
 
 
 @error.handle_redis_errors
-async def create_short_url(url: str) -> str:
+async def get_short_urls(
+    url_ids: List[str], count_views: bool = False
+) -> List[Optional[str]]:
+    """Get the ShortURL records from the in-process cache or Redis in bulk.
+
+    The cache misses are fetched with MGETs of batch_chunk_size keys,
+    or HGETs in the compact layout, sent in a single pipeline per shard
+    to the read replicas.
+
+    Args:
+        url_ids (list): The short url IDs.
+        count_views (bool): Count the lookups as the URL views.
+
+    Returns:
+        list: The original URLs in the input order, None for the missing ones.
+
+    Raises:
+        HTTPException: if some error happened during the Redis request.
+    """
+    urls = [url_cache.get(url_id) for url_id in url_ids]
+    missing_ids = [url_id for url_id, url in zip(url_ids, urls) if url is None]
+    if missing_ids:
+        shards = redis_connector.group_by_shard(
+            missing_ids, read=not _read_from_primary(missing_ids)
+        )
+        pipelines = []
+        compact = settings.url_layout == 'compact'
+        for client, positions in shards:
+            records = [_url_record(missing_ids[i]) for i in positions]
+            pipeline = client.pipeline(transaction=False)
+            if compact:
+                for key, field in records:
+                    pipeline.hget(key, field)
+            else:
+                keys = [key for key, _ in records]
+                for start in range(0, len(keys), settings.batch_chunk_size):
+                    pipeline.mget(keys[start : start + settings.batch_chunk_size])
+            pipelines.append(pipeline)
+        found = [None] * len(missing_ids)
+        for (_, positions), shard_found in zip(
+            shards, await asyncio.gather(*(p.execute() for p in pipelines))
+        ):
+            if not compact:
+                shard_found = [result for chunk in shard_found for result in chunk]
+            for i, result in zip(positions, shard_found):
+                found[i] = result
+        results = iter(found)
+        legacy = []
+        for i, url in enumerate(urls):
+            if url is not None:
+                continue
+            result = next(results)
+            if result:
+                urls[i] = url_codec.decode(result)
+            if urls[i] is not None:
+                url_cache.set(url_ids[i], urls[i])
+                if url_codec.is_legacy(result):
+                    legacy.append((url_ids[i], result))
+        if legacy and settings.url_migrate_on_read:
+            await _migrate_records(legacy)
+    if count_views:
+        found_ids = [url_id for url_id, url in zip(url_ids, urls) if url]
+        if settings.click_ingest_enabled:
+            for url_id in found_ids:
+                click_ingestor.record(url_id)
+        elif found_ids:
+            timestamp = _ts_bucket()
+            await update_view_counts(
+                [Counter((url_id, timestamp) for url_id in found_ids)]
+            )
+    return urls
+
+
+@error.handle_redis_errors
+async def create_short_url(
+    url: str,
+    labels: Optional[Dict[str, str]] = None,
+    expires_at: Optional[int] = None,
+) -> Optional[str]:
     """Create the ShortURL record in Redis.
 
-    Also creates a TimeSeries record for the stats.
+    Also creates a TimeSeries record for the stats. With url_dedup
+    the existing ID of the known URL with the same labels is returned.
 
     Args:
         url (str): The original URL.
+        labels (dict): The extra stats labels, e.g. owner and campaign.
+        expires_at (int): The link expiry unix time, it never expires if not set.
 
     Returns:
-        str: The newly created short URL ID.
+        str: The newly created short URL ID or None if no free ID was allocated.
     """
-    url_id = nanoid.generate(alphabet, settings.url_key_length)
-    await redis_client.ts().create(
-        _stats_key(url_id),
-        retention_msec=settings.stats_retention,
-        duplicate_policy='first',
-    )
-    await redis_client.set(url_id, url)
-    return url_id
+    url_ids = await _create([url], labels, expires_at, raise_on_error=True)
+    return url_ids[0]
 
 
 @error.handle_redis_errors
-async def update_short_url(url: str, url_id: str) -> Optional[str]:
+async def create_short_urls(
+    urls: List[str],
+    labels: Optional[Dict[str, str]] = None,
+    expires_at: Optional[int] = None,
+) -> List[Optional[str]]:
+    """Create the ShortURL records in Redis in pipelined chunks.
+
+    Also creates the TimeSeries records for the stats. With url_dedup
+    the existing IDs of the known URLs with the same labels are returned.
+
+    Args:
+        urls (list): The original URLs.
+        labels (dict): The extra stats labels, e.g. owner and campaign.
+        expires_at (int): The links expiry unix time, they never expire if not set.
+
+    Returns:
+        list: The newly created short URL IDs in the input order,
+            None for the items failed to be written.
+    """
+    url_ids = []
+    for start in range(0, len(urls), settings.batch_chunk_size):
+        chunk = urls[start : start + settings.batch_chunk_size]
+        url_ids.extend(await _create(chunk, labels, expires_at))
+    return url_ids
+
+
+@error.handle_redis_errors
+async def update_short_url(
+    url: str, url_id: str, expires_at: Optional[int] = None
+) -> Optional[str]:
     """Update the ShortURL record in Redis.
 
+    The record is updated only if it exists and the cache invalidation is
+    published to the other workers in the same script. With url_dedup
+    the dedup index entries are moved from the old URL to the new one,
+    unless the link is set to expire.
+
     Args:
         url (str): The new updated URL.
         url_id (str): The short url ID.
+        expires_at (int): The new link expiry unix time, the current one
+            is kept if it's not set.
 
     Returns:
         str: The updated short URL ID.
@@ -109,16 +555,38 @@ async def update_short_url(url: str, url_id: str) -> Optional[str]:
     Raises:
         HTTPException: if the ShortURL with url_id is not found in Redis
     """
-    url_exists = await redis_client.get(url_id)
-    if not url_exists:
-        return None
-    await redis_client.set(url_id, url)
-    return url_id
+    url_cache.invalidate(url_id)
+    _mark_written(url_id)
+    dedup_fields = await _release_dedup(url_id) if settings.url_dedup else []
+    key, field = _url_record(url_id)
+    updated = await scripts.update_url(
+        redis_connector.get_client(url_id),
+        _record_keys(url_id, key, field),
+        [
+            field,
+            url_codec.encode(url, expires_at),
+            _invalidation_channel(),
+            url_id,
+            expires_at or '',
+            _changelog_maxlen(),
+        ],
+    )
+    if updated and dedup_fields and not expires_at:
+        dedup_key = _dedup_key(url)
+        pipeline = redis_connector.get_client(dedup_key).pipeline(transaction=False)
+        for dedup_field in dedup_fields:
+            pipeline.hsetnx(dedup_key, dedup_field, url_id)
+        await pipeline.execute()
+    return url_id if updated else None
 
 
 @error.handle_redis_errors
 async def delete_short_url(url_id: str) -> Optional[str]:
-    """Delete the ShortURL record from Redis.
+    """Delete the ShortURL record and its stats from Redis.
+
+    The cache invalidation is published to the other workers
+    in the same script. With url_dedup the URL is removed from
+    the dedup index first.
 
     Args:
         url_id (str): The short url ID.
@@ -129,10 +597,448 @@ async def delete_short_url(url_id: str) -> Optional[str]:
     Raises:
         HTTPException: if the ShortURL with url_id is not found in Redis
     """
-    success = await redis_client.delete(url_id)
-    if success:
-        return url_id
-    return None
+    url_cache.invalidate(url_id)
+    _mark_written(url_id)
+    if settings.url_dedup:
+        await _release_dedup(url_id)
+    key, field = _url_record(url_id)
+    deleted = await scripts.delete_url(
+        redis_connector.get_client(url_id),
+        _record_keys(url_id, key, field),
+        [field, _invalidation_channel(), url_id, _changelog_maxlen()],
+    )
+    return url_id if deleted else None
+
+
+async def dump_stats(
+    client: Redis, url_ids: List[str]
+) -> Dict[str, Tuple[Dict[str, str], List[Tuple[int, int]]]]:
+    """Read the whole stats series of the shard URLs for the export.
+
+    Args:
+        client (Redis): The shard Redis client.
+        url_ids (list): The short url IDs owned by the shard.
+
+    Returns:
+        dict: The extra labels and the samples by the url ID,
+            the URLs without the stats series are missing.
+    """
+    pipeline = client.pipeline(transaction=False)
+    for start in range(0, len(url_ids), settings.batch_chunk_size):
+        chunk = url_ids[start : start + settings.batch_chunk_size]
+        pipeline.ts().mrange(
+            '-', '+', [f'url_id=({",".join(chunk)})'], with_labels=True
+        )
+    stats = {}
+    for series in await pipeline.execute():
+        for item in series:
+            for series_labels, samples in item.values():
+                labels = dict(series_labels)
+                url_id = labels.pop('url_id')
+                stats[url_id] = labels, [(ts, int(value)) for ts, value in samples]
+    return stats
+
+
+async def restore_short_urls(links: List[dict]) -> int:
+    """Write the exported ShortURL records keeping their url IDs.
+
+    The records are written with the create_url script in one pipeline
+    per shard of the hash ring, so the links are resharded on the import.
+    An existing record is not overwritten and is counted as skipped, so
+    a batch can be restored again. The stats samples are written only for
+    the created records in a second pipeline per shard, they replace the
+    ones with the same timestamps. The expired links are skipped.
+    The restored links are not added to the url_dedup index.
+
+    Args:
+        links (list): The exported links, dicts of the url ID ('id'),
+            the raw URL ('url'), and the optional expiry unix time
+            ('expires_at'), extra stats labels ('labels') and stats samples
+            ('stats').
+
+    Returns:
+        int: The number of the created records.
+    """
+    now = time.time()
+    links = [
+        link for link in links if not link.get('expires_at') or link['expires_at'] > now
+    ]
+    shards = redis_connector.group_by_shard([link['id'] for link in links])
+    pipelines = []
+    for client, positions in shards:
+        pipeline = client.pipeline(transaction=False)
+        for i in positions:
+            link = links[i]
+            url_id = link['id']
+            key, field = _url_record(url_id)
+            expires_at = link.get('expires_at')
+            stats_labels = _stats_labels(url_id, link.get('labels'))
+            scripts.create_url.queue(
+                pipeline,
+                _record_keys(url_id, key, field),
+                [
+                    field,
+                    url_codec.encode(link['url'], expires_at),
+                    settings.stats_retention,
+                    expires_at or 0,
+                    _changelog_maxlen(),
+                    url_id,
+                ]
+                + [item for label in stats_labels.items() for item in label],
+            )
+        pipelines.append(pipeline)
+    created = 0
+    stats_pipelines = []
+    for (client, positions), results in zip(
+        shards, await asyncio.gather(*(pipeline.execute() for pipeline in pipelines))
+    ):
+        pipeline = client.pipeline(transaction=False)
+        for i, result in zip(positions, results):
+            created += result
+            if not result:
+                continue
+            url_id = links[i]['id']
+            stats_labels = _stats_labels(url_id, links[i].get('labels'))
+            for timestamp, count in links[i].get('stats', []):
+                pipeline.ts().add(
+                    _stats_key(url_id),
+                    timestamp,
+                    count,
+                    retention_msecs=settings.stats_retention,
+                    labels=stats_labels,
+                    duplicate_policy='last',
+                )
+        stats_pipelines.append(pipeline)
+    await asyncio.gather(*(pipeline.execute() for pipeline in stats_pipelines))
+    if len(links) > created:
+        logger.info('Skipped %d existing ShortURL records', len(links) - created)
+    return created
+
+
+async def _create_records(
+    urls: List[str],
+    labels: Optional[Dict[str, str]],
+    raise_on_error: bool = False,
+    expires_at: Optional[int] = None,
+) -> List[Optional[str]]:
+    """Write the new ShortURL and stats records in one pipeline per shard.
+
+    Every record is written with a create_url script, so an existing record
+    is never overwritten. New IDs are allocated for the collided ones,
+    at most id_max_retries times.
+
+    Args:
+        urls (list): The original URLs.
+        labels (dict): The extra stats labels.
+        raise_on_error (bool): Raise the Redis errors instead of skipping the item.
+        expires_at (int): The links expiry unix time or None.
+
+    Returns:
+        list: The newly created short URL IDs in the input order,
+            None for the items failed to be written.
+    """
+    url_ids = [None] * len(urls)
+    pending = list(range(len(urls)))
+    for _ in range(settings.id_max_retries + 1):
+        if not pending:
+            break
+        new_ids = await id_allocator.allocate(len(pending))
+        shards = redis_connector.group_by_shard(new_ids)
+        pipelines = []
+        for client, positions in shards:
+            pipeline = client.pipeline(transaction=False)
+            for j in positions:
+                url_id = new_ids[j]
+                key, field = _url_record(url_id)
+                stats_labels = _stats_labels(url_id, labels).items()
+                scripts.create_url.queue(
+                    pipeline,
+                    _record_keys(url_id, key, field),
+                    [
+                        field,
+                        url_codec.encode(urls[pending[j]], expires_at),
+                        settings.stats_retention,
+                        expires_at or 0,
+                        _changelog_maxlen(),
+                        url_id,
+                    ]
+                    + [item for label in stats_labels for item in label],
+                )
+            pipelines.append(pipeline)
+        shard_results = await asyncio.gather(
+            *(pipeline.execute(raise_on_error=False) for pipeline in pipelines)
+        )
+        retry, collided = [], 0
+        for (client, positions), results in zip(shards, shard_results):
+            scripts_missing = False
+            for j, created in zip(positions, results):
+                if isinstance(created, NoScriptError):
+                    retry.append(pending[j])
+                    scripts_missing = True
+                elif isinstance(created, Exception):
+                    if raise_on_error:
+                        raise created
+                elif created:
+                    url_ids[pending[j]] = new_ids[j]
+                    _mark_written(new_ids[j])
+                else:
+                    retry.append(pending[j])
+                    collided += 1
+            if scripts_missing:
+                await scripts.load_scripts(client)
+        id_allocator.record_collision(collided)
+        pending = sorted(retry)
+    return url_ids
+
+
+async def _create(
+    urls: List[str],
+    labels: Optional[Dict[str, str]],
+    expires_at: Optional[int],
+    raise_on_error: bool = False,
+) -> List[Optional[str]]:
+    """Create the ShortURL records, deduplicated with url_dedup.
+
+    The expiring links are never deduplicated, so a link never outlives
+    its expiry and the known URLs never get a shorter lifetime.
+
+    Args:
+        urls (list): The original URLs.
+        labels (dict): The extra stats labels.
+        expires_at (int): The links expiry unix time or None.
+        raise_on_error (bool): Raise the Redis errors instead of skipping the item.
+
+    Returns:
+        list: The short URL IDs in the input order,
+            None for the items failed to be written.
+    """
+    if settings.url_dedup and not expires_at:
+        return await _create_deduplicated(urls, labels, raise_on_error)
+    return await _create_records(urls, labels, raise_on_error, expires_at)
+
+
+async def _create_deduplicated(
+    urls: List[str], labels: Optional[Dict[str, str]], raise_on_error: bool = False
+) -> List[Optional[str]]:
+    """Create the ShortURL records of the URLs missing in the dedup index.
+
+    The known URLs are looked up in one pipeline per shard of the index,
+    the URLs repeated in the input are created once. The created records
+    are added to the index after they are written, so the index never
+    points to a record which is not written yet. A URL created concurrently
+    by another request keeps both IDs, the first one indexed is reused.
+
+    Args:
+        urls (list): The original URLs.
+        labels (dict): The extra stats labels.
+        raise_on_error (bool): Raise the Redis errors instead of skipping the item.
+
+    Returns:
+        list: The existing or newly created short URL IDs in the input order,
+            None for the items failed to be written.
+    """
+    field = labels_field(labels)
+    keys = [_dedup_key(url) for url in urls]
+    found = await _run_by_shard(keys, lambda pipeline, i: pipeline.hget(keys[i], field))
+    url_ids = [url_id.decode() if url_id else None for url_id in found]
+    new_urls = {}
+    for i, url_id in enumerate(url_ids):
+        if url_id is None:
+            new_urls.setdefault(keys[i], urls[i])
+    if not new_urls:
+        return url_ids
+    created = dict(
+        zip(
+            new_urls,
+            await _create_records(list(new_urls.values()), labels, raise_on_error),
+        )
+    )
+    created_keys = [key for key, url_id in created.items() if url_id]
+    await _run_by_shard(
+        created_keys,
+        lambda pipeline, i: pipeline.hsetnx(
+            created_keys[i], field, created[created_keys[i]]
+        ),
+    )
+    return [url_id or created[key] for url_id, key in zip(url_ids, keys)]
+
+
+async def _release_dedup(url_id: str) -> List[bytes]:
+    """Remove the current URL of the ShortURL from the dedup index.
+
+    Args:
+        url_id (str): The short url ID.
+
+    Returns:
+        list: The labels fields removed from the index, empty if the record
+            doesn't exist, is expired or is not indexed.
+    """
+    key, field = _url_record(url_id)
+    client = redis_connector.get_client(url_id)
+    value = await (client.hget(key, field) if field else client.get(key))
+    url = url_codec.decode(value) if value is not None else None
+    if url is None:
+        return []
+    dedup_key = _dedup_key(url)
+    return await scripts.release_dedup(
+        redis_connector.get_client(dedup_key), [dedup_key], [url_id]
+    )
+
+
+async def _migrate_records(records: List[Tuple[str, bytes]]):
+    """Rewrite the version 1 string records read in the raw URL format.
+
+    The records changed since they were read are skipped. The errors are
+    logged only, the records are migrated by the next reads then.
+
+    Args:
+        records (list): The url IDs and the values read.
+    """
+    try:
+        await _run_by_shard(
+            [url_id for url_id, _ in records],
+            lambda pipeline, i: scripts.migrate_url.queue(
+                pipeline,
+                [_url_key(records[i][0])],
+                [records[i][1], url_codec.encode(url_codec.decode(records[i][1]))],
+            ),
+        )
+    except RedisError:
+        logger.exception('ShortURL records migration error')
+
+
+async def _run_by_shard(keys: List[str], queue: Callable) -> list:
+    """Run a command per key in one pipeline per shard owning the keys.
+
+    Args:
+        keys (list): The Redis keys.
+        queue (callable): Queues the command of the key at the given
+            position to the pipeline.
+
+    Returns:
+        list: The command results in the keys order.
+    """
+    shards = redis_connector.group_by_shard(keys)
+    pipelines = []
+    for client, positions in shards:
+        pipeline = client.pipeline(transaction=False)
+        for i in positions:
+            queue(pipeline, i)
+        pipelines.append(pipeline)
+    results = [None] * len(keys)
+    for (_, positions), shard_results in zip(
+        shards, await asyncio.gather(*(pipeline.execute() for pipeline in pipelines))
+    ):
+        for i, result in zip(positions, shard_results):
+            results[i] = result
+    return results
+
+
+def _mark_written(url_id: str):
+    """Read the written URL from the primary for the read-your-writes window.
+
+    The expired windows are dropped, so only the URLs written in the last
+    redis_read_your_writes seconds by the worker are kept.
+
+    Args:
+        url_id (str): The short url ID.
+    """
+    if not settings.redis_read_your_writes:
+        return
+    now = time.monotonic()
+    _recent_writes.pop(url_id, None)
+    _recent_writes[url_id] = now + settings.redis_read_your_writes
+    while next(iter(_recent_writes.values())) <= now:
+        _recent_writes.popitem(last=False)
+
+
+def _read_from_primary(url_ids: List[str]) -> bool:
+    """Check if any of the URLs is in the read-your-writes window.
+
+    Args:
+        url_ids (list): The short url IDs.
+
+    Returns:
+        bool: True if the URLs should be read from the primary.
+    """
+    if not _recent_writes:
+        return False
+    now = time.monotonic()
+    return any(_recent_writes.get(url_id, 0) > now for url_id in url_ids)
+
+
+def _get_read_client(url_id: str) -> Redis:
+    """Get the Redis client to read the URL keys from.
+
+    Args:
+        url_id (str): The short url ID.
+
+    Returns:
+        Redis: A read replica client or the primary one
+            in the read-your-writes window.
+    """
+    if _read_from_primary([url_id]):
+        return redis_connector.get_client(url_id)
+    return redis_connector.get_read_client(url_id)
+
+
+def _invalidation_channel() -> str:
+    """Get the channel to publish the cache invalidations to.
+
+    Returns:
+        str: The channel name or an empty string if the cache is disabled.
+    """
+    return settings.url_cache_channel if url_cache.enabled else ''
+
+
+def _changelog_maxlen() -> int:
+    """Get the approx. max length of the change log stream.
+
+    Returns:
+        int: The max length or 0 if the change log is disabled.
+    """
+    return settings.url_changelog_maxlen if settings.url_changelog else 0
+
+
+def _url_key(url_id: str) -> str:
+    """Make a key for the ShortURL redis record.
+
+    With redis_hash_tags the url ID is wrapped in a hash tag, so the record
+    and its stats are kept in the same Redis Cluster slot. The change log
+    stream is a single key, so the writes aren't single-slot with
+    url_changelog enabled.
+
+    Args:
+        url_id (str): The short url ID.
+
+    Returns:
+        str: The Redis key for the ShortURL record.
+    """
+    return f'{{{url_id}}}' if settings.redis_hash_tags else url_id
+
+
+def _url_record(url_id: str) -> Tuple[str, str]:
+    """Get the Redis key and the hash field of the ShortURL record.
+
+    Args:
+        url_id (str): The short url ID.
+
+    Returns:
+        tuple: The key and the field, the field is empty for the string record.
+    """
+    return url_record(url_id, _url_key(url_id))
+
+
+def _dedup_key(url: str) -> str:
+    """Make a key for the dedup index redis record of the URL.
+
+    Args:
+        url (str): The raw URL.
+
+    Returns:
+        str: The Redis hash key mapping the labels to the short url IDs.
+    """
+    return f'{settings.url_dedup_prefix}{url_fingerprint(url)}'
 
 
 def _stats_key(url_id: str) -> str:
@@ -144,7 +1050,53 @@ def _stats_key(url_id: str) -> str:
     Returns:
         str: The Redis TimeSeries key for the stats record.
     """
-    return f'{url_id}:stats'
+    return f'{_url_key(url_id)}:stats'
+
+
+def _record_keys(url_id: str, key: str, field: str) -> List[str]:
+    """Make the KEYS of the record write scripts.
+
+    The expiry index is passed in the compact layout only and the change log
+    only if it's enabled, so with redis_hash_tags a string layout write
+    touches the slot of the url ID only, unless url_changelog is enabled.
+
+    Args:
+        url_id (str): The short url ID.
+        key (str): The record key.
+        field (str): The record field, empty for the string record.
+
+    Returns:
+        list: The record, stats, expiry index and change log keys.
+    """
+    keys = [key, _stats_key(url_id)]
+    if field:
+        keys.append(settings.url_expiry_key)
+    if settings.url_changelog:
+        keys.append(settings.url_changelog_key)
+    return keys
+
+
+def _stats_labels(url_id: str, labels: Optional[Dict[str, str]]) -> Dict[str, str]:
+    """Make the labels for the stats redis record.
+
+    Args:
+        url_id (str): The short url ID.
+        labels (dict): The extra labels.
+
+    Returns:
+        dict: The Redis TimeSeries labels.
+    """
+    return dict(labels or {}, url_id=url_id)
+
+
+def _ts_bucket() -> int:
+    """Get the current stats bucket timestamp in ms.
+
+    Returns:
+        int: The timestamp in ms truncated to the stats bucket size.
+    """
+    timestamp = int(time.time() * 1000)
+    return timestamp - timestamp % settings.stats_bucket
 
 
 def _ts_24h_ago() -> int:
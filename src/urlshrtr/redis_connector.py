@@ -1,12 +1,265 @@
 """Redis connector for URL Shortener"""
 
+import asyncio
+import itertools
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
 from redis.asyncio.client import Redis
+from redis.asyncio.connection import BlockingConnectionPool
+from redis.exceptions import ConnectionError
 
 from urlshrtr.config import settings
+from urlshrtr.sharding import HashRing
+
+# The first shard, it also keeps the keys not owned by a short URL
+redis_client: Optional[Redis] = None
+redis_clients: List[Redis] = []
+replica_clients: List[List[Redis]] = []  # the read replicas of every shard
+hash_ring: Optional[HashRing] = None
+_replica_turns = defaultdict(itertools.count)
+
+REPLICA_POLICIES = ('round_robin', 'least_connections')
+
+
+class MonitoredConnectionPool(BlockingConnectionPool):
+    """A bounded connection pool counting the connections usage.
+
+    A request waits at most pool_timeout seconds for a free connection
+    and fails with ConnectionError then, so the requests don't pile up
+    while Redis stalls.
+    """
+
+    def __init__(self, **kwargs):
+        """Init the pool counters.
+
+        Args:
+            kwargs: BlockingConnectionPool arguments.
+        """
+        super().__init__(**kwargs)
+        self.in_use = 0
+        self.waiting = 0
+        self.timeouts = 0
+        self._handed_out = set()
+
+    async def get_connection(self, command_name, *keys, **options):
+        """Get a connection, waiting for a free one if the pool is exhausted.
+
+        A connection failing to connect is released by the pool itself and
+        isn't counted, only the waits for a free connection count as timeouts.
+        """
+        self.waiting += 1
+        try:
+            connection = await super().get_connection(command_name, *keys, **options)
+        except ConnectionError as e:
+            if isinstance(e.__context__, (asyncio.QueueEmpty, asyncio.TimeoutError)):
+                self.timeouts += 1
+            raise
+        finally:
+            self.waiting -= 1
+        self._handed_out.add(connection)
+        self.in_use += 1
+        return connection
+
+    async def release(self, connection):
+        """Release the connection back to the pool."""
+        if connection in self._handed_out:
+            self._handed_out.discard(connection)
+            self.in_use -= 1
+        await super().release(connection)
+
+    def stats(self) -> Dict[str, int]:
+        """Get the pool counters.
+
+        Returns:
+            dict: The pool size, the created, in use and idle connections,
+                the waiting requests and the wait timeouts.
+        """
+        created = len(self._connections)
+        return dict(
+            max_connections=self.max_connections,
+            created=created,
+            in_use=self.in_use,
+            idle=created - self.in_use,
+            waiting=self.waiting,
+            timeouts=self.timeouts,
+        )
+
+
+def make_client(url: Optional[str] = None) -> Redis:
+    """Make the Redis client with the configured connection pool.
+
+    Args:
+        url (str): The Redis URL, the redis_host settings are used by default.
+
+    Returns:
+        Redis: The Redis client.
+    """
+    if url is None:
+        address = dict(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            db=settings.redis_db,
+            password=settings.redis_password,
+        )
+        make_pool = MonitoredConnectionPool
+    else:
+        address = dict(url=url)
+        make_pool = MonitoredConnectionPool.from_url
+    pool = make_pool(
+        **address,
+        max_connections=settings.redis_max_connections,
+        timeout=settings.redis_pool_timeout,
+        socket_timeout=settings.redis_socket_timeout,
+        socket_connect_timeout=settings.redis_connect_timeout,
+        socket_keepalive=settings.redis_socket_keepalive,
+        health_check_interval=settings.redis_health_check_interval,
+        retry_on_timeout=False,
+    )
+    return Redis(connection_pool=pool)
+
+
+def connect() -> Redis:
+    """Make the worker Redis clients, it's called on the application startup.
+
+    A client is made for every redis_shards URL and the short URLs are
+    spread over them with the consistent hash ring. A client is made for
+    every redis_replicas URL of the shards too.
+
+    Returns:
+        Redis: The first shard Redis client.
+
+    Raises:
+        ValueError: if the replica policy is unknown.
+    """
+    global redis_client, redis_clients, replica_clients, hash_ring
+    if settings.redis_replica_policy not in REPLICA_POLICIES:
+        raise ValueError(
+            f'Unknown Redis replica policy: {settings.redis_replica_policy}'
+        )
+    if redis_client is None:
+        if settings.redis_shards:
+            redis_clients = [make_client(url) for url in settings.redis_shards]
+            hash_ring = HashRing(settings.redis_shards, settings.redis_shard_replicas)
+        else:
+            redis_clients = [make_client()]
+        replica_clients = [
+            [make_client(url) for url in urls] for urls in settings.redis_replicas
+        ]
+        redis_client = redis_clients[0]
+    return redis_client
+
+
+async def disconnect():
+    """Close the worker Redis clients and their connections."""
+    global redis_client, redis_clients, replica_clients, hash_ring
+    for client in redis_clients + [c for cs in replica_clients for c in cs]:
+        await client.close(close_connection_pool=True)
+    redis_client, redis_clients, replica_clients, hash_ring = None, [], [], None
+
+
+def get_clients(replicas: bool = False) -> List[Redis]:
+    """Get the Redis clients of all the shards.
+
+    Args:
+        replicas (bool): Add the read replicas clients.
+
+    Returns:
+        list: The Redis clients.
+    """
+    clients = redis_clients or [redis_client]
+    if replicas:
+        clients = clients + [client for shard in replica_clients for client in shard]
+    return clients
+
+
+def get_read_clients() -> List[Redis]:
+    """Get a read replica client of every shard.
+
+    Returns:
+        list: The Redis clients.
+    """
+    return [_get_replica(node) for node in range(len(get_clients()))]
+
+
+def get_client(url_id: str) -> Redis:
+    """Get the Redis client of the shard owning the short URL keys.
+
+    Args:
+        url_id (str): The short url ID.
+
+    Returns:
+        Redis: The Redis client.
+    """
+    return _get_primary(_get_node(url_id))
+
+
+def get_read_client(url_id: str) -> Redis:
+    """Get a read replica client of the shard owning the short URL keys.
+
+    Args:
+        url_id (str): The short url ID.
+
+    Returns:
+        Redis: The replica Redis client or the primary one
+            if the shard has no replicas.
+    """
+    return _get_replica(_get_node(url_id))
+
+
+def group_by_shard(
+    url_ids: List[str], read: bool = False
+) -> List[Tuple[Redis, List[int]]]:
+    """Group the short URLs by the shard owning their keys.
+
+    Args:
+        url_ids (list): The short url IDs.
+        read (bool): Get a read replica client of every shard.
+
+    Returns:
+        list: The Redis client and the positions of its url IDs in the input
+            for every shard owning any of them.
+    """
+    positions = defaultdict(list)
+    for i, url_id in enumerate(url_ids):
+        positions[_get_node(url_id)].append(i)
+    get_shard_client = _get_replica if read else _get_primary
+    return [
+        (get_shard_client(node), node_positions)
+        for node, node_positions in positions.items()
+    ]
+
+
+def _get_node(url_id: str) -> int:
+    """Get the index of the shard owning the short URL keys."""
+    return 0 if hash_ring is None else hash_ring.get_node(url_id)
+
+
+def _get_primary(node: int) -> Redis:
+    """Get the primary client of the shard."""
+    return redis_client if hash_ring is None else redis_clients[node]
+
+
+def _get_replica(node: int) -> Redis:
+    """Get a replica client of the shard by the replica policy."""
+    replicas = replica_clients[node] if node < len(replica_clients) else []
+    if not replicas:
+        return _get_primary(node)
+    if settings.redis_replica_policy == 'least_connections':
+        return min(replicas, key=lambda client: client.connection_pool.in_use)
+    return replicas[next(_replica_turns[node]) % len(replicas)]
+
+
+def pool_stats() -> Dict[str, int]:
+    """Get the worker connection pools counters summed over the shards.
 
-redis_client = Redis(
-    host=settings.redis_host,
-    port=settings.redis_port,
-    db=settings.redis_db,
-    password=settings.redis_password,
-)
+    Returns:
+        dict: The pool counters, all zeros if the clients are not connected.
+    """
+    stats = dict(max_connections=0, created=0, in_use=0, idle=0, waiting=0, timeouts=0)
+    if redis_client is None:
+        return stats
+    for client in get_clients(replicas=True):
+        for name, value in client.connection_pool.stats().items():
+            stats[name] += value
+    return stats
@@ -0,0 +1,73 @@
+"""Fast JSON responses of the API.
+
+With fast_json_responses the handlers return the responses rendered
+straight from the response dataclasses, so FastAPI skips the response
+model validation and the jsonable_encoder conversion. The responses are
+rendered by orjson if it's installed, by the standard json otherwise.
+The JSON is the same as the default responses render.
+"""
+
+import dataclasses
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+
+from urlshrtr.config import settings
+
+try:
+    import orjson
+except ImportError:  # optional, pip install orjson
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    """Convert the dataclasses and the datetimes for the standard json."""
+    if dataclasses.is_dataclass(obj):
+        return {
+            field.name: getattr(obj, field.name) for field in dataclasses.fields(obj)
+        }
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f'{type(obj).__name__} is not JSON serializable')
+
+
+class FastJSONResponse(JSONResponse):
+    """A JSON response rendering the dataclasses without the conversion."""
+
+    def render(self, content: Any) -> bytes:
+        """Render the content to JSON.
+
+        Args:
+            content: The response dataclass, or the JSON compatible data.
+
+        Returns:
+            bytes: The JSON document.
+        """
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(
+            content, default=_default, ensure_ascii=False, separators=(',', ':')
+        ).encode()
+
+
+def json_response(content: Any, headers: Optional[Dict[str, str]] = None):
+    """Make the handler response of the content.
+
+    Args:
+        content: The response dataclass.
+        headers (dict): The response headers.
+
+    Returns:
+        The FastJSONResponse with fast_json_responses. Otherwise the content
+        serialized by FastAPI, or a JSONResponse if there are headers.
+    """
+    if settings.fast_json_responses:
+        return FastJSONResponse(content, headers=headers)
+    if headers is not None:
+        return JSONResponse(
+            jsonable_encoder(dataclasses.asdict(content)), headers=headers
+        )
+    return content
@@ -1,25 +1,149 @@
-"""DTO and request/response entity classes."""
+"""DTO and request/response entity classes.
 
-from pydantic import AnyHttpUrl
+The requests are pydantic dataclasses validating the input. The responses
+are made by the service, so they're plain dataclasses without the validation
+on construction, FastAPI validates them against the response models unless
+they're rendered by the fast JSON responses.
+"""
+
+import dataclasses
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from pydantic import AnyHttpUrl, conint, conlist, constr, root_validator
 from pydantic.dataclasses import dataclass
 
+from urlshrtr.config import settings
+
+# A stats label value or a short url ID, restricted to the chars safe for
+# TS.MRANGE filters. The internal Redis keys have ':', so they're never
+# taken for the url records.
+ID_PATTERN = r'^[\w.-]{1,64}$'
+LabelValue = constr(regex=ID_PATTERN)
+UrlId = LabelValue
+MAX_EXPIRY = 2**32 - 1  # the max link expiry unix time
+
+
+def validate_expiry(values: dict) -> dict:
+    """Check the link expiry fields of a request.
+
+    At most one of ttl and expires_at can be set. The naive expires_at
+    is treated as UTC, it should be in the future. The expiry is at most
+    MAX_EXPIRY, the compact records keep it in 4 bytes.
+    """
+    ttl = values.get('ttl')
+    expires_at = values.get('expires_at')
+    if expires_at is None:
+        if ttl and time.time() + ttl > MAX_EXPIRY:
+            raise ValueError(f'ttl should expire before {MAX_EXPIRY} unix time')
+        return values
+    if ttl:
+        raise ValueError('ttl and expires_at are mutually exclusive')
+    if expires_at.tzinfo is None:
+        values['expires_at'] = expires_at = expires_at.replace(tzinfo=timezone.utc)
+    if expires_at <= datetime.now(timezone.utc):
+        raise ValueError('expires_at should be in the future')
+    if expires_at.timestamp() > MAX_EXPIRY:
+        raise ValueError(f'expires_at should be before {MAX_EXPIRY} unix time')
+    return values
+
 
 @dataclass
 class ShortUrlRequest:
-    """A request object for creating a new ShortUrl."""
+    """A request object for creating a new ShortUrl.
+
+    The owner and campaign are set as the stats labels on create.
+    The link expires in ttl seconds or at expires_at, url_default_ttl
+    is used on create if neither is set. The expiry is kept on update
+    if neither is set.
+    """
 
     url: AnyHttpUrl
+    owner: Optional[LabelValue] = None
+    campaign: Optional[LabelValue] = None
+    ttl: Optional[conint(gt=0)] = None
+    expires_at: Optional[datetime] = None
 
+    @root_validator(skip_on_failure=True)
+    def check_expiry(cls, values):
+        """Check the link expiry fields."""
+        return validate_expiry(values)
 
-@dataclass
+
+@dataclasses.dataclass
 class ShortUrlResponse:
-    """A response object handling ShortUrl data."""
+    """A response object handling ShortUrl data.
+
+    The expires_at is set if the link expiry is set by the request.
+    """
 
     url: str
     url_id: str
+    expires_at: Optional[datetime] = None
+
+
+@dataclass
+class ShortUrlBatchRequest:
+    """A request object for creating ShortUrls in bulk.
+
+    The urls are validated one by one, so the invalid ones are reported
+    per item instead of failing the whole request. The labels and
+    the expiry are the same for all the urls.
+    """
+
+    urls: conlist(str, min_items=1, max_items=settings.batch_max_size)
+    owner: Optional[LabelValue] = None
+    campaign: Optional[LabelValue] = None
+    ttl: Optional[conint(gt=0)] = None
+    expires_at: Optional[datetime] = None
+
+    @root_validator(skip_on_failure=True)
+    def check_expiry(cls, values):
+        """Check the links expiry fields."""
+        return validate_expiry(values)
+
+
+@dataclasses.dataclass
+class ShortUrlBatchItem:
+    """A bulk create result item, either url_id or error is set."""
+
+    url: str
+    url_id: Optional[str] = None
+    error: Optional[str] = None
+
+
+@dataclasses.dataclass
+class ShortUrlBatchResponse:
+    """A response object containing bulk create results in the input order."""
+
+    results: List[ShortUrlBatchItem]
 
 
 @dataclass
+class ShortUrlResolveRequest:
+    """A request object for resolving ShortUrls in bulk."""
+
+    url_ids: conlist(UrlId, min_items=1, max_items=settings.batch_max_size)
+    count_views: bool = False  # count the lookups as the URL views
+
+
+@dataclasses.dataclass
+class ShortUrlResolveItem:
+    """A bulk resolve result item, url is None if the ShortUrl is not found."""
+
+    url_id: str
+    url: Optional[str] = None
+
+
+@dataclasses.dataclass
+class ShortUrlResolveResponse:
+    """A response object containing bulk resolve results in the input order."""
+
+    results: List[ShortUrlResolveItem]
+
+
+@dataclasses.dataclass
 class ShortUrlStatsResponse:
     """A response object handling ShortUrl stats data."""
 
@@ -28,14 +152,123 @@ class ShortUrlStatsResponse:
 
 
 @dataclass
+class ShortUrlStatsRequest:
+    """A request object for getting ShortUrl stats in bulk.
+
+    Either url_ids or label filters (owner, campaign) should be set.
+    """
+
+    url_ids: Optional[conlist(LabelValue, max_items=settings.batch_max_size)] = None
+    owner: Optional[LabelValue] = None
+    campaign: Optional[LabelValue] = None
+
+    @root_validator(skip_on_failure=True)
+    def check_filters(cls, values):
+        """Check that url_ids or some label filter is set."""
+        if not any(values.values()):
+            raise ValueError('url_ids, owner or campaign should be set')
+        return values
+
+
+@dataclasses.dataclass
+class ShortUrlStatsBatchResponse:
+    """A response object containing ShortUrl stats for many urls."""
+
+    results: List[ShortUrlStatsResponse]
+
+
+@dataclass
+class ShortUrlViewItem:
+    """A ShortUrl view count, e.g. of the redirects served by a CDN.
+
+    The naive timestamp is treated as UTC, the current time is used if
+    it's not set.
+    """
+
+    url_id: UrlId
+    count: conint(gt=0) = 1
+    timestamp: Optional[datetime] = None
+
+
+@dataclass
+class ShortUrlViewsRequest:
+    """A request object for ingesting the ShortUrl views from the edge logs."""
+
+    views: conlist(ShortUrlViewItem, min_items=1, max_items=settings.batch_max_size)
+
+
+@dataclasses.dataclass
+class ShortUrlViewsResponse:
+    """A response object containing the number of the recorded views.
+
+    The views older than the stats retention and the views of the url IDs
+    not found are skipped.
+    """
+
+    recorded: int
+
+
+@dataclasses.dataclass
 class DeleteShortUrlResponse:
     """A response object containing a deleted ShortUrl url_id."""
 
     url_id: str
 
 
-@dataclass
+@dataclasses.dataclass
 class HealthCheckResponse:
     """A response object for the health check."""
 
     status: str = 'ok'
+
+
+@dataclasses.dataclass
+class CacheStatsResponse:
+    """A response object containing the in-process URL cache counters."""
+
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+
+
+@dataclasses.dataclass
+class IngestStatsResponse:
+    """A response object containing the view events ingestion counters."""
+
+    recorded: int
+    dropped: int
+    flushed: int
+    failed: int
+    queue_depth: int
+
+
+@dataclasses.dataclass
+class SweeperStatsResponse:
+    """A response object containing the background sweeper counters."""
+
+    sweeps: int
+    swept: int
+    failed: int
+
+
+@dataclasses.dataclass
+class IdAllocatorStatsResponse:
+    """A response object containing the short url ID allocator counters."""
+
+    allocations: int
+    collisions: int
+    collision_rate: float
+    allocations_per_sec: float
+
+
+@dataclasses.dataclass
+class RedisPoolStatsResponse:
+    """A response object containing the Redis connection pool counters."""
+
+    max_connections: int
+    created: int
+    in_use: int
+    idle: int
+    waiting: int
+    timeouts: int
@@ -0,0 +1,314 @@
+"""Server-side Lua scripts making the model operations atomic.
+
+Every script is one round-trip. The scripts are loaded on the application
+startup and called with EVALSHA, a missing script is loaded on NOSCRIPT error.
+"""
+
+from hashlib import sha1
+from typing import Any, List
+
+from redis.asyncio.client import Pipeline, Redis
+from redis.exceptions import NoScriptError
+
+
+class LuaScript:
+    """A Lua script called with EVALSHA."""
+
+    def __init__(self, source: str):
+        """Init the script.
+
+        Args:
+            source (str): The Lua source code.
+        """
+        self.source = source
+        self.sha = sha1(source.encode()).hexdigest()
+
+    async def __call__(self, client: Redis, keys: List[str], args: List[Any]) -> Any:
+        """Call the script, loading it if it's missing in the scripts cache.
+
+        Args:
+            client (Redis): The Redis client.
+            keys (list): The script KEYS.
+            args (list): The script ARGV.
+
+        Returns:
+            The script result.
+        """
+        try:
+            return await client.evalsha(self.sha, len(keys), *keys, *args)
+        except NoScriptError:
+            await client.script_load(self.source)
+            return await client.evalsha(self.sha, len(keys), *keys, *args)
+
+    def queue(self, pipeline: Pipeline, keys: List[str], args: List[Any]):
+        """Queue the script call in the pipeline.
+
+        The pipeline result is NoScriptError if the script is not loaded.
+
+        Args:
+            pipeline (Pipeline): The Redis pipeline.
+            keys (list): The script KEYS.
+            args (list): The script ARGV.
+        """
+        pipeline.evalsha(self.sha, len(keys), *keys, *args)
+
+
+# The url record is a string key, or a hash field in the compact layout.
+# The field is the first ARGV of every script, '' for the string key.
+# The expiry of the string key is a native TTL: EXAT unix time, '0' for none
+# or '' to keep the current one. The compact record keeps it in the value.
+# The writes are appended to the change log stream capped at the max length,
+# '0' disables the change log. The expiry index key is passed in the compact
+# layout only and the change log key, the last one, only if it's enabled,
+# so with the hash tags a string record write stays in the url ID slot.
+# An expired compact record is read as missing until it's purged, it's still
+# taken by the NX set, so its url ID isn't reused before the purge.
+RECORD_FUNCTIONS = """
+local function record_get(key, field)
+    if field == '' then
+        return redis.call('GET', key)
+    end
+    local value = redis.call('HGET', key, field)
+    if value and string.byte(value, 1) == 2
+            and struct.unpack('>I4', value, 2) <= tonumber(redis.call('TIME')[1]) then
+        return false
+    end
+    return value
+end
+
+local function record_exists(key, field)
+    if field == '' then
+        return redis.call('EXISTS', key) == 1
+    end
+    return record_get(key, field) ~= false
+end
+
+local function record_set(key, field, value, condition, expire_at)
+    if field == '' then
+        local expiry = {}
+        if expire_at == '' then
+            expiry = {'KEEPTTL'}
+        elseif expire_at ~= '0' then
+            expiry = {'EXAT', expire_at}
+        end
+        return redis.call('SET', key, value, condition, unpack(expiry)) ~= false
+    end
+    if condition == 'NX' then
+        return redis.call('HSETNX', key, field, value) == 1
+    end
+    if not record_exists(key, field) then
+        return false
+    end
+    redis.call('HSET', key, field, value)
+    return true
+end
+
+local function log_change(key, maxlen, operation, url_id, record_key, field)
+    if maxlen ~= '0' then
+        redis.call('XADD', key, 'MAXLEN', '~', maxlen, '*',
+            'op', operation, 'id', url_id, 'key', record_key, 'field', field)
+    end
+end
+
+local function record_del(key, field)
+    if field == '' then
+        return redis.call('DEL', key) == 1
+    end
+    return redis.call('HDEL', key, field) == 1
+end
+"""
+
+# KEYS: url, stats, [expiry index], [change log];
+# ARGV: field, url, stats retention, expiry unix time or '0',
+#     change log max length, url ID, stats labels (name, value)...
+# Returns 1 if created, 0 if the url record already exists.
+# The stats left over by a record deleted before the stats cleanup are dropped.
+# The stats with the url_id label only are created by the first view, the ones
+# with the extra labels or the expiry are created right away to keep them.
+# The expiring compact records are added to the expiry index for the purge.
+create_url = LuaScript(RECORD_FUNCTIONS + """
+if not record_set(KEYS[1], ARGV[1], ARGV[2], 'NX', ARGV[4]) then
+    return 0
+end
+redis.call('DEL', KEYS[2])
+if #ARGV > 8 or ARGV[4] ~= '0' then
+    redis.call('TS.CREATE', KEYS[2], 'RETENTION', ARGV[3], 'DUPLICATE_POLICY', 'SUM',
+        'LABELS', unpack(ARGV, 7))
+end
+if ARGV[4] ~= '0' then
+    redis.call('EXPIREAT', KEYS[2], ARGV[4])
+    if ARGV[1] ~= '' then
+        redis.call('ZADD', KEYS[3], ARGV[4], ARGV[1])
+    end
+end
+log_change(KEYS[#KEYS], ARGV[5], 'set', ARGV[6], KEYS[1], ARGV[1])
+return 1
+""")
+
+# KEYS: url, stats; ARGV: field, stats bucket timestamp, stats retention, url ID.
+# Returns the url and counts the view, or nil if the url record doesn't exist
+# or the compact record is expired.
+get_url = LuaScript(RECORD_FUNCTIONS + """
+local url = record_get(KEYS[1], ARGV[1])
+if url then
+    redis.call('TS.ADD', KEYS[2], ARGV[2], 1, 'RETENTION', ARGV[3],
+        'ON_DUPLICATE', 'SUM', 'LABELS', 'url_id', ARGV[4])
+end
+return url
+""")
+
+# KEYS: url, stats; ARGV: field, from timestamp, aggregation bucket.
+# Returns the views sum, or nil if the url record doesn't exist.
+get_view_count = LuaScript(RECORD_FUNCTIONS + """
+if not record_exists(KEYS[1], ARGV[1]) then
+    return nil
+end
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return 0
+end
+local total = 0
+local buckets = redis.call('TS.RANGE', KEYS[2], ARGV[2], '+',
+    'AGGREGATION', 'sum', ARGV[3])
+for _, bucket in ipairs(buckets) do
+    total = total + tonumber(bucket[2])
+end
+return total
+""")
+
+# KEYS: url, stats, [expiry index], [change log]; ARGV: field, url,
+#     invalidation channel or '', url ID, expiry unix time or '', change log max length.
+# Returns 1 if updated, 0 if the url record doesn't exist.
+# The current expiry is kept if the new one is not set.
+update_url = LuaScript(RECORD_FUNCTIONS + """
+local value = ARGV[2]
+if ARGV[1] ~= '' and ARGV[5] == '' then
+    local current = redis.call('HGET', KEYS[1], ARGV[1])
+    if current and string.byte(current, 1) == 2 then
+        value = string.sub(current, 1, 5) .. value
+    end
+end
+if not record_set(KEYS[1], ARGV[1], value, 'XX', ARGV[5]) then
+    return 0
+end
+if ARGV[5] ~= '' then
+    redis.call('EXPIREAT', KEYS[2], ARGV[5])
+    if ARGV[1] ~= '' then
+        redis.call('ZADD', KEYS[3], ARGV[5], ARGV[1])
+    end
+end
+log_change(KEYS[#KEYS], ARGV[6], 'set', ARGV[4], KEYS[1], ARGV[1])
+if ARGV[3] ~= '' then
+    redis.call('PUBLISH', ARGV[3], ARGV[4])
+end
+return 1
+""")
+
+# KEYS: url, stats, [expiry index], [change log];
+# ARGV: field, invalidation channel or '', url ID, change log max length.
+# Returns 1 if deleted, 0 if the url record doesn't exist.
+delete_url = LuaScript(RECORD_FUNCTIONS + """
+if not record_exists(KEYS[1], ARGV[1]) then
+    return 0
+end
+if ARGV[1] ~= '' then
+    redis.call('ZREM', KEYS[3], ARGV[1])
+end
+record_del(KEYS[1], ARGV[1])
+redis.call('DEL', KEYS[2])
+log_change(KEYS[#KEYS], ARGV[4], 'del', ARGV[3], KEYS[1], ARGV[1])
+if ARGV[2] ~= '' then
+    redis.call('PUBLISH', ARGV[2], ARGV[3])
+end
+return 1
+""")
+
+# KEYS: url, stats, [expiry index], [change log]; ARGV: field, current unix time,
+#     invalidation channel or '', url ID, change log max length.
+# Returns 1 if the expired compact record is deleted, 0 if it's not expired.
+purge_url = LuaScript(RECORD_FUNCTIONS + """
+local expire_at = redis.call('ZSCORE', KEYS[3], ARGV[1])
+if not expire_at or tonumber(expire_at) > tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZREM', KEYS[3], ARGV[1])
+record_del(KEYS[1], ARGV[1])
+redis.call('DEL', KEYS[2])
+log_change(KEYS[#KEYS], ARGV[5], 'del', ARGV[4], KEYS[1], ARGV[1])
+if ARGV[3] ~= '' then
+    redis.call('PUBLISH', ARGV[3], ARGV[4])
+end
+return 1
+""")
+
+# KEYS: url; ARGV: value read, value in the current format.
+# Returns 1 if the string record is rewritten keeping its TTL,
+# 0 if it was changed or deleted since read.
+migrate_url = LuaScript("""
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'KEEPTTL')
+return 1
+""")
+
+# KEYS: URL dedup index; ARGV: url ID.
+# Returns the labels fields of the url ID removed from the index.
+release_dedup = LuaScript("""
+local fields = {}
+local index = redis.call('HGETALL', KEYS[1])
+for i = 1, #index, 2 do
+    if index[i + 1] == ARGV[1] then
+        redis.call('HDEL', KEYS[1], index[i])
+        table.insert(fields, index[i])
+    end
+end
+return fields
+""")
+
+# KEYS: url, stats; ARGV: field, min last sample timestamp.
+# Returns 1 if the stats are deleted: the url record doesn't exist,
+# or the stats have the url_id label only and no samples since the timestamp.
+# Returns 0 if the stats don't exist, TS.INFO fails on a missing key.
+sweep_stats = LuaScript(RECORD_FUNCTIONS + """
+if not record_exists(KEYS[1], ARGV[1]) then
+    return redis.call('DEL', KEYS[2])
+end
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return 0
+end
+local info = redis.call('TS.INFO', KEYS[2])
+local last_timestamp, labels = 0, {}
+for i = 1, #info, 2 do
+    if info[i] == 'lastTimestamp' then
+        last_timestamp = info[i + 1]
+    elseif info[i] == 'labels' then
+        labels = info[i + 1]
+    end
+end
+if #labels > 1 or last_timestamp >= tonumber(ARGV[2]) then
+    return 0
+end
+return redis.call('DEL', KEYS[2])
+""")
+
+SCRIPTS = (
+    create_url,
+    get_url,
+    get_view_count,
+    update_url,
+    delete_url,
+    purge_url,
+    migrate_url,
+    release_dedup,
+    sweep_stats,
+)
+
+
+async def load_scripts(client: Redis):
+    """Load all the scripts to the Redis scripts cache.
+
+    Args:
+        client (Redis): The Redis client.
+    """
+    for script in SCRIPTS:
+        await client.script_load(script.source)
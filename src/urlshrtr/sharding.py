@@ -0,0 +1,60 @@
+"""Client-side consistent hashing of the keyspace over the Redis nodes."""
+
+import bisect
+from hashlib import md5
+from typing import List
+
+
+def _hash(value: str) -> int:
+    """Hash the value to a point on the ring.
+
+    Args:
+        value (str): The value to hash.
+
+    Returns:
+        int: The 64-bit point.
+    """
+    return int.from_bytes(md5(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """A consistent hash ring of the Redis nodes.
+
+    Every node is placed on the ring replicas times, a key belongs to the
+    first node point clockwise from the key hash. Adding a node moves only
+    about 1 / nodes of the keys. The nodes are placed by their names,
+    so the order of the nodes list doesn't matter.
+    """
+
+    def __init__(self, nodes: List[str], replicas: int = 160):
+        """Init the ring.
+
+        Args:
+            nodes (list): The node names, e.g. the Redis URLs.
+            replicas (int): The number of points per node.
+
+        Raises:
+            ValueError: if the nodes list is empty.
+        """
+        if not nodes:
+            raise ValueError('No nodes for the hash ring')
+        self.nodes = nodes
+        ring = sorted(
+            (_hash(f'{node}#{replica}'), index)
+            for index, node in enumerate(nodes)
+            for replica in range(replicas)
+        )
+        self._points = [point for point, _ in ring]
+        self._indexes = [index for _, index in ring]
+
+    def get_node(self, key: str) -> int:
+        """Get the node of the key.
+
+        Args:
+            key (str): The key, e.g. the short url ID.
+
+        Returns:
+            int: The node index in the nodes list.
+        """
+        position = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._indexes[position]
@@ -0,0 +1,101 @@
+"""Pluggable storage backends of the model layer."""
+
+from typing import Dict, List, Optional, Protocol
+
+from urlshrtr import model
+from urlshrtr.config import settings
+from urlshrtr.embedded import EmbeddedStorage
+from urlshrtr.ingest import ViewCounts
+from urlshrtr.sweeper import Sweeper
+
+
+class StorageBackend(Protocol):
+    """The ShortURL records and view counts storage.
+
+    The Redis backend is the model module, the embedded one is
+    an EmbeddedStorage instance. The errors are raised as HTTPException.
+    The expiry times are unix times in seconds.
+    """
+
+    expiry_purger: Sweeper
+
+    async def start(self):
+        """Connect the storage and start its background tasks."""
+
+    async def stop(self):
+        """Stop the background tasks and close the storage."""
+
+    async def get_short_url(self, url_id: str) -> Optional[str]:
+        """Get the URL and count the view, None if it's not found or expired."""
+
+    async def get_short_urls(
+        self, url_ids: List[str], count_views: bool = False
+    ) -> List[Optional[str]]:
+        """Get the URLs in the input order, None for the missing ones."""
+
+    async def create_short_url(
+        self,
+        url: str,
+        labels: Optional[Dict[str, str]] = None,
+        expires_at: Optional[int] = None,
+    ) -> Optional[str]:
+        """Create the ShortURL, None if no free ID was allocated."""
+
+    async def create_short_urls(
+        self,
+        urls: List[str],
+        labels: Optional[Dict[str, str]] = None,
+        expires_at: Optional[int] = None,
+    ) -> List[Optional[str]]:
+        """Create the ShortURLs, None for the items failed to be written."""
+
+    async def update_short_url(
+        self, url: str, url_id: str, expires_at: Optional[int] = None
+    ) -> Optional[str]:
+        """Update the existing ShortURL, the expiry is kept if it's not set."""
+
+    async def delete_short_url(self, url_id: str) -> Optional[str]:
+        """Delete the ShortURL and its stats, None if it's not found."""
+
+    async def update_view_counts(self, batches: List[ViewCounts]):
+        """Add the batches of the view counts."""
+
+    async def get_view_count(
+        self, url_id: str, interval: int = settings.stats_period
+    ) -> Optional[int]:
+        """Get the views for the last interval, None if the URL is not found."""
+
+    async def get_view_counts(
+        self,
+        url_ids: Optional[List[str]] = None,
+        labels: Optional[Dict[str, str]] = None,
+        interval: int = settings.stats_period,
+    ) -> Dict[str, int]:
+        """Get the views for the last interval of the URLs matching the query."""
+
+
+def make_backend(name: str) -> StorageBackend:
+    """Make the storage backend.
+
+    Args:
+        name (str): The backend name: 'redis' or 'embedded'.
+
+    Returns:
+        StorageBackend: The backend.
+
+    Raises:
+        ValueError: if the backend name is unknown.
+    """
+    if name == 'redis':
+        return model
+    if name == 'embedded':
+        return EmbeddedStorage(
+            log_path=settings.embedded_log_path,
+            snapshot_path=settings.embedded_snapshot_path,
+            snapshot_every=settings.embedded_snapshot_every,
+            views_flush_interval=settings.embedded_views_flush_interval,
+        )
+    raise ValueError(f'Unknown storage backend: {name}')
+
+
+backend = make_backend(settings.storage_backend)
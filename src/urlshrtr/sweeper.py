@@ -0,0 +1,62 @@
+"""Periodic background cleanup of the stale records."""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+
+from urlshrtr.config import logger
+
+
+class Sweeper:
+    """A periodic background sweep, e.g. of the stats series or expired links.
+
+    The sweep coroutine does one pass over the keyspace and returns
+    the number of the deleted records. A failed pass is logged and retried
+    on the next interval.
+    """
+
+    def __init__(self, sweep: Callable[[], Awaitable[int]], interval: float, name: str):
+        """Init the sweeper.
+
+        Args:
+            sweep: Coroutine function deleting the stale records.
+            interval (float): Time in seconds between the sweeps.
+            name (str): The sweeper name for the logs.
+        """
+        self.sweep = sweep
+        self.interval = interval
+        self.name = name
+        self.sweeps = 0
+        self.swept = 0
+        self.failed = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self):
+        """Run the sweep on the interval."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.swept += await self.sweep()
+                self.sweeps += 1
+            except Exception:
+                self.failed += 1
+                logger.exception(f'{self.name} sweep error')
+
+    def start(self):
+        """Start the background sweep task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stop the background sweep task."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        """Get the sweeper counters.
+
+        Returns:
+            dict: The completed and failed sweeps and the deleted records.
+        """
+        return dict(sweeps=self.sweeps, swept=self.swept, failed=self.failed)